@@ -2,7 +2,15 @@ import tkinter as tk
 from tkinter import filedialog, ttk
 from PIL import Image, ImageTk
 from transformers import pipeline
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+import os
 import threading
+from models.dedup import default_dedup, fingerprint
+from models.image_cache import default_image_cache
+from models.jobs import INTERACTIVE, JobQueue, UiPump
+from models.pool import ModelPool
+from models.profiling import default_profiler
 
 # Base class demonstrating inheritance and encapsulation
 class AIModel:
@@ -15,13 +23,42 @@ class AIModel:
     def load_model(self):
         """Load the model pipeline"""
         print(f"Loading {self._model_name}...")
-        self._pipeline = pipeline(self._task, model=self._model_name)
+        runtime = "onnx" if os.getenv("HF_IMAGE_RUNTIME") == "onnx" else "torch"
+        if int(os.getenv("HF_PROC_WORKERS", "0")) > 0:
+            # N worker processes, each with its own copy of the model (HF_PROC_THREADS threads each)
+            from models.procpool import ProcessPipelinePool
+            self._pipeline = ProcessPipelinePool(self._model_name, self._task, runtime=runtime)
+        elif runtime == "onnx":
+            # int8 ONNX Runtime instead of PyTorch (exported on first use), same call signature
+            from models.onnx_backend import shared_classifier
+            self._pipeline = shared_classifier(self._model_name)
+        else:
+            self._pipeline = pipeline(self._task, model=self._model_name)
         print("Model loaded successfully!")
     
-    def predict(self, image_path):
+    def unload(self):
+        """Free the pipeline (the model pool calls this), load_model() brings it back"""
+        pipe, self._pipeline = self._pipeline, None
+        if pipe is None:
+            return  # already unloaded, nothing of ours to give back
+        if hasattr(pipe, "close"):
+            pipe.close()  # worker processes
+        elif os.getenv("HF_IMAGE_RUNTIME") == "onnx":
+            from models.onnx_backend import release
+            release(self._model_name)
+    
+    def predict(self, image_path, top_k=5):
         """Method to be overridden - demonstrates polymorphism"""
         raise NotImplementedError("Subclasses must implement predict()")
     
+    @staticmethod
+    def _open_image(image):
+        """Accepts a file path or an already decoded PIL image (so it is only decoded once)"""
+        if isinstance(image, Image.Image):
+            return image
+        # shared with display_image: the same file (same mtime + size) is only read and decoded once
+        return default_image_cache().rgb(image)
+    
     def get_model_info(self):
         """Returns model information"""
         return f"Model: {self._model_name}\nTask: {self._task}"
@@ -33,10 +70,10 @@ class ImageClassifierModel1(AIModel):
     def __init__(self):
         super().__init__("google/vit-base-patch16-224", "image-classification")
     
-    def predict(self, image_path):
+    def predict(self, image_path, top_k=5):
         """Override predict method - demonstrates method overriding"""
-        image = Image.open(image_path)
-        results = self._pipeline(image)
+        image = self._open_image(image_path)
+        results = self._pipeline(image, top_k=top_k)
         return results
 
 
@@ -46,10 +83,10 @@ class ImageClassifierModel2(AIModel):
     def __init__(self):
         super().__init__("microsoft/resnet-50", "image-classification")
     
-    def predict(self, image_path):
+    def predict(self, image_path, top_k=5):
         """Override predict method - demonstrates method overriding"""
-        image = Image.open(image_path)
-        results = self._pipeline(image)
+        image = self._open_image(image_path)
+        results = self._pipeline(image, top_k=top_k)
         return results
 
 
@@ -58,16 +95,152 @@ class ModelDecorator:
     """Decorator to add extra functionality - demonstrates decorator pattern"""
     def __init__(self, model):
         self._model = model
+        self._dedup = None
+    
+    def set_dedup(self, index):
+        """Near-duplicate index (models/dedup.py): lookalike pictures reuse the earlier answer"""
+        self._dedup = index
     
-    def predict(self, image_path):
+    def predict(self, image_path, top_k=5):
         """Wraps prediction with additional processing"""
         print("Preprocessing image...")
-        result = self._model.predict(image_path)
+        image = AIModel._open_image(image_path)
+        fp = None
+        if self._dedup is not None:
+            fp = fingerprint(image)  # None = too plain to compare safely, always ask the model
+            hit = self._dedup.lookup(*fp) if fp is not None else None
+            if hit is not None and hit[0][0] >= top_k:
+                (_, results), distance = hit
+                print(f"Near duplicate ({distance} bits off), skipping the model")
+                return NearDuplicateResult(results[:top_k], distance)
+        result = self._model.predict(image, top_k=top_k)
+        if fp is not None:
+            self._dedup.add(fp[0], (top_k, result), fp[1])
         print("Postprocessing results...")
         return result
     
     def get_model_info(self):
         return self._model.get_model_info()
+    
+    def unload(self):
+        self._model.unload()
+
+
+class NearDuplicateResult(list):
+    """Results reused from a lookalike picture, remembers how different it was"""
+    def __init__(self, results, distance):
+        super().__init__(results)
+        self.distance = distance
+
+
+# Composite model - runs several models on the same image at the same time
+class EnsembleModel:
+    """Merges the predictions of several models - demonstrates composition"""
+    METHODS = ("average", "rank")
+    RRF_K = 60  # standard constant for reciprocal rank fusion
+    MAX_WORKERS = 4  # shared by every ensemble, enough for two 2-model runs at once
+    _pool = None  # class attribute: one thread pool for all instances, made on first use
+    _pool_lock = threading.Lock()
+    
+    def __init__(self, models, method="average"):
+        if method not in self.METHODS:
+            raise ValueError(f"method must be one of {self.METHODS}")
+        self._models = list(models)
+        self._method = method
+    
+    @classmethod
+    def _executor(cls):
+        """The models run at the same time (total time ~ the slowest model); re-making an
+        ensemble (picking another model) reuses these threads instead of leaking new ones"""
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = ThreadPoolExecutor(max_workers=cls.MAX_WORKERS, thread_name_prefix="ensemble")
+            return cls._pool
+    
+    def predict(self, image_path, top_k=5):
+        """Decodes the image once, runs every model in parallel, merges the top-k"""
+        image = AIModel._open_image(image_path).convert("RGB")
+        image.load()
+        # each model gets its own copy of the pixels, copying is much cheaper than decoding
+        futures = [self._executor().submit(m.predict, image.copy(), top_k * 2) for m in self._models]
+        per_model = [f.result() for f in futures]
+        if self._method == "rank":
+            return self._rank_fusion(per_model, top_k)
+        return self._average(per_model, top_k)
+    
+    @staticmethod
+    def _key(label):
+        """ViT and ResNet both use ImageNet labels, but spacing/case can differ"""
+        return label.strip().lower()
+    
+    def _average(self, per_model, top_k):
+        """Mean score per label (a label a model didn't return counts as 0)"""
+        totals, names = {}, {}
+        for results in per_model:
+            for r in results:
+                k = self._key(r["label"])
+                totals[k] = totals.get(k, 0.0) + r["score"]
+                names.setdefault(k, r["label"])
+        merged = [{"label": names[k], "score": v / len(per_model)} for k, v in totals.items()]
+        return sorted(merged, key=lambda r: r["score"], reverse=True)[:top_k]
+    
+    def _rank_fusion(self, per_model, top_k):
+        """Reciprocal rank fusion - only the order matters, not how confident each model is"""
+        fused, names = {}, {}
+        for results in per_model:
+            ranked = sorted(results, key=lambda r: r["score"], reverse=True)
+            for rank, r in enumerate(ranked, 1):
+                k = self._key(r["label"])
+                fused[k] = fused.get(k, 0.0) + 1.0 / (self.RRF_K + rank)
+                names.setdefault(k, r["label"])
+        # scale so the best possible fused score (rank 1 everywhere) is 1.0
+        best = len(per_model) / (self.RRF_K + 1)
+        merged = [{"label": names[k], "score": v / best} for k, v in fused.items()]
+        return sorted(merged, key=lambda r: r["score"], reverse=True)[:top_k]
+    
+    def get_model_info(self):
+        info = "\n".join(m.get_model_info() for m in self._models)
+        return f"Ensemble ({self._method}):\n{info}"
+
+
+# Composite model - cheap model first, the expensive one only when it is needed
+class CascadeModel:
+    """Asks the fast model first and the slow one only when unsure - demonstrates composition"""
+    def __init__(self, fast, slow, min_score=0.5, min_margin=0.2):
+        self._fast = fast
+        self._slow = slow
+        self._min_score = min_score    # top-1 below this -> escalate
+        self._min_margin = min_margin  # top-1 minus top-2 below this -> escalate
+        self._models = [fast, slow]
+    
+    @staticmethod
+    def confidence(results):
+        """Top-1 score and the gap to the top-2 score"""
+        scores = sorted((r["score"] for r in results), reverse=True) or [0.0]
+        return scores[0], scores[0] - (scores[1] if len(scores) > 1 else 0.0)
+    
+    def predict(self, image_path, top_k=5):
+        """Returns the results with a .path attribute ("fast" or "escalated")"""
+        image = AIModel._open_image(image_path)
+        results = self._fast.predict(image, top_k=max(top_k, 2))  # need 2 for the margin
+        score, margin = self.confidence(results)
+        path = "fast"
+        if score < self._min_score or margin < self._min_margin:
+            results = self._slow.predict(image, top_k=top_k)
+            path = "escalated"
+        return CascadeResult(results[:top_k], path, score)
+    
+    def get_model_info(self):
+        return (f"Cascade (escalates below {self._min_score:.0%} or a {self._min_margin:.0%} margin):\n"
+                f"{self._fast.get_model_info()}\n{self._slow.get_model_info()}")
+
+
+class CascadeResult(list):
+    """A normal results list that also remembers which way the cascade went"""
+    def __init__(self, results, path, fast_score):
+        super().__init__(results)
+        self.path = path
+        self.fast_score = fast_score
 
 
 # Main GUI Application
@@ -78,15 +251,23 @@ class ImageClassifierGUI:
         self.root.title("AI Image Classifier - OOP Demo")
         self.root.geometry("900x700")
         
-        # Initialize models (lazy loading)
-        self.models = {
-            "Google ViT": None,
-            "Microsoft ResNet": None
-        }
+        # Models are loaded lazily into a memory-budgeted pool (HF_MODEL_BUDGET_MB),
+        # least recently used ones get unloaded and come back on demand
+        self.model_pool = ModelPool(self.load_model_by_name)
+        self.ensemble = None
+        self.cascade = None
+        self.dedups = {}  # model name -> near-duplicate index (survives the model being unloaded)
         self.current_image_path = None
         self.current_photo = None
         
+        # Long-lived worker threads + a job queue (instead of a new thread per click)
+        self.jobs = JobQueue(workers=2, name="classify")
+        
         self.create_widgets()
+        # One after() loop brings results back to the GUI thread
+        self.pump = UiPump(self.root, self.jobs, on_tick=self.update_status, on_event=self.update_job).start()
+        # Preload the selected model in the background so the first click is quick
+        self.model_pool.preload([self.model_var.get()], jobs=self.jobs)
     
     def create_widgets(self):
         """Create all GUI widgets"""
@@ -100,7 +281,7 @@ class ImageClassifierGUI:
         model_frame.pack(padx=20, pady=10, fill="x")
         
         self.model_var = tk.StringVar(value="Google ViT")
-        model_options = ["Google ViT", "Microsoft ResNet"]
+        model_options = ["Google ViT", "Microsoft ResNet", "Ensemble (ViT + ResNet)", "Cascade (ResNet, ViT if unsure)"]
         
         for option in model_options:
             rb = tk.Radiobutton(model_frame, text=option, variable=self.model_var, 
@@ -127,6 +308,15 @@ class ImageClassifierGUI:
                                 bg="#2196F3", fg="white", padx=20, pady=10)
         classify_btn.pack(pady=10)
         
+        # Queue status + cancel
+        status_frame = tk.Frame(self.root)
+        status_frame.pack()
+        self.status_label = tk.Label(status_frame, text="Queue: empty", font=("Arial", 10))
+        self.status_label.pack(side="left", padx=5)
+        tk.Button(status_frame, text="Cancel all", command=self.jobs.cancel_all).pack(side="left")
+        tk.Button(status_frame, text="Profile next run", command=self.profile_next_run).pack(side="left", padx=5)
+        self.last_job = ""
+        
         # Results display
         results_frame = tk.LabelFrame(self.root, text="Classification Results", 
                                      padx=10, pady=10)
@@ -180,6 +370,9 @@ class ImageClassifierGUI:
   connections for efficient and fast 
   classification.
   
+  Ensemble mode runs both models at the 
+  same time and averages their scores.
+  
 • Input: Image files (JPG, PNG, BMP)
 • Output: Top 5 predictions with confidence
 """
@@ -198,13 +391,13 @@ class ImageClassifierGUI:
         oop_explanation = """• Where Multiple Inheritance is used:
   - ImageClassifierModel1 and 
     ImageClassifierModel2 both inherit from 
-    the AIModel base class (lines 10-23)
+    the AIModel base class (lines 16-64)
   - They will assume load_model() and 
     get_model_info() methods
 
 • Why Encapsulation was applied:
   - Private attributes (_model_name, 
-    _pipeline) hide internal data (line 12-13)
+    _pipeline) hide internal data (line 19-21)
   - The data can only be accessed through public 
     methods, preventing immediate manipulation
   - This shields model stability and makes 
@@ -213,19 +406,19 @@ class ImageClassifierGUI:
 • How Polymorphism and Method Overriding 
   are shown:
   - predict() method is defined in parent 
-    AIModel class (line 21-23)
+    AIModel class (line 50-52)
   - Each sub class overrides predict() 
-    with self implementation (lines 31, 41)
+    with self implementation (lines 73, 86)
   - Same method name, different behaviors - 
     this is polymorphism in action
 
 • Where Multiple Decorators are applied:
   - ModelDecorator class wraps any model 
-    (line 46-59)
+    (line 94-126)
   - Adds preprocessing/postprocessing without 
     changing original model classes
-  - Applied in run_classification() method 
-    (line 177) when wrapping models
+  - Applied in load_model_by_name() method 
+    (line 560) when wrapping models
 """
         oop_text.insert("1.0", oop_explanation)
         oop_text.config(state="disabled")
@@ -243,9 +436,8 @@ class ImageClassifierGUI:
     
     def display_image(self, image_path):
         """Display uploaded image in GUI"""
-        image = Image.open(image_path)
-        # Resize to fit display
-        image.thumbnail((400, 300))
+        # Resized to fit display, kept in the image cache next to the full decode
+        image = default_image_cache().thumbnail(image_path, (400, 300))
         photo = ImageTk.PhotoImage(image)
         
         self.image_label.config(image=photo, text="")
@@ -260,46 +452,116 @@ class ImageClassifierGUI:
         
         selected_model = self.model_var.get()
         
+        image_path = self.current_image_path
+        
         # Show loading message
         self.results_text.delete("1.0", tk.END)
         self.results_text.insert("1.0", f"Loading {selected_model} model and classifying...\nThis may take a moment...")
-        self.root.update()
         
-        # Run in thread to prevent GUI freezing
-        thread = threading.Thread(target=self.run_classification, args=(selected_model,))
-        thread.start()
-    
-    def run_classification(self, selected_model):
-        """Run classification in separate thread"""
-        try:
-            # Load model if not already loaded (lazy loading)
-            if self.models[selected_model] is None:
-                if selected_model == "Google ViT":
-                    model = ImageClassifierModel1()
-                else:
-                    model = ImageClassifierModel2()
-                
-                model.load_model()
-                # Wrap with decorator
-                self.models[selected_model] = ModelDecorator(model)
-            
-            # Get prediction
-            model = self.models[selected_model]
-            results = model.predict(self.current_image_path)
-            
-            # Format results
-            output = f"Results from {selected_model}:\n\n"
-            for i, result in enumerate(results[:5], 1):  # Top 5 results
-                label = result['label']
-                score = result['score'] * 100
-                output += f"{i}. {label}: {score:.2f}%\n"
-            
-            # Update GUI (must be done in main thread)
-            self.root.after(0, self.update_results, output)
-            
-        except Exception as e:
-            error_msg = f"Error: {str(e)}"
-            self.root.after(0, self.update_results, error_msg)
+        # Queue it - a worker runs it, the GUI stays responsive and more clicks just queue up
+        self.jobs.submit(lambda job: self.run_classification(selected_model, image_path, job),
+                         name=selected_model, on_done=self.show_result)
+    
+    def run_classification(self, selected_model, image_path, job=None):
+        """Run classification on a worker thread, returns the text to show"""
+        # Get prediction (models are loaded lazily the first time)
+        if job is not None:
+            job.report(0.1, "loading model")
+        with self.use_model(selected_model) as model:
+            if job is not None:
+                job.report(0.5, "classifying")
+            # only does something once "Profile next run" was pressed
+            with default_profiler().capture(f"image-{selected_model}") as profile:
+                results = model.predict(image_path)
+        
+        # Format results
+        output = f"Results from {selected_model}:\n\n"
+        for i, result in enumerate(results[:5], 1):  # Top 5 results
+            label = result['label']
+            score = result['score'] * 100
+            output += f"{i}. {label}: {score:.2f}%\n"
+        if getattr(results, "distance", None) is not None:
+            output += f"\n(Looks like a picture already classified, {results.distance} bits different - model skipped)"
+        if getattr(results, "path", None) == "escalated":
+            output += f"\n(ResNet was only {results.fast_score:.0%} sure, so ViT answered)"
+        elif getattr(results, "path", None) == "fast":
+            output += f"\n(ResNet was {results.fast_score:.0%} sure, ViT skipped)"
+        if profile:
+            output += f"\n(Profile saved: {profile[0]} and {os.path.basename(profile[1])})"
+        return output
+    
+    def profile_next_run(self):
+        """Arm the profiler: the next classification gets a cProfile + tracemalloc report"""
+        profiler = default_profiler().arm(1)
+        self.update_results(f"Profiling the next {profiler.pending} run(s), reports go to {profiler.out_dir}")
+    
+    def show_result(self, job):
+        """Called on the GUI thread when a job finishes"""
+        if job.error is not None:
+            self.update_results(f"Error: {str(job.error)}")
+        elif job.state == "cancelled":
+            self.update_results(f"{job.name} was cancelled")
+        else:
+            self.update_results(job.result)
+    
+    def update_job(self, job, kind):
+        """Progress of the most recent job"""
+        self.last_job = f"{job.name}: {job.state} {job.progress:.0%} {job.message}".strip()
+    
+    def update_status(self, stats):
+        """Queue depth, refreshed by the pump"""
+        text = f"Queue: {stats['queued']} waiting, {stats['running']} running | {self.last_job}"
+        if self.status_label.cget("text") != text:
+            self.status_label.config(text=text)
+    
+    @contextmanager
+    def use_model(self, name):
+        """Borrow a model from the pool (lazy loading); it can't be unloaded while in use"""
+        with ExitStack() as stack:
+            if name == "Ensemble (ViT + ResNet)":
+                halves = ["Google ViT", "Microsoft ResNet"]
+                # load both halves at the same time, then combine them
+                self.warm_halves(halves)
+                parts = [stack.enter_context(self.model_pool.use(n)) for n in halves]
+                if self.ensemble is None or self.ensemble._models != parts:
+                    self.ensemble = EnsembleModel(parts, method="average")
+                yield self.ensemble
+            elif name == "Cascade (ResNet, ViT if unsure)":
+                halves = ["Microsoft ResNet", "Google ViT"]
+                self.warm_halves(halves)
+                parts = [stack.enter_context(self.model_pool.use(n)) for n in halves]
+                if self.cascade is None or self.cascade._models != parts:
+                    self.cascade = CascadeModel(*parts)
+                yield self.cascade
+            else:
+                yield stack.enter_context(self.model_pool.use(name))
+    
+    def warm_halves(self, halves):
+        """Load the halves of a combined model at the same time, without starting new threads"""
+        # the others go on the job queue, the first one loads right here. warming them again
+        # afterwards just waits for a load that's still going (the pool loads each model once),
+        # and does it here if every worker was busy, so we never wait on a job that can't start
+        for name in halves[1:]:
+            if name not in self.model_pool:
+                self.jobs.submit(lambda job, n=name: self.model_pool.warm(n), name=f"load {name}",
+                                 priority=INTERACTIVE)
+        for name in halves:
+            self.model_pool.warm(name)
+    
+    def load_model_by_name(self, name):
+        """Called by the pool when a model isn't loaded (or was unloaded)"""
+        if name == "Google ViT":
+            model = ImageClassifierModel1()
+        else:
+            model = ImageClassifierModel2()
+        
+        model.load_model()
+        # Wrap with decorator
+        decorated = ModelDecorator(model)
+        if name not in self.dedups:
+            self.dedups[name] = default_dedup()
+        decorated.set_dedup(self.dedups[name])
+        return decorated
     
     def update_results(self, text):
         """Update results text (called from main thread)"""
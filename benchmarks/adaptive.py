@@ -0,0 +1,71 @@
+# fixed concurrency vs the adaptive limiter against a stand-in api that throttles
+# (needs requests + huggingface_hub, no token, no internet):
+#   python -m benchmarks.adaptive --n 400 --threads 64 --capacity 16 --retry-after 0.5
+# "fixed" = every thread fires straight away (HF_ADAPTIVE=0, how it was), "adaptive" = the same
+# threads but the limiter decides how many are really in flight.
+import argparse, json, os, time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.standin import StandinConfig, start
+from models.limiter import reset_shared_limiter, shared_limiter
+from models.metrics import Metrics, nearest_rank
+from models.text_sentiment import TextSentimentModel
+
+
+def _scenario(args, adaptive):
+    srv, cfg = start(0, StandinConfig(args.latency_ms, 5.0, capacity=args.capacity,
+                                      retry_after=args.retry_after, loading_s=args.loading_s))
+    os.environ["HF_INFERENCE_ENDPOINT"] = f"http://127.0.0.1:{srv.server_address[1]}"
+    os.environ["HF_ADAPTIVE"] = "1" if adaptive else "0"
+    os.environ["HF_WARMUP"] = "0"
+    reset_shared_limiter()
+    m = TextSentimentModel().set_metrics(Metrics()).set_coalescing(None)
+    m.load()
+    lat, errors = [], 0
+    def one(i):
+        t0 = time.perf_counter()
+        try:
+            m.run(f"text number {i}")
+            return (time.perf_counter() - t0) * 1000, None
+        except Exception as e:
+            return (time.perf_counter() - t0) * 1000, e
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        for ms, err in pool.map(one, range(args.n)):
+            if err is None:
+                lat.append(ms)
+            else:
+                errors += 1
+    wall = time.perf_counter() - t0
+    srv.shutdown()
+    lat.sort()
+    out = {"ok_per_s": round(len(lat) / wall, 2), "errors": errors, "server": cfg.stats()}
+    for q in (0.5, 0.95, 0.99):
+        out[f"p{int(q * 100)}_ms"] = round(nearest_rank(lat, q), 2) if lat else None
+    if adaptive:
+        out["limiter"] = shared_limiter().stats()
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="fixed concurrency vs adaptive limiter against a throttling api")
+    ap.add_argument("--n", type=int, default=400)
+    ap.add_argument("--threads", type=int, default=64, help="callers at once (the gui / cli side)")
+    ap.add_argument("--capacity", type=int, default=16, help="stand-in answers 429 past this many at once")
+    ap.add_argument("--retry-after", type=float, default=0.5)
+    ap.add_argument("--loading-s", type=float, default=0.0, help="503 model loading for the first n seconds")
+    ap.add_argument("--latency-ms", type=float, default=40.0)
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+    os.environ.setdefault("HF_TOKEN", "standin")
+
+    report = {"args": vars(args), "fixed": _scenario(args, False), "adaptive": _scenario(args, True)}
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# resnet-first cascade vs always asking the vit: average cost per picture and how often the
+# cascade's top-1 is the same as the vit's.
+#   python -m benchmarks.cascade --tiny                          # random tiny models, no downloads
+#   python -m benchmarks.cascade --images ./pics --n 200 --out cascade.json
+# both models look at every picture once (timed), then every threshold pair in the grid is
+# worked out from those answers, and the default one is also run for real through CascadeModel.
+# (random tiny models are never sure of anything, so with --tiny nearly everything escalates)
+import argparse, json, statistics, tempfile, time
+from io import BytesIO
+
+from benchmarks.onnx_vs_torch import load_images, make_tiny
+
+SCORES = (0.3, 0.4, 0.5, 0.6, 0.7, 0.8)
+MARGINS = (0.0, 0.1, 0.2, 0.3)
+
+
+def _png(im):
+    buf = BytesIO()
+    im.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _top1(raw):
+    return max(raw, key=lambda r: r["score"])["label"]
+
+
+def _answers(model, payloads):
+    # (raw answer, ms) per picture, one call at a time like the gui does
+    model._predict(payloads[0])  # warm up
+    out = []
+    for p in payloads:
+        t0 = time.perf_counter()
+        raw = model._predict(p)
+        out.append((raw, (time.perf_counter() - t0) * 1000))
+    return out
+
+
+def sweep(fast, slow):
+    # what each threshold pair would have cost, from answers we already have
+    from models.cascade import confidence
+    slow_ms = statistics.fmean(ms for _, ms in slow)
+    rows = []
+    for s in SCORES:
+        for m in MARGINS:
+            cost, same, up = 0.0, 0, 0
+            for (fr, fms), (sr, sms) in zip(fast, slow):
+                score, margin = confidence(fr)
+                escalate = score < s or margin < m
+                cost += fms + (sms if escalate else 0.0)
+                up += escalate
+                same += _top1(sr if escalate else fr) == _top1(sr)
+            n = len(fast)
+            rows.append({"min_score": s, "min_margin": m, "escalation_rate": round(up / n, 3),
+                         "avg_ms": round(cost / n, 2), "saving_vs_vit": round(1 - cost / n / slow_ms, 3),
+                         "agrees_with_vit": round(same / n, 3)})
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="resnet -> vit cascade vs always vit")
+    ap.add_argument("--tiny", action="store_true", help="random tiny vit + resnet instead of the real ones (offline)")
+    ap.add_argument("--fast", default="microsoft/resnet-50")
+    ap.add_argument("--slow", default="google/vit-base-patch16-224")
+    ap.add_argument("--backend", default="local", help="local, onnx, hosted, ...")
+    ap.add_argument("--min-score", type=float, default=None)
+    ap.add_argument("--min-margin", type=float, default=None)
+    ap.add_argument("--n", type=int, default=64)
+    ap.add_argument("--images", help="folder of pictures (default: generated ones)")
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    from models.cascade import CascadeModel
+    payloads = [_png(im) for im in load_images(args.images, args.n)]
+    with tempfile.TemporaryDirectory() as tmp:
+        fast_id, slow_id = (make_tiny(tmp)[::-1]) if args.tiny else (args.fast, args.slow)
+        cascade = CascadeModel(fast_id, slow_id, backend=args.backend,
+                               min_score=args.min_score, min_margin=args.min_margin)
+        cascade.load()
+        try:
+            processed = [cascade._preprocess(p) for p in payloads]
+            fast = _answers(cascade._fast, processed)
+            slow = _answers(cascade._slow, processed)
+            # the real thing at the chosen thresholds
+            real = _answers(cascade, processed)
+        finally:
+            cascade.unload()
+
+    vit_ms = statistics.fmean(ms for _, ms in slow)
+    real_ms = statistics.fmean(ms for _, ms in real)
+    report = {
+        "args": vars(args),
+        "fast_ms_avg": round(statistics.fmean(ms for _, ms in fast), 2),
+        "slow_ms_avg": round(vit_ms, 2),
+        "cascade": {"min_score": cascade.min_score, "min_margin": cascade.min_margin,
+                    "escalation_rate": round(sum(r["path"] == "escalated" for r, _ in real) / len(real), 3),
+                    "avg_ms": round(real_ms, 2), "saving_vs_vit": round(1 - real_ms / vit_ms, 3),
+                    "agrees_with_vit": round(sum(_top1(r["predictions"]) == _top1(s) for (r, _), (s, _)
+                                                 in zip(real, slow)) / len(real), 3)},
+        "sweep": sweep(fast, slow),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
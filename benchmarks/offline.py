@@ -0,0 +1,161 @@
+# offline benchmark. no token, no network: the models talk to benchmarks/simulated.py.
+#   python -m benchmarks.offline --n 200 --latency-ms 40 --out bench.json
+#   python -m benchmarks.offline --out new.json --compare bench.json   # spot regressions
+# it drives the real model classes (preprocess, cache/coalescing, postprocess all included),
+# only the network call is fake.
+import argparse, asyncio, json, os, platform, random, resource, statistics, sys, tempfile, time, tracemalloc
+
+from benchmarks.simulated import SimConfig, install
+from models.image_classification import ImageClassificationModel
+from models.metrics import Metrics, nearest_rank
+from models.singleflight import SingleFlight
+from models.text_sentiment import TextSentimentModel
+
+WORDS = ("the movie was great awful boring fun plot actors slow fast loved hated ending music "
+         "really not very quite honestly story scene camera would watch again never").split()
+
+
+def make_texts(n, rng, min_words=5, max_words=120):
+    # unique-ish sentences so the cache/coalescing doesn't make it look faster than it is
+    return [f"{i} " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))) for i in range(n)]
+
+
+def make_images(n, size, folder, rng):
+    from PIL import Image
+    paths = []
+    for i in range(n):
+        # gradient + noise, compresses a bit like a real photo
+        w, h = size, int(size * 0.75)
+        im = Image.linear_gradient("L").resize((w, h)).convert("RGB")
+        noise = Image.effect_noise((w, h), rng.uniform(10, 60)).convert("RGB")
+        im = Image.blend(im, noise, 0.5)
+        p = os.path.join(folder, f"img_{size}_{i}.jpg")
+        im.save(p, quality=90)
+        paths.append(p)
+    return paths
+
+
+def _lat_summary(xs):
+    xs = sorted(x for x in xs if x is not None)
+    if not xs:
+        return None
+    return {"p50_ms": round(nearest_rank(xs, 0.5), 2), "p95_ms": round(nearest_rank(xs, 0.95), 2),
+            "p99_ms": round(nearest_rank(xs, 0.99), 2), "mean_ms": round(statistics.fmean(xs), 2)}
+
+
+def run_scenario(name, model, inputs, path, concurrency):
+    m = Metrics()
+    model.set_metrics(m).set_coalescing(SingleFlight())
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    if path == "run":
+        results = []
+        for x in inputs:
+            try:
+                results.append(model.run(x))
+            except Exception as e:
+                results.append(model._error_result(e))
+    elif path == "batch":
+        results = model.run_batch(inputs, max_in_flight=concurrency)
+    elif path == "async":
+        async def go():
+            try:
+                return await model.arun_many(inputs, concurrency=concurrency)
+            finally:
+                await model.aclose()
+        results = asyncio.run(go())
+    else:
+        raise ValueError(path)
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stages = m.snapshot()["models"].get(model.model_id, {}).get("stages", {})
+    errors = sum(1 for r in results if "error" in r)
+    return {
+        "scenario": name,
+        "path": path,
+        "items": len(inputs),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(len(inputs) / wall, 2) if wall else None,
+        "latency": _lat_summary([r.get("latency_ms") for r in results]),
+        "preprocess": stages.get("preprocess"),
+        "peak_traced_mb": round(peak / 2**20, 2),
+    }
+
+
+def compare(new, old):
+    # prints throughput and p95 change per scenario
+    before = {(r["scenario"], r["path"]): r for r in old["results"]}
+    print("\nvs baseline:")
+    for r in new["results"]:
+        o = before.get((r["scenario"], r["path"]))
+        if not o or not o.get("throughput_per_s"):
+            continue
+        d_tp = (r["throughput_per_s"] - o["throughput_per_s"]) / o["throughput_per_s"] * 100
+        p95n = (r["latency"] or {}).get("p95_ms")
+        p95o = (o["latency"] or {}).get("p95_ms")
+        d95 = f"{(p95n - p95o) / p95o * 100:+.1f}%" if p95n and p95o else "n/a"
+        print(f"  {r['scenario']:<18} {r['path']:<6} throughput {d_tp:+.1f}%  p95 {d95}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="offline benchmark with a simulated InferenceClient")
+    ap.add_argument("--n", type=int, default=100, help="items per scenario")
+    ap.add_argument("--latency-ms", type=float, default=40.0)
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--image-sizes", default="128,512,1600", help="widths in px, comma separated")
+    ap.add_argument("--image-mode", default="passthrough", choices=ImageClassificationModel.MODES)
+    ap.add_argument("--paths", default="run,batch,async")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="save json here")
+    ap.add_argument("--compare", help="older json to compare against")
+    args = ap.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    install(SimConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.seed))
+    paths = [p.strip() for p in args.paths.split(",") if p.strip()]
+    results = []
+
+    texts = make_texts(args.n, rng)
+    for path in paths:
+        model = TextSentimentModel(backend="simulated")
+        model.load()
+        results.append(run_scenario("text", model, texts, path, args.concurrency))
+        print(json.dumps(results[-1]))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in [int(x) for x in args.image_sizes.split(",") if x.strip()]:
+            imgs = make_images(args.n, size, tmp, rng)
+            for path in paths:
+                model = ImageClassificationModel(mode=args.image_mode, backend="simulated")
+                model.load()
+                res = run_scenario(f"image_{size}px", model, imgs, path, args.concurrency)
+                res["prep_bytes"] = model.prep_stats.snapshot()
+                results.append(res)
+                print(json.dumps(results[-1]))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        # ru_maxrss is KB on linux, bytes on mac
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10), 1),
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return report
+
+
+if __name__ == "__main__":
+    main()
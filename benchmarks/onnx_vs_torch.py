@@ -0,0 +1,173 @@
+# pytorch pipeline vs onnx runtime (fp32 and int8) for the image classifiers:
+# latency, throughput, peak memory and how often the top-1 label agrees with pytorch.
+#   python -m benchmarks.onnx_vs_torch --tiny                       # random tiny vit + resnet, no downloads
+#   python -m benchmarks.onnx_vs_torch --images ./pics --out onnx.json   # the real models
+# every runtime runs in its own subprocess so the memory numbers don't bleed into each other.
+# needs torch + transformers + onnxruntime (+ onnx for the quantizer).
+import argparse, glob, json, os, subprocess, sys, tempfile, time
+
+from models.metrics import nearest_rank
+
+MODELS = ("google/vit-base-patch16-224", "microsoft/resnet-50")
+RUNTIMES = ("torch", "onnx-fp32", "onnx-int8")
+
+
+def make_tiny(root):
+    # same architectures, a few layers wide, random weights. saved like a hub checkout
+    import torch
+    from transformers import (ConvNextImageProcessor, ResNetConfig, ResNetForImageClassification,
+                              ViTConfig, ViTForImageClassification, ViTImageProcessor)
+    torch.manual_seed(0)
+    labels = {i: f"class_{i}" for i in range(10)}
+    vit = ViTForImageClassification(ViTConfig(hidden_size=64, num_hidden_layers=4, num_attention_heads=4,
+                                              intermediate_size=128, image_size=224, patch_size=16,
+                                              id2label=labels, label2id={v: k for k, v in labels.items()}))
+    resnet = ResNetForImageClassification(ResNetConfig(embedding_size=16, hidden_sizes=[16, 32, 64, 128],
+                                                       depths=[1, 1, 1, 1], id2label=labels,
+                                                       label2id={v: k for k, v in labels.items()}))
+    dirs = []
+    for name, model, proc in (("tiny-vit", vit, ViTImageProcessor(size={"height": 224, "width": 224})),
+                              ("tiny-resnet", resnet, ConvNextImageProcessor(size={"shortest_edge": 224}))):
+        d = os.path.join(root, name)
+        model.eval().save_pretrained(d)
+        proc.save_pretrained(d)
+        dirs.append(d)
+    return dirs
+
+
+def load_images(folder, n, seed=0):
+    from PIL import Image
+    if folder:
+        paths = sorted(p for ext in ("jpg", "jpeg", "png", "bmp") for p in glob.glob(os.path.join(folder, f"*.{ext}")))
+        return [Image.open(p).convert("RGB") for p in paths[:n]]
+    # no pictures given: smooth random colour blobs (pure noise makes every model shrug)
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(n):
+        small = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+        out.append(Image.fromarray(small).resize((320, 240), Image.BICUBIC))
+    return out
+
+
+def _rss_mb(field="VmHWM"):
+    # VmHWM = peak, VmRSS = right now
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource  # not on windows, but neither is /proc
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def worker(runtime, model_dir, args):
+    # runs in the subprocess: load, time single calls, time a batched call, report top-1s
+    images = load_images(args.images, args.n)
+    before = _rss_mb("VmRSS")
+    t0 = time.perf_counter()  # load time includes importing the runtime
+    if runtime == "torch":
+        import torch
+        from transformers import AutoImageProcessor, pipeline
+        torch.set_num_threads(args.threads)
+        clf = pipeline("image-classification", model=model_dir, device="cpu",
+                       image_processor=AutoImageProcessor.from_pretrained(model_dir, use_fast=False))
+    else:
+        from models.onnx_backend import OnnxImageClassifier
+        clf = OnnxImageClassifier(model_dir, quantized=runtime == "onnx-int8", threads=args.threads)
+    load_ms = (time.perf_counter() - t0) * 1000
+    for im in images[:2]:
+        clf(im, top_k=1)  # warm up
+    lat, top1 = [], []
+    for im in images:
+        t0 = time.perf_counter()
+        res = clf(im, top_k=1)
+        lat.append((time.perf_counter() - t0) * 1000)
+        top1.append(res[0]["label"])
+    t0 = time.perf_counter()
+    clf(images, top_k=1, batch_size=args.batch_size)
+    wall = time.perf_counter() - t0
+    lat.sort()
+    return {"load_ms": round(load_ms, 1), "p50_ms": round(nearest_rank(lat, 0.5), 2),
+            "p95_ms": round(nearest_rank(lat, 0.95), 2), "throughput_per_s": round(len(images) / wall, 2),
+            "peak_rss_mb": _rss_mb(), "runtime_rss_mb": round(_rss_mb() - before, 1), "top1": top1}
+
+
+def _spawn(runtime, model_dir, args):
+    cmd = [sys.executable, "-m", "benchmarks.onnx_vs_torch", "--worker", runtime, "--model-dir", model_dir,
+           "--n", str(args.n), "--threads", str(args.threads), "--batch-size", str(args.batch_size)]
+    if args.images:
+        cmd += ["--images", args.images]
+    out = subprocess.run(cmd, capture_output=True, text=True)
+    if out.returncode != 0:
+        return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"exit {out.returncode}"}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def compare(model_dir, args):
+    from models.onnx_backend import export
+    t0 = time.perf_counter()
+    onnx_dir = export(model_dir, os.path.join(args.work, os.path.basename(model_dir.rstrip("/")) + "-onnx"))
+    report = {"export_ms": round((time.perf_counter() - t0) * 1000, 1),
+              "onnx_mb": {f: round(os.path.getsize(os.path.join(onnx_dir, f)) / 2**20, 2)
+                          for f in ("model.onnx", "model.int8.onnx")}}
+    runs = {"torch": _spawn("torch", model_dir, args)}
+    for rt in RUNTIMES[1:]:
+        runs[rt] = _spawn(rt, onnx_dir, args)
+    ref = runs["torch"].get("top1")
+    for rt, r in runs.items():
+        top1 = r.pop("top1", None)
+        if ref and top1 and rt != "torch":
+            r["top1_agreement"] = round(sum(a == b for a, b in zip(ref, top1)) / len(ref), 3)
+            r["p50_speedup"] = round(runs["torch"]["p50_ms"] / r["p50_ms"], 2) if r["p50_ms"] else None
+    report.update(runs)
+    return report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="pytorch vs onnx runtime (fp32/int8) for the image models")
+    ap.add_argument("--tiny", action="store_true", help="random tiny configs instead of the real models (offline)")
+    ap.add_argument("--models", nargs="*", default=list(MODELS), help="hub ids or local folders")
+    ap.add_argument("--images", help="folder of pictures (default: generated ones)")
+    ap.add_argument("--n", type=int, default=32)
+    ap.add_argument("--batch-size", type=int, default=8)
+    ap.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--work", help="where exports go (default: a temp dir)")
+    ap.add_argument("--out")
+    ap.add_argument("--worker", choices=RUNTIMES, help=argparse.SUPPRESS)
+    ap.add_argument("--model-dir", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.model_dir, args)))
+        return None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        args.work = args.work or tmp
+        models = make_tiny(args.work) if args.tiny else args.models
+        report = {"args": {k: v for k, v in vars(args).items() if k not in ("worker", "model_dir")}}
+        if not args.tiny:
+            # real hub models: save a local copy once so every subprocess loads the same files
+            from transformers import AutoImageProcessor, AutoModelForImageClassification
+            local = []
+            for m in models:
+                d = os.path.join(args.work, m.replace("/", "__"))
+                if not os.path.isdir(d):
+                    AutoModelForImageClassification.from_pretrained(m).save_pretrained(d)
+                    AutoImageProcessor.from_pretrained(m, use_fast=False).save_pretrained(d)
+                local.append(d)
+            models = local
+        for d in models:
+            report[os.path.basename(d)] = compare(d, args)
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# one in-process pipeline vs N worker processes (shared-memory pictures), images/second:
+#   python -m benchmarks.procpool --tiny --workers 1 2 4 --threads 1
+#   python -m benchmarks.procpool --model microsoft/resnet-50 --workers 2 4 --threads 2 --n 128
+# on a big box try workers x threads = cores.
+import argparse, json, os, tempfile, time
+
+from benchmarks.onnx_vs_torch import load_images, make_tiny
+
+
+def _throughput(call, images, batch_size):
+    call(images[:2], top_k=1)  # warm up
+    t0 = time.perf_counter()
+    out = call(images, top_k=1, batch_size=batch_size)
+    return round(len(images) / (time.perf_counter() - t0), 2), [r[0]["label"] for r in out]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="in-process pipeline vs worker processes")
+    ap.add_argument("--tiny", action="store_true", help="random tiny vit instead of a real model (offline)")
+    ap.add_argument("--model", default="google/vit-base-patch16-224")
+    ap.add_argument("--runtime", choices=("torch", "onnx"), default="torch")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--threads", type=int, default=1, help="intra-op threads per worker")
+    ap.add_argument("--n", type=int, default=64)
+    ap.add_argument("--batch-size", type=int, default=8)
+    ap.add_argument("--images", help="folder of pictures (default: generated ones)")
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    from models.procpool import ProcessPipelinePool
+    images = load_images(args.images, args.n)
+    with tempfile.TemporaryDirectory() as tmp:
+        model = make_tiny(tmp)[0] if args.tiny else args.model
+        report = {"args": vars(args), "cpus": os.cpu_count()}
+
+        if args.runtime == "onnx":
+            from models.onnx_backend import OnnxImageClassifier, export
+            pipe = OnnxImageClassifier(export(model, os.path.join(tmp, "onnx")), threads=args.threads)
+        else:
+            import torch
+            from transformers import pipeline
+            torch.set_num_threads(args.threads)
+            pipe = pipeline("image-classification", model=model, device="cpu")
+        report["in_process_per_s"], ref = _throughput(pipe, images, args.batch_size)
+
+        for w in args.workers:
+            pool = ProcessPipelinePool(model, workers=w, threads=args.threads, runtime=args.runtime)
+            try:
+                per_s, labels = _throughput(pool, images, args.batch_size)
+            finally:
+                pool.close()
+            report[f"workers_{w}"] = {"per_s": per_s, "speedup": round(per_s / report["in_process_per_s"], 2),
+                                      "worker_load_ms": pool.load_ms,
+                                      "same_top1": sum(a == b for a, b in zip(ref, labels)) / len(ref)}
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# a fake InferenceClient so we can benchmark without a token or internet.
+# it sleeps for latency +- jitter and sometimes throws, like the real one on a bad day.
+import asyncio, random, threading, time
+
+from models.backends import BACKENDS, Backend
+
+TEXT_LABELS = ["POSITIVE", "NEGATIVE"]
+IMAGE_LABELS = ["tabby cat", "golden retriever", "sports car", "banana", "pizza", "laptop", "teapot"]
+
+
+class SimulatedHTTPError(Exception):
+    # looks enough like huggingface_hub's HfHubHTTPError for our code (status + headers)
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"simulated {status_code}")
+        self.status_code = status_code
+        self.headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+
+
+class SimConfig:
+    def __init__(self, latency_ms=40.0, jitter_ms=10.0, error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def draw(self):
+        # (seconds to wait, should it fail?)
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            fail = self._rng.random() < self.error_rate
+            scores = [self._rng.random() for _ in IMAGE_LABELS]
+        return delay, fail, scores
+
+
+def _text_out(scores):
+    p = scores[0]
+    return [{"label": TEXT_LABELS[0], "score": p}, {"label": TEXT_LABELS[1], "score": 1 - p}]
+
+def _image_out(scores):
+    total = sum(scores)
+    out = [{"label": lbl, "score": s / total} for lbl, s in zip(IMAGE_LABELS, scores)]
+    return sorted(out, key=lambda r: r["score"], reverse=True)[:5]
+
+
+class SimulatedClient:
+    def __init__(self, cfg: SimConfig):
+        self.cfg = cfg
+
+    def _call(self, make):
+        delay, fail, scores = self.cfg.draw()
+        time.sleep(delay)
+        if fail:
+            raise SimulatedHTTPError(503)
+        return make(scores)
+
+    def text_classification(self, text):
+        return self._call(_text_out)
+
+    def image_classification(self, image):
+        return self._call(_image_out)
+
+
+class AsyncSimulatedClient(SimulatedClient):
+    async def _acall(self, make):
+        delay, fail, scores = self.cfg.draw()
+        await asyncio.sleep(delay)
+        if fail:
+            raise SimulatedHTTPError(503)
+        return make(scores)
+
+    async def text_classification(self, text):
+        return await self._acall(_text_out)
+
+    async def image_classification(self, image):
+        return await self._acall(_image_out)
+
+
+class SimulatedBackend(Backend):
+    name = "simulated"
+    config = SimConfig()  # set this before creating models
+
+    def make_client(self, model_id, task):
+        return SimulatedClient(self.config)
+
+    def make_async_client(self, model_id, task):
+        return AsyncSimulatedClient(self.config)
+
+
+def install(cfg: SimConfig = None):
+    # after this, Model(backend="simulated") talks to the fake client
+    if cfg is not None:
+        SimulatedBackend.config = cfg
+    BACKENDS["simulated"] = SimulatedBackend
+    return SimulatedBackend.config
@@ -0,0 +1,149 @@
+# a pretend hugging face inference api on localhost, for poking at the real
+# InferenceClient + our transport without the internet:
+#   python -m benchmarks.standin --port 9000 --latency-ms 40 --tail-rate 0.05 --tail-ms 800
+#   HF_INFERENCE_ENDPOINT=http://127.0.0.1:9000 HF_TOKEN=x python main.py
+#   python -m benchmarks.standin --capacity 16 --retry-after 0.5 --loading-s 3   # a busy api
+# it counts tcp connections vs requests, so you can see keep-alive working.
+# with --capacity it acts like an overloaded api: past capacity/2 requests at once every answer
+# gets slower, past capacity it answers 429 (+ Retry-After). --loading-s = 503 "model is loading"
+# for that long after starting, like a cold model on hf.
+import argparse, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandinConfig:
+    def __init__(self, latency_ms=40.0, jitter_ms=10.0, tail_rate=0.0, tail_ms=500.0, seed=0,
+                 capacity=None, retry_after=None, loading_s=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tail_rate = tail_rate  # share of requests that are randomly very slow
+        self.tail_ms = tail_ms
+        self.capacity = capacity  # requests at once before 429s (None = unlimited)
+        self.retry_after = retry_after  # seconds, sent with 429 / 503
+        self.loading_until = time.monotonic() + loading_s
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.throttled = 0
+        self.loading = 0
+
+    def admit(self):
+        # None = go ahead (call done() after), or the error status to send back
+        with self.lock:
+            self.requests += 1
+            if time.monotonic() < self.loading_until:
+                self.loading += 1
+                return 503
+            if self.capacity is not None and self.in_flight >= self.capacity:
+                self.throttled += 1
+                return 429
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return None
+
+    def done(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def delay(self):
+        with self.lock:
+            d = self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+            if self.rng.random() < self.tail_rate:
+                d += self.tail_ms
+            if self.capacity:
+                # overloaded: everyone slows down past half capacity
+                d *= max(1.0, self.in_flight / (self.capacity / 2))
+        return max(0.0, d) / 1000
+
+    def stats(self):
+        with self.lock:
+            return {"connections": self.connections, "requests": self.requests, "throttled": self.throttled,
+                    "loading": self.loading, "peak_in_flight": self.peak_in_flight}
+
+
+TEXT_OUT = [[{"label": "POSITIVE", "score": 0.91}, {"label": "NEGATIVE", "score": 0.09}]]
+IMAGE_OUT = [{"label": "tabby cat", "score": 0.62}, {"label": "tiger cat", "score": 0.21},
+             {"label": "egyptian cat", "score": 0.09}]
+
+
+def make_handler(cfg):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def setup(self):
+            super().setup()
+            with cfg.lock:
+                cfg.connections += 1
+
+        def log_message(self, *a):
+            pass  # quiet
+
+        def _reply(self, status, payload, headers=None):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            # warm-up / status ping
+            self._reply(200, {"loaded": True, "state": "Loadable"})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            status = cfg.admit()
+            if status is not None:
+                headers = {"Retry-After": f"{cfg.retry_after:g}"} if cfg.retry_after is not None else {}
+                msg = "Model is loading" if status == 503 else "Rate limit reached"
+                self._reply(status, {"error": msg}, headers)
+                return
+            try:
+                time.sleep(cfg.delay())
+            finally:
+                cfg.done()
+            is_json = self.headers.get("Content-Type", "").startswith("application/json") or body[:1] == b"{"
+            self._reply(200, TEXT_OUT if is_json else IMAGE_OUT)
+
+    return Handler
+
+
+def start(port=0, cfg=None, handler_factory=make_handler):
+    # starts in a background thread, returns (server, cfg). port=0 picks a free one
+    cfg = cfg or StandinConfig()
+    srv = ThreadingHTTPServer(("127.0.0.1", port), handler_factory(cfg))
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, cfg
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="local stand-in for the hf inference api")
+    ap.add_argument("--port", type=int, default=9000)
+    ap.add_argument("--latency-ms", type=float, default=40.0)
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--tail-rate", type=float, default=0.0)
+    ap.add_argument("--tail-ms", type=float, default=500.0)
+    ap.add_argument("--capacity", type=int, help="requests at once before it answers 429")
+    ap.add_argument("--retry-after", type=float, help="seconds, sent with 429 / 503")
+    ap.add_argument("--loading-s", type=float, default=0.0, help="answer 503 (model loading) for this long")
+    args = ap.parse_args(argv)
+    srv, cfg = start(args.port, StandinConfig(args.latency_ms, args.jitter_ms, args.tail_rate, args.tail_ms,
+                                              capacity=args.capacity, retry_after=args.retry_after,
+                                              loading_s=args.loading_s))
+    print(f"stand-in api on http://127.0.0.1:{srv.server_address[1]} (ctrl-c to stop)")
+    try:
+        while True:
+            time.sleep(5)
+            print(cfg.stats())
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# how long until the window shows up? run from the repo folder:
+#   python -m benchmarks.startup --runs 5 --out startup.json
+# every run is a fresh python so nothing is already imported.
+import argparse, json, os, statistics, subprocess, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# stuff that should NOT get imported just to open the window
+HEAVY = ["huggingface_hub", "PIL", "transformers", "torch", "aiohttp"]
+
+IMPORT_SNIPPET = """
+import json, sys, time
+t0 = time.perf_counter()
+import gui
+t1 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+WINDOW_SNIPPET = """
+import json, time
+from gui import App
+app = App()
+app.update()  # draw it once
+print(json.dumps({"window_at": time.time()}))
+app.destroy()
+"""
+
+def _run(code):
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "child failed")
+    # the models print logs too, the json is the last line
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def _summary(xs):
+    if not xs:
+        return None
+    return {"median": round(statistics.median(xs), 2), "min": round(min(xs), 2), "max": round(max(xs), 2)}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="startup benchmark (import time + time to first window)")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--out", help="write json here too")
+    args = ap.parse_args(argv)
+
+    import_ms, heavy = [], set()
+    for _ in range(args.runs):
+        r = _run(IMPORT_SNIPPET)
+        import_ms.append(r["import_ms"])
+        heavy.update(r["heavy"])
+
+    window_ms, window_err = [], None
+    for _ in range(args.runs):
+        t0 = time.time()
+        try:
+            r = _run(WINDOW_SNIPPET)
+        except RuntimeError as e:
+            window_err = str(e)  # usually no display (ssh / ci)
+            break
+        window_ms.append((r["window_at"] - t0) * 1000)
+
+    report = {
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import_gui_ms": _summary(import_ms),
+        "heavy_modules_imported": sorted(heavy),
+        "time_to_first_window_ms": _summary(window_ms),
+        "window_error": window_err,
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+if __name__ == "__main__":
+    main()
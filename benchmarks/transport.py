@@ -0,0 +1,79 @@
+# pooled transport / warm-up / hedging against the local stand-in api (needs requests +
+# huggingface_hub installed, but no token and no internet):
+#   python -m benchmarks.transport --n 200 --tail-rate 0.05 --tail-ms 800 --out transport.json
+import argparse, json, os, time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.standin import StandinConfig, start
+from models.limiter import reset_shared_limiter
+from models.metrics import Metrics, nearest_rank
+from models.singleflight import SingleFlight
+from models.text_sentiment import TextSentimentModel
+from models.transport import Hedger, shared_transport
+
+
+def _first_request_ms(warm):
+    shared_transport().close()  # drop pooled connections so this is a cold start
+    os.environ["HF_WARMUP"] = "1" if warm else "0"
+    m = TextSentimentModel().set_metrics(Metrics())
+    m.load()
+    t0 = time.perf_counter()
+    m.run("first one")
+    return round((time.perf_counter() - t0) * 1000, 2)
+
+
+def _load_run(n, concurrency, hedger):
+    reset_shared_limiter()  # both runs start from the same limit, not one warmed up by the other
+    m = TextSentimentModel().set_metrics(Metrics()).set_coalescing(SingleFlight()).set_hedging(hedger)
+    m.load()
+    lat = []
+    def one(i):
+        t0 = time.perf_counter()
+        m.run(f"text number {i}")
+        return (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        lat = sorted(pool.map(one, range(n)))
+    wall = time.perf_counter() - t0
+    out = {"throughput_per_s": round(n / wall, 2)}
+    for q in (0.5, 0.95, 0.99):
+        out[f"p{int(q * 100)}_ms"] = round(nearest_rank(lat, q), 2)
+    if hedger is not None:
+        out["hedging"] = hedger.stats()
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="transport benchmark against the stand-in api")
+    ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--latency-ms", type=float, default=40.0)
+    ap.add_argument("--tail-rate", type=float, default=0.05)
+    ap.add_argument("--tail-ms", type=float, default=800.0)
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    srv, cfg = start(0, StandinConfig(args.latency_ms, 5.0, args.tail_rate, args.tail_ms))
+    os.environ["HF_INFERENCE_ENDPOINT"] = f"http://127.0.0.1:{srv.server_address[1]}"
+    os.environ.setdefault("HF_TOKEN", "standin")
+    report = {"args": vars(args)}
+    report["first_request_cold_ms"] = _first_request_ms(warm=False)
+    report["first_request_after_warmup_ms"] = _first_request_ms(warm=True)
+
+    before = cfg.stats()
+    report["no_hedging"] = _load_run(args.n, args.concurrency, None)
+    report["hedging"] = _load_run(args.n, args.concurrency, Hedger(default_delay_ms=args.latency_ms * 3))
+    after = cfg.stats()
+    report["connections_opened"] = after["connections"] - before["connections"]
+    report["requests_sent"] = after["requests"] - before["requests"]
+    srv.shutdown()
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
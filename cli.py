@@ -0,0 +1,197 @@
+# headless batch runner (no window). streams inputs through a registry model and
+# writes one json line per result as it goes.
+#
+#   python cli.py --model sentiment --input reviews.jsonl --out scores.jsonl
+#   python cli.py --model image --input photos/ --out labels.jsonl --parallel 16
+#   python cli.py ... --resume      # carry on after a crash / ctrl-c
+#   python cli.py ... --store preds/   # also keep every label + score for querying later
+#   python cli.py ... --profile 3      # cProfile + tracemalloc report for the first 3 items
+#
+# inputs: .jsonl (each line a string or {"text": ..., "id": ...}), .txt (one text per line)
+# or a folder of pictures (walked recursively, sorted so the order is the same every time).
+# progress is checkpointed next to the output file (<out>.ckpt) so --resume skips finished work.
+import argparse, itertools, json, os, sys, time
+from collections import deque
+
+from models import registry
+from models.cache import ResultCache
+from models.profiling import default_profiler
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def iter_texts(path, field):
+    # yields (meta, text). generator so a huge file never sits in memory
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            if path.endswith(".txt"):
+                yield {"line": n + 1}, line
+                continue
+            row = json.loads(line)
+            if isinstance(row, str):
+                yield {"line": n + 1}, row
+            else:
+                meta = {"line": n + 1}
+                if "id" in row:
+                    meta["id"] = row["id"]
+                yield meta, row.get(field)
+
+
+def iter_images(folder, exts=IMAGE_EXTS):
+    # sorted walk, so item #n is the same picture on every run (resume depends on that)
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(exts):
+                p = os.path.join(root, name)
+                yield {"path": p}, p
+
+
+def iter_inputs(path, field):
+    if os.path.isdir(path):
+        return iter_images(path)
+    return iter_texts(path, field)
+
+
+class Checkpoint:
+    # remembers how many items are done and how many bytes of output are good.
+    # written after the output is flushed, so the output is never behind the checkpoint.
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)  # atomic, a crash mid-write leaves the old one
+
+
+def run(args):
+    spec = registry.get_spec(args.model)
+    model = registry.create_model(args.model, backend=args.backend)
+    if args.cache:
+        model.set_cache(ResultCache(max_items=args.cache_items, path=args.cache))
+    store = None
+    if args.store:
+        from models.store import PredictionStore  # needs numpy
+        store = PredictionStore(args.store)
+        model.set_sink(store)
+    model.load()
+
+    ckpt = Checkpoint(args.out + ".ckpt")
+    state = ckpt.load() if args.resume else None
+    if state and (state.get("input") != os.path.abspath(args.input) or state.get("model") != spec["key"]):
+        raise SystemExit("checkpoint is for a different input/model, delete it or drop --resume")
+    if state and not os.path.exists(args.out):
+        state = None  # output is gone, nothing to resume from
+    done = state["done"] if state else 0
+    good_bytes = state["out_bytes"] if state else 0
+
+    # throw away anything written after the last checkpoint, it gets redone
+    out = open(args.out, "r+b" if state else "wb")
+    out.truncate(good_bytes)
+    out.seek(good_bytes)
+
+    items = itertools.islice(iter_inputs(args.input, args.field), done, None)
+    metas = deque()
+    def feed():
+        for meta, x in items:
+            metas.append(meta)
+            yield x
+
+    t0 = time.perf_counter()
+    n_new = n_err = 0
+    # (items done, output bytes) as of the last complete row, set in one go. a ctrl-c between
+    # writing a row and counting it then can't checkpoint the row's bytes without the row
+    # (resume would write a second row with the same i), the half-counted row is just redone
+    good = (done, good_bytes)
+    def emit(meta, res):
+        nonlocal n_new, n_err, good
+        row = dict(meta, i=done + n_new, **res)
+        out.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+        good = (done + n_new + 1, out.tell())
+        n_new += 1
+        n_err += "error" in row
+        if n_new % args.checkpoint_every == 0:
+            _commit(out, ckpt, args, spec, good)
+            _progress(n_new, n_err, t0)
+
+    try:
+        if args.profile:
+            # these go one at a time on this thread (cProfile only sees the thread it runs on),
+            # the rest streams through run_many like normal
+            profiler = default_profiler().arm(args.profile)
+            for meta, x in itertools.islice(items, args.profile):
+                try:
+                    res = model.run(x)
+                except Exception as e:
+                    res = {"error": str(e), "latency_ms": None, "model_id": model.model_id, "task": model.TASK}
+                emit(meta, res)
+            profiler.disarm()  # whatever wasn't used (fewer items than --profile)
+            print(f"profiles in {profiler.out_dir}", file=sys.stderr)
+        for res in model.run_many(feed(), max_in_flight=args.parallel):
+            res.pop("index")
+            emit(metas.popleft(), res)
+    finally:
+        _commit(out, ckpt, args, spec, good)
+        out.close()
+        if store is not None:
+            store.flush()
+    _progress(n_new, n_err, t0, final=True)
+    return done + n_new
+
+
+def _commit(out, ckpt, args, spec, good):
+    total_done, out_bytes = good
+    out.flush()
+    os.fsync(out.fileno())
+    ckpt.save({"input": os.path.abspath(args.input), "model": spec["key"],
+               "done": total_done, "out_bytes": out_bytes, "updated": time.time()})
+
+
+def _progress(n, n_err, t0, final=False):
+    dt = time.perf_counter() - t0
+    rate = n / dt if dt else 0.0
+    print(f"{'done' if final else '...'} {n} items ({n_err} errors) in {dt:.1f}s, {rate:.1f}/s", file=sys.stderr)
+
+
+def positive_int(value):
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"should be 1 or more, not {value}")
+    return n
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="run a registry model over a jsonl file or an image folder")
+    ap.add_argument("--model", required=True, help="registry name or key (e.g. sentiment, image)")
+    ap.add_argument("--input", required=True, help=".jsonl / .txt file, or a folder of images")
+    ap.add_argument("--out", required=True, help="results .jsonl (appended as we go)")
+    ap.add_argument("--field", default="text", help="which key holds the text in jsonl objects")
+    ap.add_argument("--backend", help="override the registry entry (hosted / local)")
+    ap.add_argument("--parallel", type=int, default=8, help="requests in flight at once")
+    ap.add_argument("--checkpoint-every", type=positive_int, default=100)
+    ap.add_argument("--resume", action="store_true", help="skip items the checkpoint says are done")
+    ap.add_argument("--cache", help="sqlite file for the result cache (skip repeats across runs)")
+    ap.add_argument("--cache-items", type=int, default=10000)
+    ap.add_argument("--store", help="folder for the prediction store (every label + score, columnar, see models/store.py)")
+    ap.add_argument("--profile", type=int, default=0, metavar="N",
+                    help="cProfile + tracemalloc the first N items, reports in HF_PROFILE_DIR (see models/profiling.py)")
+    args = ap.parse_args(argv)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,81 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from typing import Optional
-import threading
+import os, threading
+from collections import deque
+from itertools import groupby
 from explanations import OOP_EXPLANATIONS
-from models import registry
+from models import metrics, registry
+from models.cache import default_cache
+from models.dedup import default_dedup
+from models.image_cache import default_image_cache
+from models.jobs import INTERACTIVE, NORMAL, JobQueue, UiPump
+from models.limiter import shared_limiter
+from models.pool import ModelPool
+from models.profiling import default_profiler
+
+MAX_JOB_ROWS = 200  # finished jobs drop off the list after this
+
+
+class ChunkedWriter:
+    # batch results can show up way faster than tk can draw them one insert at a time.
+    # write() just buffers (any thread), flush() runs on the pump tick and puts up to
+    # max_lines in with ONE insert. really old lines get trimmed so the widget stays quick.
+    # everything that goes in the output box goes through here (so the line count stays right).
+    # tag = whose output it is ("job12", "metrics"), clear(tag) only takes that bit out again
+    def __init__(self, text, max_lines=500, keep_lines=20000):
+        self.text = text
+        self.max_lines = max_lines
+        self.keep_lines = keep_lines
+        self._buf = deque()  # (text, tag), text can be several lines
+        self._buf_lock = threading.Lock()  # workers write while the tk thread flushes / clears
+        self._lines = 0
+        self._tags = set()
+
+    def write(self, line, tag=None):
+        with self._buf_lock:
+            self._buf.append((line, tag))
+
+    def tags(self):
+        return set(self._tags)
+
+    def clear(self, tag=None):
+        # tag=None = everything
+        if tag is None:
+            with self._buf_lock:
+                self._buf.clear()
+            self._lines = 0
+            self._tags.clear()
+            self.text.delete("1.0", "end")
+            return
+        with self._buf_lock:
+            self._buf = deque(x for x in self._buf if x[1] != tag)
+        ranges = self.text.tag_ranges(tag)
+        # back to front so the indexes still point at the right places
+        for start, end in reversed(list(zip(ranges[::2], ranges[1::2]))):
+            self._lines -= self.text.get(start, end).count("\n")
+            self.text.delete(start, end)
+        self._tags.discard(tag)
+
+    def flush(self):
+        with self._buf_lock:
+            if not self._buf:
+                return
+            chunk = [self._buf.popleft() for _ in range(min(len(self._buf), self.max_lines))]
+        # lines next to each other with the same tag go in as one piece, still one insert call
+        args = []
+        for tag, group in groupby(chunk, key=lambda x: x[1]):
+            piece = "\n".join(line for line, _ in group) + "\n"
+            self._lines += piece.count("\n")
+            args += [piece, tag or ()]
+            if tag is not None:
+                self._tags.add(tag)
+        self.text.insert("end", *args)
+        if self._lines > self.keep_lines:
+            drop = self._lines - self.keep_lines
+            self.text.delete("1.0", f"{drop + 1}.0")
+            self._lines -= drop
+        self.text.see("end")
 
 # helper because i keep writing json.dumps wrong
 def pretty_json(x):
@@ -12,27 +84,48 @@ def pretty_json(x):
     return json.dumps(x, indent=2, ensure_ascii=False)
 
 class App(tk.Tk):
+    RUN1_MODEL = "Text: Sentiment (easy one)"
+    RUN2_MODEL = "Vision: Image Classifier (the picture one)"
+
     def __init__(self):
         super().__init__()
         self.title("Tkinter AI GUI (amateur mode)")
         self.geometry("980x720")
-        self.loaded_models = {} 
+        # loaded models, up to HF_MODEL_BUDGET_MB. least recently used ones get unloaded
+        self.pool = ModelPool(self._load_model)
+        # every click becomes a job for these workers (no more thread per click)
+        self.jobs = JobQueue(workers=2, name="gui")
+        self._job_rows = {}  # job id -> Job, for the job list
+        self._dedups = {}  # model name -> its near-duplicate index (kept when the model is evicted)
 
         # i store some state here. globals are bad but also easy
         self.input_mode = tk.StringVar(value="Text")
         self.selected_model_name = tk.StringVar(value=registry.get_model_names()[0])
-        self.model = None
+        self.model_id = None  # hugging face id of the last model loaded with Load Model
         self.image_path: Optional[str] = None
+        self.image_paths = []  # Browse can pick several, they all get run
+        self.per_line = tk.BooleanVar(value=False)  # text mode: every line is its own input
 
         self._make_menus()
         self._make_top()
         self._make_main()
         self._make_bottom()
         self._show_oop_text()
+        # the one after() loop that brings finished jobs / progress back to tk
+        self.pump = UiPump(self, self.jobs, on_tick=self._on_tick, on_event=self._show_job).start()
+        # warm up the likely ones in the background (HF_PRELOAD=sentiment,image-local picks others by key)
+        keys = os.getenv("HF_PRELOAD")
+        likely = [self.RUN1_MODEL, self.RUN2_MODEL]
+        if keys is not None:
+            likely = [n for n in registry.get_model_names() if registry.get_spec(n)["key"] in keys.split(",")]
+        self.pool.preload(likely, jobs=self.jobs)
 
     def _make_menus(self):
         m = tk.Menu(self); self.config(menu=m)
         f = tk.Menu(m, tearoff=0)
+        f.add_command(label="Show Metrics", command=self.on_metrics)
+        f.add_command(label="Profile Next Run", command=lambda: self.on_profile(1))
+        f.add_command(label="Profile Next 10 Runs", command=lambda: self.on_profile(10))
         f.add_command(label="Exit", command=self.destroy)
         m.add_cascade(label="File", menu=f)
         h = tk.Menu(m, tearoff=0)
@@ -58,18 +151,31 @@ class App(tk.Tk):
         ttk.Radiobutton(r, text="Text", variable=self.input_mode, value="Text").pack(side="left")
         ttk.Radiobutton(r, text="Image", variable=self.input_mode, value="Image").pack(side="left", padx=8)
         ttk.Button(r, text="Browse", command=self.on_browse).pack(side="right")
+        ttk.Checkbutton(r, text="one per line", variable=self.per_line).pack(side="right", padx=8)
 
         self.input_box = tk.Text(left, height=12); self.input_box.pack(fill="both", expand=True, pady=6)
 
         b = ttk.Frame(left); b.pack(fill="x", pady=4)
-        self.run1_btn = ttk.Button(b, text="Run Model 1", command=lambda: self._run_fixed("Text: Sentiment (easy one)"))
+        self.run1_btn = ttk.Button(b, text="Run Model 1", command=lambda: self._run_fixed(self.RUN1_MODEL))
         self.run1_btn.pack(side="left")
-        self.run2_btn = ttk.Button(b, text="Run Model 2", command=lambda: self._run_fixed("Vision: Image Classifier (the picture one)"))
+        self.run2_btn = ttk.Button(b, text="Run Model 2", command=lambda: self._run_fixed(self.RUN2_MODEL))
         self.run2_btn.pack(side="left", padx=6)
         ttk.Button(b, text="Clear", command=self.on_clear).pack(side="right")
 
         ttk.Label(right, text="Output Display:").pack(anchor="w")
         self.output_box = tk.Text(right, height=12); self.output_box.pack(fill="both", expand=True, pady=6)
+        self.writer = ChunkedWriter(self.output_box)
+
+        jf = ttk.Frame(right); jf.pack(fill="x")
+        self.queue_lbl = ttk.Label(jf, text="queue: nothing yet")
+        self.queue_lbl.pack(side="left")
+        ttk.Button(jf, text="Cancel all", command=self.on_cancel_all).pack(side="right")
+        ttk.Button(jf, text="Cancel", command=self.on_cancel).pack(side="right", padx=4)
+        self.job_list = ttk.Treeview(right, columns=("job", "state", "progress"), show="headings", height=5)
+        for col, w in (("job", 200), ("state", 80), ("progress", 140)):
+            self.job_list.heading(col, text=col)
+            self.job_list.column(col, width=w, stretch=col == "job")
+        self.job_list.pack(fill="x", pady=(4, 0))
 
         self.left = left
         self.right = right
@@ -93,62 +199,160 @@ class App(tk.Tk):
     # event handlers (i put them together so i can find them fast)
     def on_browse(self):
         if self.input_mode.get() == "Image":
-            p = filedialog.askopenfilename(title="choose picture", filetypes=[("Images","*.png;*.jpg;*.jpeg;*.bmp")])
-            if p:
-                self.image_path = p
+            # ctrl/shift click to pick a bunch of them
+            ps = filedialog.askopenfilenames(title="choose picture(s)", filetypes=[("Images","*.png;*.jpg;*.jpeg;*.bmp")])
+            if ps:
+                self.image_paths = list(ps)
+                self.image_path = self.image_paths[0]
                 self.input_box.delete("1.0","end")
-                self.input_box.insert("end", f"[image selected] {p}\n")
+                self.input_box.insert("end", "".join(f"[image selected] {p}\n" for p in ps))
         else:
             messagebox.showinfo("Browse", "switch to Image first to pick a file")
 
+    def on_metrics(self):
+        # latency percentiles per model/stage (same thing metrics.snapshot() gives scripts)
+        self._clear_finished()
+        out = [metrics.snapshot("json")]
+        # memory per model, cold loads vs warm hits
+        out.append("\nmodel pool:\n" + pretty_json(self.pool.stats()))
+        limiter = shared_limiter()
+        if limiter is not None:
+            out.append("\nhosted api limiter:\n" + pretty_json(limiter.stats()))
+        # near duplicate pictures that skipped the model
+        dedup = {n: d.stats() for n, d in self._dedups.items() if d is not None}
+        if dedup:
+            out.append("\nnear duplicates:\n" + pretty_json(dedup))
+        if os.getenv("HF_PREDICTION_STORE"):
+            from models.store import default_store
+            q = default_store().query()
+            out.append("\nstored predictions:\n" + pretty_json(
+                {"rows": q.count(), "top_labels": q.label_histogram(top=10), "latency": q.latency_summary()}))
+        prof = default_profiler().stats()
+        if prof["pending"] or prof["captured"]:
+            out.append("\nprofiling:\n" + pretty_json(prof))
+        self.writer.write("\n".join(out), tag="metrics")
+
+    def _clear_finished(self):
+        # takes out what finished jobs (and the last metrics dump) wrote, anything still
+        # running or queued keeps its lines
+        for tag in self.writer.tags():
+            job = self._job_rows.get(int(tag[3:])) if tag.startswith("job") else None
+            if job is None or job.state in ("done", "failed", "cancelled"):
+                self.writer.clear(tag)
+
+    def on_profile(self, n):
+        # the next n single runs (Run Model 1 / 2) get a cProfile + tracemalloc report each,
+        # the .prof path shows up in the result. batches aren't profiled, they're spread over threads
+        prof = default_profiler().arm(n)
+        messagebox.showinfo("profiling", f"profiling the next {prof.pending} run(s)\nreports go to {prof.out_dir}")
+
     def on_clear(self):
         self.input_box.delete("1.0","end")
-        self.output_box.delete("1.0","end")
+        self.writer.clear()
         self.model_info.delete("1.0","end")
 
     def on_load(self):
         name = self.selected_model_name.get()
         
-        # check cache first
-        if name in self.loaded_models:
-            self.model = self.loaded_models[name]
-            self._fill_model_info(name)
-            messagebox.showinfo("ok", "model already loaded (from cache)")
-            return
+        def loaded_id():
+            # only pinned while we read the id, we don't keep the model itself around
+            # (the pool may unload it later, the next run just loads it again)
+            with self.pool.use(name) as mdl:
+                return mdl.model_id
         
-        # disable button while loading
-        self.load_btn.config(text="Loading...", state="disabled")
-        self.dd.config(state="disabled")
+        # even when it's loaded this goes through the queue: it can be evicted before use() gets
+        # it (a cold load), and letting go of it can unload others. neither belongs on the tk thread
+        was_loaded = name in self.pool
         
-        def load_thread():
-            try:
-                mdl = registry.create_model(name)
-                mdl.load()
-                # cache it
-                self.loaded_models[name] = mdl
-                self.model = mdl
-                # update UI from main thread
-                self.after(0, lambda: self._fill_model_info(name))
-                self.after(0, lambda: messagebox.showinfo("ok","model loaded :)"))
-            except Exception as e:
-                self.after(0, lambda: messagebox.showerror("oops", str(e)))
-            finally:
-                self.after(0, lambda: self.load_btn.config(text="Load Model", state="normal"))
-                self.after(0, lambda: self.dd.config(state="readonly"))
+        def done(job):
+            # runs on the tk thread (the pump calls it)
+            if job.error is not None:
+                messagebox.showerror("oops", str(job.error))
+            elif job.state == "done":
+                self.model_id = job.result
+                self._fill_model_info(name)
+                messagebox.showinfo("ok", "model already loaded (from cache)" if was_loaded else "model loaded :)")
         
-        threading.Thread(target=load_thread, daemon=True).start()
+        self.jobs.submit(lambda job: loaded_id(), name=f"load {name}", priority=NORMAL, on_done=done)
+
+    def on_cancel(self):
+        for iid in self.job_list.selection():
+            job = self._job_rows.get(int(iid))
+            if job is not None:
+                job.cancel()
+
+    def on_cancel_all(self):
+        self.jobs.cancel_all()
+
+    def destroy(self):
+        self.pump.stop()
+        self.jobs.close()
+        super().destroy()
+
+    def _load_model(self, name):
+        # the pool calls this (on a worker thread) when the model isn't loaded
+        mdl = self._new_model(name)
+        if hasattr(mdl, "set_dedup"):
+            if name not in self._dedups:
+                self._dedups[name] = default_dedup()
+            mdl.set_dedup(self._dedups[name])
+        mdl.load()
+        return mdl
+
+    def _show_job(self, job, kind):
+        # keep the job list in sync (tk thread, called by the pump)
+        iid = str(job.id)
+        progress = f"{job.progress:.0%} {job.message}".strip()
+        if job.state == "failed":
+            progress = f"error: {job.error}"
+        values = (job.name, job.state, progress)
+        if self.job_list.exists(iid):
+            self.job_list.item(iid, values=values)
+        else:
+            self.job_list.insert("", 0, iid=iid, values=values)
+            self._job_rows[job.id] = job
+            if len(self._job_rows) > MAX_JOB_ROWS:
+                # oldest finished one goes
+                for old_id, old in list(self._job_rows.items()):
+                    if old.state in ("done", "failed", "cancelled"):
+                        self.job_list.delete(str(old_id))
+                        del self._job_rows[old_id]
+                        break
+
+    def _on_tick(self, stats):
+        self.writer.flush()
+        self._show_queue(stats)
+
+    def _show_queue(self, stats):
+        text = f"queue: {stats['queued']} waiting, {stats['running']} running, {stats['done']} done"
+        limiter = shared_limiter()
+        if limiter is not None and (limiter.in_flight or limiter.queued):
+            # hosted api: how many at once it's allowing right now, how many are waiting for a slot
+            text += f" | api: {limiter.in_flight}/{int(limiter.limit)} in flight, {limiter.queued} waiting"
+        if self.queue_lbl.cget("text") != text:
+            self.queue_lbl.config(text=text)
+
+    @staticmethod
+    def _new_model(name):
+        mdl = registry.create_model(name).set_cache(default_cache())
+        if hasattr(mdl, "set_image_cache"):
+            # same decoded pictures for every image model, so switching models doesn't re-read the file
+            mdl.set_image_cache(default_image_cache())
+        if os.getenv("HF_PREDICTION_STORE"):
+            from models.store import default_store  # needs numpy, so only when asked for
+            mdl.set_sink(default_store())
+        return mdl
 
     def _fill_model_info(self, name):
+        # all of this comes from the registry entry, no need to import the model for it
+        spec = registry.get_spec(name)
         self.model_info.delete("1.0","end")
-        cat = "Text" if "Text:" in name else "Vision"
         self.model_info.insert("end", f"Model Name: {name}\n")
-        self.model_info.insert("end", f"Category: {cat}\n")
-        self.model_info.insert("end", f"Hugging Face ID: {self.model.model_id if self.model else '?'}\n")
+        self.model_info.insert("end", f"Category: {spec['category']}\n")
+        self.model_info.insert("end", f"Hugging Face ID: {self.model_id or spec['model_id']}\n")
+        self.model_info.insert("end", f"Runs on: {spec['backend']}\n")
         self.model_info.insert("end", "Short Description:\n")
-        if cat == "Text":
-            self.model_info.insert("end","  does sentiment. like positive/negative vibes.\n")
-        else:
-            self.model_info.insert("end","  guesses what the picture is basically.\n")
+        self.model_info.insert("end", f"  {spec['description']}\n")
 
     def _get_user_input(self):
         if self.input_mode.get() == "Text":
@@ -156,40 +360,90 @@ class App(tk.Tk):
         else:
             return self.image_path
 
+    def _get_user_inputs(self):
+        # a list, more than one item means batch mode
+        if self.input_mode.get() == "Image":
+            return list(self.image_paths)
+        if self.per_line.get():
+            return [line.strip() for line in self.input_box.get("1.0","end").splitlines() if line.strip()]
+        text = self._get_user_input()
+        return [text] if text else []
+
     def _run_fixed(self, fixed_name):
-        data = self._get_user_input()
-        if not data:
+        inputs = self._get_user_inputs()
+        if not inputs:
             messagebox.showwarning("hmm","type something or pick an image first")
             return
+        if len(inputs) > 1:
+            self._run_batch(fixed_name, inputs)
+            return
+        data = inputs[0]
+        
+        def work(job):
+            if fixed_name not in self.pool:
+                job.report(0.1, "loading model")
+            # use() = it won't get evicted while this runs
+            with self.pool.use(fixed_name) as mdl:
+                job.report(0.5, "running")
+                return mdl.run(data)
         
-        # disable buttons while running
-        self.run1_btn.config(state="disabled")
-        self.run2_btn.config(state="disabled")
-        self.output_box.delete("1.0","end")
-        self.output_box.insert("end", "Running model, please wait...")
+        def done(job):
+            # swaps this job's "please wait" for the answer, other jobs' output stays put
+            tag = f"job{job.id}"
+            self.writer.clear(tag)
+            if job.error is not None:
+                self.writer.write(f"Error: {str(job.error)}", tag=tag)
+                messagebox.showerror("run fail", str(job.error))
+            elif job.state == "cancelled":
+                self.writer.write(f"job {job.id} was cancelled", tag=tag)
+            else:
+                self.writer.write(pretty_json(job.result), tag=tag)
         
-        def run_thread():
-            try:
-                # check cache first
-                if fixed_name in self.loaded_models:
-                    mdl = self.loaded_models[fixed_name]
-                else:
-                    mdl = registry.create_model(fixed_name)
-                    mdl.load()
-                    self.loaded_models[fixed_name] = mdl
-                
-                result = mdl.run(data)
-                
-                # update UI from main thread
-                self.after(0, lambda: self.output_box.delete("1.0","end"))
-                self.after(0, lambda: self.output_box.insert("end", pretty_json(result)))
-            except Exception as e:
-                self.after(0, lambda: self.output_box.delete("1.0","end"))
-                self.after(0, lambda: self.output_box.insert("end", f"Error: {str(e)}"))
-                self.after(0, lambda: messagebox.showerror("run fail", str(e)))
-            finally:
-                self.after(0, lambda: self.run1_btn.config(state="normal"))
-                self.after(0, lambda: self.run2_btn.config(state="normal"))
+        # buttons stay clickable, more runs just queue up behind this one
+        job = self.jobs.submit(work, name=fixed_name.split(" (")[0], priority=INTERACTIVE, on_done=done)
+        self._clear_finished()
+        self.writer.write(f"Running model, please wait... (job {job.id})", tag=f"job{job.id}")
+
+    def _run_batch(self, fixed_name, inputs):
+        # results stream into the output box as they finish (one short line each, through
+        # the chunked writer) instead of one big pretty_json at the end
+        total = len(inputs)
+        
+        def work(job):
+            if fixed_name not in self.pool:
+                job.report(0.0, "loading model")
+            failed = 0
+            with self.pool.use(fixed_name) as mdl:
+                results = mdl.run_many(inputs)
+                try:
+                    for res in results:
+                        i = res["index"]
+                        failed += "error" in res
+                        self.writer.write(self._result_line(job.id, i + 1, inputs[i], res), tag=f"job{job.id}")
+                        job.report((i + 1) / total, f"{i + 1}/{total}")  # raises if cancelled
+                finally:
+                    results.close()  # cancelled: stop feeding the model
+            return {"count": total, "failed": failed}
         
-        threading.Thread(target=run_thread, daemon=True).start()
+        def done(job):
+            tag = f"job{job.id}"
+            if job.error is not None:
+                self.writer.write(f"[{job.id}] stopped: {job.error}", tag=tag)
+            elif job.state == "cancelled":
+                self.writer.write(f"[{job.id}] cancelled at {job.message or 'the start'}", tag=tag)
+            else:
+                self.writer.write(f"[{job.id}] finished {job.result['count']} ({job.result['failed']} failed)", tag=tag)
+        
+        name = f"{fixed_name.split(' (')[0]} x{total}"
+        job = self.jobs.submit(work, name=name, priority=INTERACTIVE, on_done=done)
+        self._clear_finished()
+        self.writer.write(f"[{job.id}] {total} inputs queued...", tag=f"job{job.id}")
+
+    @staticmethod
+    def _result_line(job_id, n, x, res):
+        what = x if len(x) <= 40 else x[:37] + "..."
+        if "error" in res:
+            return f"[{job_id}] {n}. {what} -> ERROR {res['error']}"
+        ms = res.get("latency_ms")
+        return f"[{job_id}] {n}. {what} -> {res['output']}" + (f" ({ms:.0f} ms)" if ms is not None else "")
 
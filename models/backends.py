@@ -0,0 +1,221 @@
+# where the model actually runs. "hosted" = hf inference api (the original way),
+# "local" = a transformers pipeline on our own cpu (like HuggingFace1.py does),
+# "onnx" = the image models exported to int8 onnx runtime (see onnx_backend.py),
+# "local-procs" = local pipelines spread over worker processes (see procpool.py).
+# both hand back a "client" with the same text_classification / image_classification
+# methods so the model classes don't care which one they got.
+from __future__ import annotations
+import os, threading
+from abc import ABC, abstractmethod
+from io import BytesIO
+
+from .limiter import LimitedClient, shared_limiter
+from .transport import model_url, shared_transport
+
+
+class Backend(ABC):
+    name = ""
+
+    @abstractmethod
+    def make_client(self, model_id: str, task: str): ...
+
+    def make_async_client(self, model_id: str, task: str):
+        # None means "no async client, run the sync one in an executor"
+        return None
+
+    def warm_up(self, model_id: str):
+        # called at the end of load(). nothing to do unless there's a network in the way
+        return None
+
+    def release(self, model_id: str, task: str):
+        # called by unload(). only backends that keep big things around need it
+        return None
+
+    def identity(self, model_id: str, task: str) -> str:
+        # goes in the cache / coalescing key: the same model on another backend (int8, another
+        # runtime) doesn't give exactly the same answers, so they mustn't share them
+        return self.name
+
+
+class HostedBackend(Backend):
+    name = "hosted"
+
+    def _token(self):
+        token = os.getenv("HF_TOKEN")
+        if not token:
+            # i keep forgetting this so the message is loud
+            raise EnvironmentError("NO HF_TOKEN SET. get one from huggingface and export HF_TOKEN")
+        return token
+
+    def _target(self, model_id):
+        # a full url if someone pointed us somewhere else (e.g. a local stand-in server)
+        return model_url(model_id) if os.getenv("HF_INFERENCE_ENDPOINT") else model_id
+
+    def make_client(self, model_id, task):
+        from huggingface_hub import InferenceClient
+        token = self._token()
+        shared_transport().install()  # all hosted models share one keep-alive pool
+        return self._limited(InferenceClient(model=self._target(model_id), token=token), model_id)
+
+    def make_async_client(self, model_id, task):
+        from huggingface_hub import AsyncInferenceClient  # needs aiohttp, so only import when used
+        return self._limited(AsyncInferenceClient(model=self._target(model_id), token=self._token()),
+                             model_id, is_async=True)
+
+    @staticmethod
+    def _limited(client, model_id, is_async=False):
+        # every hosted call goes through the one adaptive limiter (HF_ADAPTIVE=0 to turn it off)
+        limiter = shared_limiter()
+        return client if limiter is None else LimitedClient(client, limiter, model_id, is_async)
+
+    def warm_up(self, model_id):
+        # open the connection (dns + tls) now instead of on the user's first click
+        if os.getenv("HF_WARMUP", "1") == "0":
+            return None
+        return shared_transport().warm_up(model_url(model_id), self._token())
+
+
+# one pipeline per (task, model_id) for the whole process. they're hundreds of MB each.
+# every shared_pipeline() is a hold on it, release_pipeline() gives one back, and it's only
+# forgotten when the last holder lets go (the local cascade and "ResNet-50 (local)" share one)
+_PIPELINES = {}  # key -> [pipe, holders]
+_PIPELINES_LOCK = threading.Lock()
+_LOADING = {}  # key -> lock, so two threads asking for the same model don't both load it
+
+def shared_pipeline(task: str, model_id: str):
+    key = (task, model_id)
+    with _PIPELINES_LOCK:
+        if key in _PIPELINES:
+            _PIPELINES[key][1] += 1
+            return _PIPELINES[key][0]
+        lock = _LOADING.setdefault(key, threading.Lock())
+    with lock:
+        with _PIPELINES_LOCK:
+            if key in _PIPELINES:
+                _PIPELINES[key][1] += 1
+                return _PIPELINES[key][0]
+        from transformers import pipeline  # heavy import, only pay for it when someone goes local
+        pipe = pipeline(task, model=model_id, token=os.getenv("HF_TOKEN") or None)
+        with _PIPELINES_LOCK:
+            _PIPELINES[key] = [pipe, 1]
+            _LOADING.pop(key, None)
+        return pipe
+
+def release_pipeline(task: str, model_id: str):
+    # give back one hold. True if that was the last one (then the memory goes with it)
+    key = (task, model_id)
+    with _PIPELINES_LOCK:
+        entry = _PIPELINES.get(key)
+        if entry is None:
+            return False
+        entry[1] -= 1
+        if entry[1] > 0:
+            return False
+        del _PIPELINES[key]
+        return True
+
+
+class LocalPipelineClient:
+    # pretends to be an InferenceClient (only the two methods we actually use)
+    TOP_K = 5
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def text_classification(self, text):
+        # top_k=None gives every label like the hosted api does
+        out = self._pipe(text, top_k=None)
+        return out[0] if out and isinstance(out[0], list) else out
+
+    def image_classification(self, image):
+        if isinstance(image, (bytes, bytearray)):
+            from PIL import Image
+            image = Image.open(BytesIO(image)).convert("RGB")
+        return self._pipe(image, top_k=self.TOP_K)
+
+    # batched versions: one pipeline call for the whole list, the model does a proper
+    # batched forward pass. gives back one result (or the Exception) per item
+    def text_classification_batch(self, texts):
+        return self._batch(texts, top_k=None)
+
+    def image_classification_batch(self, images):
+        from PIL import Image
+        ims = []
+        for im in images:
+            try:
+                ims.append(Image.open(BytesIO(im)).convert("RGB") if isinstance(im, (bytes, bytearray)) else im)
+            except Exception as e:
+                ims.append(e)  # one broken picture shouldn't sink the batch
+        return self._batch(ims, top_k=self.TOP_K)
+
+    def _batch(self, items, **kw):
+        good = [x for x in items if not isinstance(x, Exception)]
+        try:
+            res = iter(self._pipe(good, batch_size=len(good), **kw)) if good else iter(())
+        except Exception as e:
+            return [x if isinstance(x, Exception) else e for x in items]
+        return [x if isinstance(x, Exception) else next(res) for x in items]
+
+
+class LocalBackend(Backend):
+    name = "local"
+
+    def make_client(self, model_id, task):
+        return LocalPipelineClient(shared_pipeline(task, model_id))
+
+    def release(self, model_id, task):
+        release_pipeline(task, model_id)
+
+
+class OnnxBackend(Backend):
+    # int8 onnx runtime on the cpu. image classification only (that's where the time goes)
+    name = "onnx"
+
+    def make_client(self, model_id, task):
+        if task != "image-classification":
+            raise ValueError(f"the onnx backend only does image-classification, not {task}")
+        from .onnx_backend import shared_classifier  # onnxruntime is optional
+        return LocalPipelineClient(shared_classifier(model_id))
+
+    def release(self, model_id, task):
+        from .onnx_backend import release
+        release(model_id)
+
+    def identity(self, model_id, task):
+        return "onnx-int8"  # shared_classifier is always the quantized one
+
+
+class ProcessBackend(Backend):
+    # same local pipelines, but in HF_PROC_WORKERS worker processes (HF_PROC_THREADS threads
+    # each). pictures travel through shared memory. see procpool.py
+    name = "local-procs"
+
+    @staticmethod
+    def _runtime(task):
+        return "onnx" if task == "image-classification" and os.getenv("HF_IMAGE_RUNTIME") == "onnx" else "torch"
+
+    def make_client(self, model_id, task):
+        from .procpool import shared_process_pool
+        return LocalPipelineClient(shared_process_pool(task, model_id, self._runtime(task)))
+
+    def release(self, model_id, task):
+        from .procpool import release_process_pool
+        release_process_pool(task, model_id, self._runtime(task))
+
+    def identity(self, model_id, task):
+        # the workers' onnx models are int8 too
+        return "local-procs-onnx-int8" if self._runtime(task) == "onnx" else self.name
+
+
+BACKENDS = {
+    "hosted": HostedBackend,
+    "local": LocalBackend,
+    "onnx": OnnxBackend,
+    "local-procs": ProcessBackend,
+}
+
+def get_backend(name: str) -> Backend:
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"unknown backend {name!r}, pick one of {list(BACKENDS)}")
@@ -1,63 +1,402 @@
 
 # ok so this file has the model base class.
 from __future__ import annotations
-import os, time
+import asyncio, atexit, inspect, logging, logging.handlers, os, queue, sys, time
 from abc import ABC, abstractmethod
-from typing import Any
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable
 
-from huggingface_hub import InferenceClient
+from .backends import get_backend
+from .cache import make_key
+from .dedup import Reused
+from .metrics import default_metrics
+from .profiling import default_profiler
+from .singleflight import default_group
 
 # --- decorators that i re-use ---
 def timed(fn):
-    # i like to see how long stuff takes. probably not super accurate but meh.
+    # i like to see how long stuff takes. perf_counter_ns is the accurate clock (time.time() jumps around)
+    # works on async functions too (needed for arun)
+    if inspect.iscoroutinefunction(fn):
+        async def aw(*a, **k):
+            t0 = time.perf_counter_ns()
+            out = await fn(*a, **k)
+            return out, (time.perf_counter_ns() - t0) / 1e6
+        return aw
     def w(*a, **k):
-        t0 = time.time()
+        t0 = time.perf_counter_ns()
         out = fn(*a, **k)
-        ms = (time.time() - t0) * 1000
-        return out, ms
+        return out, (time.perf_counter_ns() - t0) / 1e6
     return w
 
+def _check_loaded(self):
+    if getattr(self, "_client", None) is None:
+        raise RuntimeError("uh oh, model not loaded. do self.load() first pls.")
+
 def ensure_loaded(fn):
     # this just yells at me if i forgot to call .load()
+    if inspect.iscoroutinefunction(fn):
+        async def aw(self, *a, **k):
+            _check_loaded(self)
+            return await fn(self, *a, **k)
+        return aw
     def w(self, *a, **k):
-        if getattr(self, "_client", None) is None:
-            raise RuntimeError("uh oh, model not loaded. do self.load() first pls.")
+        _check_loaded(self)
         return fn(self, *a, **k)
     return w
 
-# i wanted logging too but didn't want to import logging module lol
+# logging. messages go on a queue and a background thread prints them, so a slow
+# terminal never holds up a request. HF_LOG_LEVEL=DEBUG shows the chatty per-request stuff.
+_logger = logging.getLogger("hit137")
+_listener = None
+
+def _setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+    q = queue.SimpleQueue()
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(logging.Formatter("[log] %(message)s"))
+    _listener = logging.handlers.QueueListener(q, out)
+    _listener.start()
+    atexit.register(_listener.stop)  # flush whatever is left when we quit
+    _logger.addHandler(logging.handlers.QueueHandler(q))
+    _logger.setLevel(os.getenv("HF_LOG_LEVEL", "INFO").upper())
+    _logger.propagate = False
+
+_setup_logging()
+
 class LoggingMixin:
-    def log(self, msg):
-        print("[log]", msg)  # TODO: make fancy later maybe
+    def log(self, msg, *args, level=logging.DEBUG):
+        # use log("x=%s", x) style so the string only gets built if someone will see it
+        if _logger.isEnabledFor(level):
+            _logger.log(level, msg, *args)
 
 class BaseHFModel(ABC):
     TASK = ""  # i set this in the kids
+    # batch knobs. kids can change these (images need more preprocess threads than text)
+    PREPROCESS_WORKERS = 2
+    MAX_IN_FLIGHT = 8
+    # async knobs. if _preprocess chews cpu (image decoding) it goes to an executor
+    # so it doesn't block the event loop
+    PREPROCESS_IN_EXECUTOR = False
+    ASYNC_CONCURRENCY = 64
 
-    def __init__(self, model_id: str):
+    def __init__(self, model_id: str, backend: str = "hosted"):
         # these underscores make it look private
         self._model_id = model_id
+        self._backend = get_backend(backend)  # hosted (hf api) or local (transformers on our cpu)
         self._client = None
+        self._aclient = None  # async client, made on first arun
         self._loaded = False
+        self._cache = None  # optional ResultCache, see set_cache()
+        self._flights = default_group()  # same request already in flight -> share it
+        self._metrics = default_metrics()  # per stage timings, see models/metrics.py
+        self._hedger = None  # optional transport.Hedger, see set_hedging()
+        self._sink = None  # optional store.PredictionStore, see set_sink()
+        self._profiler = default_profiler()  # only does anything once armed, see models/profiling.py
 
     @property
     def model_id(self):
         return self._model_id
 
+    @property
+    def backend(self):
+        return self._backend.name
+
+    def _key(self, stuff):
+        # cache + single-flight key. the backend is in it, int8 onnx answers aren't the hosted ones
+        return make_key(self._model_id, self.TASK, stuff, self._backend.identity(self._model_id, self.TASK))
+
     def load(self):
-        token = os.getenv("HF_TOKEN")
-        if not token:
-            # i keep forgetting this so the message is loud
-            raise EnvironmentError("NO HF_TOKEN SET. get one from huggingface and export HF_TOKEN")
-        self._client = InferenceClient(model=self._model_id, token=token)
+        client = self._backend.make_client(self._model_id, self.TASK)
+        if self._loaded:
+            # loaded twice: the backend counts holds on shared pipelines, keep just the one
+            self._backend.release(self._model_id, self.TASK)
+        self._client = client
         self._loaded = True
-        self.log(f"loaded {self._model_id} (i think)")
+        warm_ms = self._backend.warm_up(self._model_id)
+        if warm_ms is not None:
+            self.log("warm-up took %.0fms", warm_ms, level=logging.INFO)
+        self.log("loaded %s on %s (i think)", self._model_id, self._backend.name, level=logging.INFO)
+
+    def unload(self):
+        # give the memory back (the model pool calls this when it evicts). load() again to reuse
+        was_loaded, self._loaded = self._loaded, False
+        self._client = None
+        self._aclient = None
+        if was_loaded:  # unload twice must not give back someone else's hold
+            self._backend.release(self._model_id, self.TASK)
+
+    def set_cache(self, cache):
+        # pass a ResultCache (or None to turn it off again)
+        self._cache = cache
+        return self
+
+    def set_coalescing(self, group):
+        # pass a SingleFlight (or None to always send every request)
+        self._flights = group
+        return self
+
+    def set_hedging(self, hedger):
+        # pass a transport.Hedger: slow calls (past this model's p95) get a backup copy sent
+        self._hedger = hedger
+        return self
+
+    def set_sink(self, sink):
+        # pass a store.PredictionStore (or None). every result's labels + scores get appended to it
+        self._sink = sink
+        return self
+
+    def set_profiler(self, profiler):
+        # pass a profiling.Profiler (or None to never profile this model)
+        self._profiler = profiler
+        return self
+
+    def set_metrics(self, metrics):
+        # swap in a different Metrics (benchmarks use a fresh one per scenario)
+        self._metrics = metrics
+        return self
 
     # this is the "template method" thing
     def run(self, input_data: Any):
+        prof = self._profiler
+        if prof is not None and prof.pending:
+            # armed: cProfile + tracemalloc around the whole thing, the report path goes in the result
+            with prof.capture(f"{self.TASK}-{self._model_id}") as paths:
+                out = self._run(input_data)
+            return dict(out, profile=paths[0]) if paths else out
+        return self._run(input_data)
+
+    def _run(self, input_data):
+        try:
+            stuff = self._timed_preprocess(input_data)
+            return self._run_processed(stuff)
+        except Exception:
+            self._metrics.inc(self._model_id, "errors")
+            raise
+
+    def prepare(self, input_data):
+        # just the preprocess step (timed). the server does this itself, then batches
+        return self._timed_preprocess(input_data)
+
+    def _timed_preprocess(self, input_data):
+        t0 = time.perf_counter_ns()
         stuff = self._preprocess(input_data)
-        raw, when_ms = self._predict_timed(stuff)
+        self._metrics.observe(self._model_id, "preprocess", (time.perf_counter_ns() - t0) / 1e6)
+        return stuff
+
+    # the bit after preprocess. split out so the batch path can share it
+    def _run_processed(self, stuff):
+        key = self._key(stuff)
+        hit = self._from_cache(key)
+        if hit is not None:
+            return hit
+        if self._flights is None:
+            return self._result(*self._fetch(key, stuff), key=key)
+        (raw, when_ms), shared = self._flights.do(key, lambda: self._fetch(key, stuff))
+        return self._result(raw, when_ms, coalesced=shared, key=key)
+
+    def _from_cache(self, key):
+        # result dict on a hit, None on a miss (or no cache)
+        if self._cache is None:
+            return None
+        t0 = time.perf_counter()
+        raw = self._cache.get(key)
+        if raw is None:
+            return None
+        # cache hit, no network at all. latency here is just the lookup
+        return self._result(raw, (time.perf_counter() - t0) * 1000, cached=True, key=key)
+
+    def _fetch(self, key, stuff):
+        # the real upstream call. with coalescing on only one caller per key gets here
+        if self._hedger is not None:
+            p95 = self._metrics.hist(self._model_id, "predict").percentile(0.95)
+            raw, when_ms = self._hedger.call(self._predict_timed, stuff, delay_ms=p95)
+        else:
+            raw, when_ms = self._predict_timed(stuff)
+        if isinstance(raw, Reused):
+            return raw, when_ms  # no model call happened, not a predict time and not for the cache
+        self._metrics.observe(self._model_id, "predict", when_ms)
+        if self._cache is not None:
+            self._cache.put(key, raw)
+        return raw, when_ms
+
+    def _result(self, raw, when_ms, cached=False, coalesced=False, key=None):
+        extra = {}
+        if isinstance(raw, Reused):
+            # a lookalike's answer (models/dedup.py): no model call, so it counts as cached
+            extra = {"reused": True, "near_duplicate_of": raw.of, "near_duplicate_bits": raw.distance}
+            raw, cached = raw.raw, True
+        t0 = time.perf_counter_ns()
         nice = self._postprocess(raw)
-        return {"output": nice, "latency_ms": round(when_ms, 2), "model_id": self._model_id, "task": self.TASK}
+        self._metrics.observe(self._model_id, "postprocess", (time.perf_counter_ns() - t0) / 1e6)
+        self._metrics.inc(self._model_id, "cached" if cached else "coalesced" if coalesced else "upstream")
+        if self._sink is not None:
+            try:
+                self._sink.record(self._model_id, self.TASK, self._label_scores(raw), when_ms,
+                                  key.rsplit("|", 1)[-1] if key else None, cached, coalesced)
+            except Exception as e:
+                _logger.info("couldn't store the prediction: %s", e)  # the answer still goes back
+        return {"output": nice, "latency_ms": round(when_ms, 2), "cached": cached, "coalesced": coalesced,
+                "model_id": self._model_id, "task": self.TASK, **extra}
+
+    def _label_scores(self, raw):
+        # (label, score) pairs out of a raw answer, for the sink. kids with other shapes override it
+        return [(r.get("label", "?"), r.get("score", 0.0)) for r in raw or ()]
+
+    def _error_result(self, err):
+        # per-item error so one bad row doesn't kill the whole batch
+        self._metrics.inc(self._model_id, "errors")
+        return {"error": str(err), "latency_ms": None, "model_id": self._model_id, "task": self.TASK}
+
+    def run_processed_batch(self, stuffs):
+        # for the micro-batcher: already preprocessed items in, one result dict per item out.
+        # cache is checked per item, duplicates inside the batch are only sent once,
+        # and everything left goes through ONE _predict_many call.
+        out = [None] * len(stuffs)
+        todo = {}  # key -> indexes that want it
+        for i, stuff in enumerate(stuffs):
+            key = self._key(stuff)
+            hit = self._from_cache(key)
+            if hit is not None:
+                out[i] = hit
+            else:
+                todo.setdefault(key, []).append(i)
+        if todo:
+            keys = list(todo)
+            raws, when_ms = self._predict_many_timed([stuffs[todo[k][0]] for k in keys])
+            self._metrics.observe(self._model_id, "predict", when_ms)
+            for key, raw in zip(keys, raws):
+                for n, i in enumerate(todo[key]):
+                    if isinstance(raw, Exception):
+                        out[i] = self._error_result(raw)
+                        continue
+                    if n == 0 and self._cache is not None and not isinstance(raw, Reused):
+                        self._cache.put(key, raw)
+                    out[i] = dict(self._result(raw, when_ms, coalesced=n > 0, key=key), batch_size=len(keys))
+        return out
+
+    def _predict_many(self, processed_list, predict=None):
+        # default: one _predict (or `predict`) per item, but at the same time. kids with a real batch
+        # call (local pipelines) override this. gives back raw outputs, or the Exception for that item
+        predict = predict or self._predict
+        def one(p):
+            try:
+                return predict(p)
+            except Exception as e:
+                return e
+        if len(processed_list) == 1:
+            return [one(processed_list[0])]
+        with ThreadPoolExecutor(min(len(processed_list), self.MAX_IN_FLIGHT)) as pool:
+            return list(pool.map(one, processed_list))
+
+    def run_batch(self, inputs: Iterable[Any], max_in_flight: int = None, preprocess_workers: int = None):
+        # same as run() for every item, but lots of them at once. results come back in order.
+        return list(self.run_many(inputs, max_in_flight, preprocess_workers))
+
+    def run_many(self, inputs: Iterable[Any], max_in_flight: int = None, preprocess_workers: int = None):
+        # generator version of run_batch. only keeps a small window of items going
+        # so a huge iterable doesn't turn into a huge pile of futures.
+        n_pred = max(1, max_in_flight or self.MAX_IN_FLIGHT)
+        n_pre = max(1, preprocess_workers or self.PREPROCESS_WORKERS)
+        window = n_pred * 2
+
+        def one(pre_future):
+            # runs on the predict pool, waits for its own preprocess first
+            try:
+                stuff = pre_future.result()
+                return self._run_processed(stuff)
+            except Exception as e:
+                return self._error_result(e)
+
+        with ThreadPoolExecutor(n_pre, thread_name_prefix="hf-pre") as pre_pool, \
+                ThreadPoolExecutor(n_pred, thread_name_prefix="hf-predict") as pred_pool:
+            pending = deque()
+            for i, x in enumerate(inputs):
+                pending.append((i, pred_pool.submit(one, pre_pool.submit(self._timed_preprocess, x))))
+                if len(pending) >= window:
+                    j, fut = pending.popleft()
+                    yield dict(fut.result(), index=j)
+            while pending:
+                j, fut = pending.popleft()
+                yield dict(fut.result(), index=j)
+
+    # --- async stuff. one event loop, lots of requests, no thread per request ---
+    def _get_aclient(self):
+        if self._aclient is None:
+            self._aclient = self._backend.make_async_client(self._model_id, self.TASK)
+        return self._aclient
+
+    async def arun(self, input_data: Any, sem: asyncio.Semaphore = None):
+        try:
+            if sem is None:
+                return await self._arun_one(input_data)
+            async with sem:
+                return await self._arun_one(input_data)
+        except Exception:
+            self._metrics.inc(self._model_id, "errors")
+            raise
+
+    async def _arun_one(self, input_data):
+        if self.PREPROCESS_IN_EXECUTOR:
+            loop = asyncio.get_running_loop()
+            stuff = await loop.run_in_executor(None, self._timed_preprocess, input_data)
+        else:
+            stuff = self._timed_preprocess(input_data)
+        key = self._key(stuff)
+        hit = self._from_cache(key)
+        if hit is not None:
+            return hit
+        if self._flights is None:
+            return self._result(*await self._afetch(key, stuff), key=key)
+        (raw, when_ms), shared = await self._flights.ado(key, lambda: self._afetch(key, stuff))
+        return self._result(raw, when_ms, coalesced=shared, key=key)
+
+    async def _afetch(self, key, stuff):
+        if self._get_aclient() is None:
+            # backend has no async client (local pipeline), so the sync call goes on a thread
+            loop = asyncio.get_running_loop()
+            raw, when_ms = await loop.run_in_executor(None, self._predict_timed, stuff)
+        else:
+            raw, when_ms = await self._apredict_timed(stuff)
+        if isinstance(raw, Reused):
+            return raw, when_ms
+        self._metrics.observe(self._model_id, "predict", when_ms)
+        if self._cache is not None:
+            self._cache.put(key, raw)
+        return raw, when_ms
+
+    async def arun_many(self, inputs: Iterable[Any], concurrency: int = None):
+        # like run_batch but async. ordered results, errors per item
+        sem = asyncio.Semaphore(max(1, concurrency or self.ASYNC_CONCURRENCY))
+
+        async def one(i, x):
+            try:
+                async with sem:
+                    res = await self._arun_one(x)
+            except Exception as e:
+                res = self._error_result(e)
+            return dict(res, index=i)
+
+        return await asyncio.gather(*(one(i, x) for i, x in enumerate(inputs)))
+
+    async def aclose(self):
+        if self._aclient is not None:
+            close = getattr(self._aclient, "close", None)
+            if close is not None:
+                await close()
+            self._aclient = None
+
+    async def _apredict(self, processed):
+        # kids override this with the async client call
+        raise NotImplementedError(f"{type(self).__name__} has no async predict")
+
+    @timed
+    @ensure_loaded
+    async def _apredict_timed(self, processed):
+        return await self._apredict(processed)
 
     # the kids have to write these themselves (override!)
     @abstractmethod
@@ -72,3 +411,8 @@ class BaseHFModel(ABC):
     @ensure_loaded
     def _predict_timed(self, processed):
         return self._predict(processed)
+
+    @timed
+    @ensure_loaded
+    def _predict_many_timed(self, processed_list):
+        return self._predict_many(processed_list)
@@ -0,0 +1,84 @@
+# dynamic micro-batching. requests that show up at about the same time get glued
+# together into one list and handed to fn in one go (one forward pass for a local
+# pipeline instead of N). waits at most max_wait_ms for the batch to fill up.
+from __future__ import annotations
+import threading, time
+from collections import deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(self, fn, max_batch: int = 16, max_wait_ms: float = 10.0, name: str = "batcher"):
+        # fn(list_of_items) -> list_of_results, same length and order
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait_ms = max_wait_ms
+        self._q = deque()
+        self._cv = threading.Condition()
+        self._closed = False
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        fut = Future()
+        with self._cv:
+            if self._closed:
+                raise RuntimeError("batcher is closed")
+            self._q.append((item, fut))
+            self._cv.notify()
+        return fut
+
+    def _take(self):
+        # block for the first item, then keep collecting until full or the window runs out
+        with self._cv:
+            while not self._q and not self._closed:
+                self._cv.wait()
+            if not self._q:
+                return None
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(self._q) < self.max_batch and not self._closed:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cv.wait(left)
+            n = min(self.max_batch, len(self._q))
+            return [self._q.popleft() for _ in range(n)]
+
+    def _loop(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            # drop anything the caller already gave up on
+            batch = [(x, f) for x, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            self.largest = max(self.largest, len(batch))
+            try:
+                results = self.fn([x for x, _ in batch])
+            except Exception as e:
+                for _, f in batch:
+                    f.set_exception(e)
+                continue
+            for (_, f), r in zip(batch, results):
+                f.set_result(r)
+
+    def queue_depth(self):
+        with self._cv:
+            return len(self._q)
+
+    def stats(self):
+        return {"batches": self.batches, "items": self.items, "largest_batch": self.largest,
+                "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "queue_depth": self.queue_depth(), "max_batch": self.max_batch, "max_wait_ms": self.max_wait_ms}
+
+    def close(self):
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        self._thread.join(timeout=5)
@@ -0,0 +1,125 @@
+# result cache so we don't keep asking hf the same thing over and over.
+# memory LRU with a TTL in front, optional sqlite file behind it so it survives restarts.
+from __future__ import annotations
+import hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+def payload_digest(processed: Any) -> str:
+    # hash whatever _preprocess spat out (bytes for images, str for text)
+    h = hashlib.sha256()
+    if isinstance(processed, (bytes, bytearray, memoryview)):
+        h.update(processed)
+    elif isinstance(processed, str):
+        h.update(processed.encode("utf-8"))
+    else:
+        # fallback, hopefully json-able
+        h.update(json.dumps(processed, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def make_key(model_id: str, task: str, processed: Any, backend: str = "hosted") -> str:
+    # backend = Backend.identity(): the same model id on local torch / int8 onnx is another model
+    return f"{model_id}|{backend}|{task}|{payload_digest(processed)}"
+
+
+class ResultCache:
+    def __init__(self, max_items: int = 1024, ttl_s: Optional[float] = 3600, path: Optional[str] = None):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self._mem = OrderedDict()  # key -> (expires_at, raw)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = None
+        if path:
+            d = os.path.dirname(path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            # one connection shared between threads, the lock keeps it sane
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (k TEXT PRIMARY KEY, expires REAL, raw TEXT)")
+            self._db.commit()
+
+    def _expiry(self):
+        return time.time() + self.ttl_s if self.ttl_s else None
+
+    def get(self, key: str):
+        # returns the raw model output or None
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                exp, raw = hit
+                if exp is None or exp > now:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return raw
+                del self._mem[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT expires, raw FROM results WHERE k=?", (key,)).fetchone()
+                if row is not None:
+                    exp, txt = row
+                    if exp is None or exp > now:
+                        raw = json.loads(txt)
+                        self._put_mem(key, exp, raw)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return raw
+                    self._db.execute("DELETE FROM results WHERE k=?", (key,))
+                    self._db.commit()
+            self.misses += 1
+            return None
+
+    def put(self, key: str, raw):
+        exp = self._expiry()
+        with self._lock:
+            self._put_mem(key, exp, raw)
+            if self._db is not None:
+                try:
+                    txt = json.dumps(raw, default=str)
+                except (TypeError, ValueError):
+                    return  # can't store it on disk, memory is still fine
+                self._db.execute("INSERT OR REPLACE INTO results (k, expires, raw) VALUES (?, ?, ?)", (key, exp, txt))
+                self._db.commit()
+
+    def _put_mem(self, key, exp, raw):
+        # caller holds the lock
+        self._mem[key] = (exp, raw)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "evictions": self.evictions, "size": len(self._mem)}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_cache() -> ResultCache:
+    # one cache for the whole app. set HF_RESULT_CACHE=some/file.sqlite to keep it on disk
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ResultCache(path=os.getenv("HF_RESULT_CACHE") or None)
+        return _default
@@ -0,0 +1,117 @@
+# cheap model first, the expensive one only when the cheap one isn't sure.
+# resnet-50 is a lot quicker than the vit and agrees with it most of the time, so every picture
+# goes to resnet and only goes on to the vit when resnet's top score is low or its top two
+# are close. the result says which way it went ("path": "fast" or "escalated").
+from __future__ import annotations
+import threading
+
+from .dedup import Reused
+from .image_classification import ImageClassificationModel
+
+
+def confidence(raw):
+    # (top-1 score, top-1 minus top-2) of one classifier answer
+    scores = sorted((r["score"] for r in raw or ()), reverse=True)
+    if not scores:
+        return 0.0, 0.0
+    return scores[0], scores[0] - (scores[1] if len(scores) > 1 else 0.0)
+
+
+class CascadeModel(ImageClassificationModel):
+    # below either of these and the slow model gets asked too
+    MIN_SCORE = 0.5
+    MIN_MARGIN = 0.2
+
+    def __init__(self, model_id="microsoft/resnet-50", slow_id="google/vit-base-patch16-224",
+                 backend="hosted", min_score=None, min_margin=None, mode="passthrough"):
+        self.min_score = self.MIN_SCORE if min_score is None else min_score
+        self.min_margin = self.MIN_MARGIN if min_margin is None else min_margin
+        # both get the same preprocessed picture (they both look at 224x224)
+        self._fast = ImageClassificationModel(model_id, mode=mode, backend=backend)
+        self._slow = ImageClassificationModel(slow_id, mode=mode, backend=backend)
+        self._models = [self._fast, self._slow]
+        # the thresholds go in the id so cached answers from other settings aren't reused
+        super().__init__(f"{model_id}>{slow_id}@{self.min_score:g}/{self.min_margin:g}", mode=mode, backend=backend)
+        self._lock = threading.Lock()
+        self.counts = {"fast": 0, "escalated": 0}
+
+    def load(self):
+        for m in self._models:
+            m.load()
+        self._client = self._fast._client  # so ensure_loaded is happy
+        self._loaded = True
+        self.log("cascade %s -> %s loaded", self._fast.model_id, self._slow.model_id)
+
+    def unload(self):
+        for m in self._models:
+            m.unload()
+        self._client = None
+        self._loaded = False
+
+    def _unsure(self, raw):
+        score, margin = confidence(raw)
+        return score < self.min_score or margin < self.min_margin
+
+    def _combine(self, fast, slow=None):
+        path = "escalated" if slow is not None else "fast"
+        with self._lock:
+            self.counts[path] += 1
+        self._metrics.inc(self._model_id, f"cascade_{path}")
+        score, margin = confidence(fast)
+        return {"path": path,
+                "model": self._slow.model_id if slow is not None else self._fast.model_id,
+                "fast_score": round(score, 4), "fast_margin": round(margin, 4),
+                "predictions": slow if slow is not None else fast}
+
+    def _classify(self, processed):
+        fast = self._fast._predict(processed)
+        if not self._unsure(fast):
+            return self._combine(fast)
+        self.log("cascade: not sure (%.3f / %.3f), asking %s", *confidence(fast), self._slow.model_id)
+        return self._combine(fast, self._slow._predict(processed))
+
+    def _classify_many(self, processed_list):
+        # one batch through the fast model, then one batch of just the unsure ones through the slow one
+        fast = self._fast._predict_many(processed_list)
+        redo = [i for i, r in enumerate(fast) if not isinstance(r, Exception) and self._unsure(r)]
+        slow = dict(zip(redo, self._slow._predict_many([processed_list[i] for i in redo]))) if redo else {}
+        out = []
+        for i, r in enumerate(fast):
+            s = slow.get(i)
+            if isinstance(r, Exception) or isinstance(s, Exception):
+                out.append(s if isinstance(s, Exception) else r)
+            else:
+                out.append(self._combine(r, s))
+        return out
+
+    def _get_aclient(self):
+        # only go async if both halves can
+        a, b = self._fast._get_aclient(), self._slow._get_aclient()
+        return a if a is not None and b is not None else None
+
+    async def _aclassify(self, processed):
+        fast = await self._fast._apredict(processed)
+        if not self._unsure(fast):
+            return self._combine(fast)
+        return self._combine(fast, await self._slow._apredict(processed))
+
+    def _postprocess(self, raw):
+        out = super()._postprocess(raw.get("predictions"))
+        who = raw["model"].split("/")[-1]
+        if raw["path"] == "fast":
+            return f"{out} via {who}"
+        return f"{out} via {who} (first one unsure, {raw['fast_score']:.2f})"
+
+    def _label_scores(self, raw):
+        return super()._label_scores(raw.get("predictions"))
+
+    def _result(self, raw, when_ms, cached=False, coalesced=False, key=None):
+        out = super()._result(raw, when_ms, cached, coalesced, key)
+        out["path"] = (raw.raw if isinstance(raw, Reused) else raw)["path"]
+        return out
+
+    def stats(self):
+        with self._lock:
+            n = self.counts["fast"] + self.counts["escalated"]
+            return {**self.counts, "escalation_rate": round(self.counts["escalated"] / n, 3) if n else None,
+                    "min_score": self.min_score, "min_margin": self.min_margin}
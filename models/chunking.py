@@ -0,0 +1,93 @@
+# long text -> overlapping windows that each fit the model (distilbert only reads 512
+# tokens and quietly drops the rest), and the window scores -> one answer again.
+# everything here is a generator, so a huge report is never tokenized / sent all at once.
+from __future__ import annotations
+import re
+from collections import deque
+from itertools import islice
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+APPROX_PIECE = 6  # no tokenizer: long words count as one token per 6 chars (wordpiece-ish, on the safe side)
+
+
+class LongText(str):
+    # marks a text that needs windows. still a plain str for cache keys / json
+    pass
+
+
+def approx_spans(text):
+    # (start, end) char offsets of rough "tokens": words, punctuation, long words in pieces
+    for m in _PIECES.finditer(text):
+        s, e = m.span()
+        for i in range(s, e, APPROX_PIECE):
+            yield i, min(i + APPROX_PIECE, e)
+
+
+def tokenizer_spans(tokenizer, text, segment_chars=20000):
+    # real token offsets from a fast tokenizer, a segment at a time (cut at a space)
+    pos = 0
+    while pos < len(text):
+        end = min(len(text), pos + segment_chars)
+        if end < len(text):
+            cut = text.rfind(" ", pos, end)
+            if cut > pos:
+                end = cut
+        enc = tokenizer(text[pos:end], add_special_tokens=False, return_offsets_mapping=True)
+        for s, e in enc["offset_mapping"]:
+            if e > s:
+                yield pos + s, pos + e
+        pos = end
+
+
+def fits(spans, max_tokens):
+    # stops counting as soon as it's over
+    return next(islice(spans, max_tokens, None), None) is None
+
+
+def iter_windows(text, spans, size, overlap):
+    # yields (window text, weight). windows are `size` tokens and share `overlap` with the one
+    # before. weight = tokens the window adds, so overlapping bits aren't counted twice
+    if not 0 <= overlap < size:
+        raise ValueError(f"overlap has to be 0..{size - 1}, got {overlap}")
+    buf = deque()
+    fresh = 0
+    for span in spans:
+        buf.append(span)
+        fresh += 1
+        if len(buf) == size:
+            yield text[buf[0][0]:buf[-1][1]], fresh
+            for _ in range(size - overlap):
+                buf.popleft()
+            fresh = 0
+    if fresh:
+        yield text[buf[0][0]:buf[-1][1]], fresh
+
+
+def batched(it, n):
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Vote:
+    # length weighted average of each label's score over the windows
+    def __init__(self):
+        self.totals = {}
+        self.weight = 0
+        self.windows = 0
+
+    def add(self, weight, raw):
+        self.weight += weight
+        self.windows += 1
+        for r in raw:
+            self.totals[r["label"]] = self.totals.get(r["label"], 0.0) + weight * r["score"]
+
+    def result(self):
+        # same shape as one normal answer, so _postprocess doesn't care
+        if not self.weight:
+            return []
+        out = [{"label": k, "score": v / self.weight} for k, v in self.totals.items()]
+        return sorted(out, key=lambda r: r["score"], reverse=True)
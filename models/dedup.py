@@ -0,0 +1,182 @@
+# near duplicate pictures (the same frame saved twice, a re-compressed jpeg, a resized copy)
+# get the answer we already have instead of going to the model again. the result cache only
+# catches byte-for-byte copies, this compares what the pictures look like.
+# dhash: 9x8 grayscale thumbnail, one bit per "is this pixel brighter than the next one" = 64 bits.
+# similar pictures -> hashes a few bits apart (hamming distance).
+# lookups use multi-index hashing: the 64 bits are cut into max_distance + 1 bands, and two
+# hashes within max_distance bits must have at least one band exactly the same, so only the
+# entries sharing a band get compared instead of all of them.
+# 64 bits of brightness steps can't tell every picture apart: anything plain (one colour, a
+# small shape on a blank page) hashes to (nearly) all zeros. so pictures with too little detail
+# aren't hashed at all, and a hit also needs a 4x4 colour thumbnail to match (a black circle and
+# a red square on white can share a hash, they don't share colours).
+# off unless HF_NEAR_DUP is set: a wrong answer handed out silently is worse than a slow one.
+from __future__ import annotations
+import os, threading, time
+from collections import OrderedDict
+from io import BytesIO
+
+HASH_BITS = 64
+MIN_DETAIL = 4.0  # mean brightness step (0-255) between neighbouring hash pixels, below = too plain
+COLOUR_TOLERANCE = 32  # biggest allowed difference (0-255) in any cell + channel of the colour thumbnails
+
+if hasattr(int, "bit_count"):
+    _popcount = int.bit_count
+else:  # python < 3.10
+    def _popcount(x):
+        return bin(x).count("1")
+
+
+def _open(image):
+    # image: a PIL image, or encoded bytes (jpegs are only decoded at 1/8 size for this)
+    from PIL import Image
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(BytesIO(image))
+        image.draft("RGB", (64, 64))
+    return image
+
+
+def _hash_and_detail(image):
+    from PIL import Image
+    px = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    h, steps = 0, 0
+    for row in range(8):
+        for col in range(8):
+            a, b = px[row * 9 + col], px[row * 9 + col + 1]
+            h = (h << 1) | (a > b)
+            steps += abs(a - b)
+    return h, steps / 64
+
+
+def dhash(image) -> int:
+    return _hash_and_detail(_open(image))[0]
+
+
+def fingerprint(image):
+    # (dhash, colour thumbnail bytes), or None if the picture is too plain to be told apart
+    # from other plain pictures by its hash (then it just goes to the model)
+    from PIL import Image
+    image = _open(image)
+    h, detail = _hash_and_detail(image)
+    if detail < MIN_DETAIL:
+        return None
+    return h, image.convert("RGB").resize((4, 4), Image.BOX).tobytes()
+
+
+def colours_match(a, b, tolerance=COLOUR_TOLERANCE) -> bool:
+    # None on either side = nothing to compare (added without one), trust the hash
+    return a is None or b is None or max(abs(x - y) for x, y in zip(a, b)) <= tolerance
+
+
+class Reused:
+    # an answer taken from a lookalike picture instead of asking the model. it travels like
+    # any raw answer, BaseHFModel._result unwraps it (counted as cached, marked in the result)
+    __slots__ = ("raw", "distance", "of")
+
+    def __init__(self, raw, distance, of=None):
+        self.raw = raw
+        self.distance = distance  # hash bits apart
+        self.of = of  # input hash (first 16 hex of the payload sha256) of the picture it came from
+
+
+def hamming(a: int, b: int) -> int:
+    return _popcount(a ^ b)
+
+
+class NearDuplicateIndex:
+    def __init__(self, max_distance: int = 4, max_items: int = 4096):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"max_distance has to be 0..{HASH_BITS - 1}, got {max_distance}")
+        self.max_distance = max_distance
+        self.max_items = max_items
+        n = max_distance + 1
+        # (shift, mask) per band, bands as even as 64 bits allow
+        edges = [round(i * HASH_BITS / n) for i in range(n + 1)]
+        self._bands = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+        self._tables = [{} for _ in self._bands]  # band value -> set of hashes
+        self._items = OrderedDict()  # hash -> (stored value, colour), least recently used first
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.colour_rejects = 0  # hash close enough but the colours weren't
+        self.compared = 0
+        self.evictions = 0
+        self.lookup_ns = 0
+
+    def _keys(self, h):
+        return [(h >> shift) & mask for shift, mask in self._bands]
+
+    def lookup(self, h: int, colour: bytes = None):
+        # (stored value, distance) of the closest picture within max_distance whose colours
+        # match too, or None
+        t0 = time.perf_counter_ns()
+        with self._lock:
+            near = [(0, h)] if h in self._items else []
+            seen = {h}
+            for table, k in zip(self._tables, self._keys(h)):
+                for cand in table.get(k, ()):
+                    if cand in seen:
+                        continue
+                    seen.add(cand)
+                    d = hamming(h, cand)
+                    if d <= self.max_distance:
+                        near.append((d, cand))
+            self.compared += len(seen) - 1
+            self.lookups += 1
+            found = None
+            for d, cand in sorted(near):
+                value, stored = self._items[cand]
+                if colours_match(colour, stored):
+                    self._items.move_to_end(cand)
+                    self.hits += 1
+                    found = (value, d)
+                    break
+                self.colour_rejects += 1
+            self.lookup_ns += time.perf_counter_ns() - t0
+            return found
+
+    def add(self, h: int, value, colour: bytes = None):
+        with self._lock:
+            if h in self._items:
+                self._items[h] = (value, colour)
+                self._items.move_to_end(h)
+                return
+            self._items[h] = (value, colour)
+            for table, k in zip(self._tables, self._keys(h)):
+                table.setdefault(k, set()).add(h)
+            while len(self._items) > self.max_items:
+                old, _ = self._items.popitem(last=False)
+                for table, k in zip(self._tables, self._keys(old)):
+                    bucket = table[k]
+                    bucket.discard(old)
+                    if not bucket:
+                        del table[k]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            for t in self._tables:
+                t.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._items), "max_items": self.max_items, "max_distance": self.max_distance,
+                    "lookups": self.lookups, "hits": self.hits, "colour_rejects": self.colour_rejects,
+                    "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else None,
+                    "lookup_us_avg": round(self.lookup_ns / self.lookups / 1000, 2) if self.lookups else None,
+                    "compared_avg": round(self.compared / self.lookups, 1) if self.lookups else None,
+                    "evictions": self.evictions}
+
+
+def default_dedup():
+    # a new index (one per model, answers from different models don't mix), or None.
+    # off unless HF_NEAR_DUP = max hamming distance (4 is a good start)
+    setting = os.getenv("HF_NEAR_DUP", "off").strip().lower()
+    if setting in ("off", "no", "none", ""):
+        return None
+    return NearDuplicateIndex(max_distance=int(setting),
+                              max_items=int(os.getenv("HF_NEAR_DUP_ITEMS", "4096")))
@@ -0,0 +1,170 @@
+# decoded pictures, kept around so showing the thumbnail, classifying, re-classifying and
+# switching models don't each read + decode the same file again.
+# key is (path, mtime, size): if the file changes on disk it's simply a new entry.
+# everything counts against a byte budget, least recently used goes first.
+from __future__ import annotations
+import os, threading
+from collections import OrderedDict
+
+
+def _size_of(v):
+    # rough bytes for the things we store (PIL images, bytes)
+    if isinstance(v, (bytes, bytearray)):
+        return len(v)
+    if isinstance(v, tuple):
+        return sum(_size_of(x) for x in v)
+    size = getattr(v, "size", None)
+    if isinstance(size, tuple) and len(size) == 2:
+        return size[0] * size[1] * len(v.getbands())
+    return 64  # small stuff, doesn't matter
+
+
+def shrink(im, short_side):
+    # short side down to short_side (what the model resizes to anyway). None if already that small.
+    # an unloaded jpeg gets decoded at 1/2, 1/4 or 1/8 size (draft mode), way faster than full size
+    from PIL import Image
+    w, h = im.size
+    scale = short_side / min(w, h)
+    if scale >= 1:
+        return None
+    target = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if im.format == "JPEG":
+        im.draft("RGB", target)
+    return im.convert("RGB").resize(target, Image.BILINEAR, reducing_gap=2.0)
+
+
+class _Entry:
+    def __init__(self, path):
+        self.path = path
+        self.values = {}  # name -> value ("rgb" = full decode, anything else = derived)
+        self.nbytes = 0
+
+
+class DecodedImageCache:
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> _Entry
+        self._latest = {}  # abspath -> key, so an edited file drops its old entry right away
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(path):
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+    def _entry(self, key):
+        # caller holds the lock
+        e = self._entries.get(key)
+        if e is None:
+            old = self._latest.get(key[0])
+            if old is not None and old != key:
+                self._drop(old)
+            e = self._entries[key] = _Entry(key[0])
+            self._latest[key[0]] = key
+        self._entries.move_to_end(key)
+        return e
+
+    def _drop(self, key):
+        e = self._entries.pop(key, None)
+        if e is not None:
+            self.nbytes -= e.nbytes
+            if self._latest.get(key[0]) == key:
+                del self._latest[key[0]]
+
+    def get(self, path, name, make):
+        # cached value `name` for this file, or make(entry) once and keep it
+        key = self.key_for(path)
+        with self._lock:
+            e = self._entry(key)
+            if name in e.values:
+                self.hits += 1
+                return e.values[name]
+            self.misses += 1
+        value = make(e)  # decode outside the lock, it's the slow bit
+        size = _size_of(value)
+        with self._lock:
+            # e itself, not just the key: if it was evicted (and maybe made again) while we decoded,
+            # e is an orphan and its bytes mustn't be counted
+            if self._entries.get(key) is e and name not in e.values:
+                e.values[name] = value
+                e.nbytes += size
+                self.nbytes += size
+                self._evict(keep=key)
+        return value
+
+    def _evict(self, keep):
+        while self.nbytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            if oldest == keep and len(self._entries) == 1:
+                self._drop(oldest)  # one picture bigger than the whole budget, can't keep it
+                self.evictions += 1
+                break
+            if oldest == keep:
+                self._entries.move_to_end(oldest)
+                continue
+            self._drop(oldest)
+            self.evictions += 1
+
+    # --- the common ones ---
+    def rgb(self, path):
+        # full size RGB decode
+        def decode(e):
+            from PIL import Image
+            with Image.open(e.path) as im:
+                out = im.convert("RGB")
+            out.load()
+            return out
+        return self.get(path, "rgb", decode)
+
+    def shrunk(self, path, short_side=224):
+        # the downscale mode's decode: straight from the file (so jpeg draft mode still works),
+        # never via the full size rgb. None if the picture is already small enough
+        def make(e):
+            from PIL import Image
+            with Image.open(e.path) as im:
+                out = shrink(im, short_side)
+            if out is not None:
+                out.load()
+            return out
+        return self.get(path, ("shrunk", short_side), make)
+
+    def thumbnail(self, path, size=(400, 300)):
+        def make(e):
+            im = self.rgb(e.path).copy()
+            im.thumbnail(size)
+            return im
+        return self.get(path, ("thumb", tuple(size)), make)
+
+    def resized(self, path, size=(224, 224)):
+        # model input size, same squash-to-square the ViT/ResNet processors do
+        def make(e):
+            from PIL import Image
+            return self.rgb(e.path).resize(tuple(size), Image.BILINEAR)
+        return self.get(path, ("resized", tuple(size)), make)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.nbytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_image_cache() -> DecodedImageCache:
+    # HF_IMAGE_CACHE_MB sets the budget (default 256)
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = DecodedImageCache(int(os.getenv("HF_IMAGE_CACHE_MB", "256")) * 2**20)
+        return _default
@@ -1,33 +1,246 @@
-
 # IMAGE MODEL (classification). i picked a ViT because it sounded cool
+import mmap, os, threading, time
 from io import BytesIO
-from PIL import Image
 from .base import BaseHFModel, LoggingMixin
+from .cache import payload_digest
+from .dedup import Reused, colours_match, fingerprint, hamming
+from .image_cache import shrink
+
+# magic bytes at the start of the file. hf can read these directly so no need to touch them
+_SIGNATURES = {
+    b"\xff\xd8\xff": "jpeg",
+    b"\x89PNG\r\n\x1a\n": "png",
+}
+
+def sniff_format(head: bytes):
+    for sig, fmt in _SIGNATURES.items():
+        if head.startswith(sig):
+            return fmt
+    return None
+
+def read_file(path: str) -> bytes:
+    # mmap so the os hands us the pages, instead of python reading it in chunks
+    with open(path, "rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[:]
+        except ValueError:
+            # mmap refuses empty files
+            raise ValueError(f"image file is empty: {path}")
+
+
+class PrepStats:
+    # counts how many bytes went in vs out and how long encoding took
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.passthrough = 0
+        self.reencoded = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encode_ms = 0.0
+
+    def add(self, n_in, n_out, encode_ms=None):
+        with self._lock:
+            self.images += 1
+            self.bytes_in += n_in
+            self.bytes_out += n_out
+            if encode_ms is None:
+                self.passthrough += 1
+            else:
+                self.reencoded += 1
+                self.encode_ms += encode_ms
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "images": self.images,
+                "passthrough": self.passthrough,
+                "reencoded": self.reencoded,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "out_vs_in": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+                "encode_ms_total": round(self.encode_ms, 2),
+                "encode_ms_avg": round(self.encode_ms / self.reencoded, 2) if self.reencoded else 0.0,
+            }
+
 
 class ImageClassificationModel(LoggingMixin, BaseHFModel):
     TASK = "image-classification"
+    # decoding + encoding pictures actually eats cpu so give it a few threads
+    PREPROCESS_WORKERS = min(4, os.cpu_count() or 1)
+    MAX_IN_FLIGHT = 8
+    PREPROCESS_IN_EXECUTOR = True
+    # "reencode" = old way (always decode + png), "passthrough" = send jpeg/png files as they are,
+    # "downscale" = shrink big pictures to INPUT_SIZE and send a jpeg
+    MODES = ("reencode", "passthrough", "downscale")
+    INPUT_SIZE = 224  # the vit only looks at 224x224 anyway
+    JPEG_QUALITY = 90
+
+    def __init__(self, model_id="google/vit-base-patch16-224", mode="passthrough", input_size=None, backend="hosted"):
+        super().__init__(model_id, backend)
+        if mode not in self.MODES:
+            raise ValueError(f"mode has to be one of {self.MODES}, got {mode!r}")
+        self.mode = mode
+        self.input_size = input_size or self.INPUT_SIZE
+        self.prep_stats = PrepStats()
+        self._image_cache = None
+        self._dedup = None
 
-    def __init__(self, model_id="google/vit-base-patch16-224"):
-        super().__init__(model_id)
+    def set_image_cache(self, cache):
+        # pass a DecodedImageCache (or None). then a path that was already prepared (same
+        # mtime + size) skips the disk read and decode, and the decode is shared with display
+        self._image_cache = cache
+        return self
+
+    def set_dedup(self, index):
+        # pass a dedup.NearDuplicateIndex (or None). a picture that looks like one this model
+        # already answered gets that answer back without asking the model
+        self._dedup = index
+        return self
 
     def _preprocess(self, input_data):
         # i accept either path or bytes. probably could be better.
         if isinstance(input_data, (bytes, bytearray)):
-            data = bytes(input_data)
+            raw = bytes(input_data)
         else:
             if not isinstance(input_data, str):
                 raise ValueError("pls give me an image path (png/jpg)")
-            im = Image.open(input_data).convert("RGB")
+            if self._image_cache is not None:
+                # payload depends on mode + size, so switching vit <-> resnet reuses it
+                cache = self._image_cache
+                def make(e):
+                    # downscale keeps its own small decode (jpeg draft), the rest share the full rgb one
+                    if self.mode == "downscale":
+                        decode = lambda: cache.shrunk(e.path, self.input_size)
+                    else:
+                        decode = lambda: cache.rgb(e.path)
+                    return self._prepare_raw(read_file(e.path), True, decode)
+                return cache.get(input_data, ("payload", self.mode, self.input_size), make)
+            raw = read_file(input_data)
+        return self._prepare_raw(raw, not isinstance(input_data, (bytes, bytearray)))
+
+    def _prepare_raw(self, raw, from_path, decode=None):
+        data, encode_ms = self._encode(raw, from_path, decode)
+        self.prep_stats.add(len(raw), len(data), encode_ms)
+        self.log("image bytes = %d -> %d (%s)", len(raw), len(data), self.mode)
+        return data
+
+    def _encode(self, raw, from_path, decode=None):
+        # returns (bytes to upload, encode time in ms or None if we didn't touch it).
+        # decode: optional callable giving an already decoded picture (from the image cache).
+        # in downscale mode that one is already shrunk (None = small enough as it is)
+        fmt = sniff_format(raw[:8])
+        if not from_path and self.mode != "downscale":
+            return raw, None  # bytes always went straight through, keep that
+        if self.mode == "passthrough" and fmt is not None:
+            return raw, None
+        from PIL import Image  # imported here so startup doesn't pay for PIL
+        t0 = time.perf_counter()
+        if self.mode == "downscale":
+            small = decode() if decode is not None else self._shrink(Image.open(BytesIO(raw)))
+            if small is None and fmt is not None:
+                return raw, None  # already small enough, sending it as is is cheapest
+            im = (small or Image.open(BytesIO(raw))).convert("RGB")
+            buf = BytesIO()
+            im.save(buf, format="JPEG", quality=self.JPEG_QUALITY)
+        else:
+            # bmp and friends (or mode=reencode): png like before
+            im = (decode() if decode is not None else Image.open(BytesIO(raw))).convert("RGB")
             buf = BytesIO()
             im.save(buf, format="PNG")
-            data = buf.getvalue()
-        self.log(f"image bytes = {len(data)}")
-        return data
+        return buf.getvalue(), (time.perf_counter() - t0) * 1000
+
+    def _shrink(self, im):
+        # make the short side input_size (the model resizes to that anyway). None if already small
+        return shrink(im, self.input_size)
+
+    def _near_dup(self, processed):
+        # (fingerprint, Reused answer or None). fingerprint None = too plain to hash (or not
+        # a picture we can open), just ask the model and don't remember it
+        try:
+            fp = fingerprint(processed)
+        except Exception as e:
+            self.log("couldn't hash the picture (%s)", e)
+            return None, None
+        if fp is None:
+            return None, None
+        hit = self._dedup.lookup(*fp)
+        if hit is None:
+            return fp, None
+        (raw, of), distance = hit
+        self._metrics.inc(self._model_id, "near_duplicate")
+        self.log("near duplicate (%d bits off), skipping the model", distance)
+        return fp, Reused(raw, distance, of)
+
+    def _remember(self, fp, raw, processed):
+        if fp is not None and not isinstance(raw, Exception):
+            self._dedup.add(fp[0], (raw, payload_digest(processed)[:16]), fp[1])
 
     def _predict(self, processed):
+        if self._dedup is None:
+            return self._classify(processed)
+        fp, raw = self._near_dup(processed)
+        if raw is None:
+            raw = self._classify(processed)
+            self._remember(fp, raw, processed)
+        return raw
+
+    def _predict_many(self, processed_list):
+        if self._dedup is None:
+            return self._classify_many(processed_list)
+        found = [self._near_dup(p) for p in processed_list]
+        out = [raw for _, raw in found]
+        # lookalikes inside this batch (frames of a stream) only need asking once too
+        todo, same_as = [], {}
+        for i, (fp, raw) in enumerate(found):
+            if raw is not None:
+                continue
+            lead = next((j for j in todo if fp is not None and found[j][0] is not None
+                         and hamming(fp[0], found[j][0][0]) <= self._dedup.max_distance
+                         and colours_match(fp[1], found[j][0][1])), None)
+            if lead is None:
+                todo.append(i)
+            else:
+                same_as[i] = lead
+        if todo:
+            for i, raw in zip(todo, self._classify_many([processed_list[i] for i in todo])):
+                self._remember(found[i][0], raw, processed_list[i])
+                out[i] = raw
+        for i, lead in same_as.items():
+            if isinstance(out[lead], Exception):
+                out[i] = out[lead]
+                continue
+            out[i] = Reused(out[lead], hamming(found[i][0][0], found[lead][0][0]),
+                            payload_digest(processed_list[lead])[:16])
+            self._metrics.inc(self._model_id, "near_duplicate")
+        return out
+
+    async def _apredict(self, processed):
+        if self._dedup is None:
+            return await self._aclassify(processed)
+        fp, raw = self._near_dup(processed)
+        if raw is None:
+            raw = await self._aclassify(processed)
+            self._remember(fp, raw, processed)
+        return raw
+
+    # the actual model calls (the cascade swaps these out)
+    def _classify(self, processed):
         self.log("sending to hf (image-classification) ...")
         return self._client.image_classification(processed)
 
+    def _classify_many(self, processed_list):
+        # local pipelines can do one batched forward pass, the hosted api can't
+        batch = getattr(self._client, "image_classification_batch", None)
+        if batch is None:
+            return super()._predict_many(processed_list, self._classify)
+        return batch(processed_list)
+
+    async def _aclassify(self, processed):
+        self.log("sending to hf async (image-classification) ...")
+        return await self._get_aclient().image_classification(processed)
+
     def _postprocess(self, raw):
         if not raw:
             return "no classes?? weird"
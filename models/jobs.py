@@ -0,0 +1,229 @@
+# a few long-lived worker threads + a priority queue of jobs, for the tk windows.
+# before this every click started its own thread and the buttons were greyed out until it
+# finished. now clicks just queue a job: many can wait / run at once, each one reports
+# progress, and they can be cancelled.
+# workers never touch tk. they drop events in a deque and UiPump (one after() loop on the
+# tk thread) hands them to the callbacks, instead of a pile of after(0, lambda: ...) calls.
+from __future__ import annotations
+import heapq, itertools, logging, threading, time
+from collections import deque
+
+_logger = logging.getLogger("hit137")
+
+# lower runs first
+INTERACTIVE = 0
+NORMAL = 10
+BACKGROUND = 20
+
+
+class Cancelled(Exception):
+    # a job function can raise this (or just return) once it sees job.cancelled
+    pass
+
+
+class Job:
+    def __init__(self, queue, fn, name, priority, on_done=None, on_progress=None):
+        self.id = next(queue._ids)
+        self.name = name or f"job {self.id}"
+        self.priority = priority
+        self.state = "queued"  # queued -> running -> done / failed / cancelled
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.on_done = on_done  # called on the tk thread (through UiPump) with the job
+        self.on_progress = on_progress
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._fn = fn
+        self._queue = queue
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        # a queued job never runs. a running one can't be interrupted halfway through a
+        # model call, it's told to stop (job.cancelled) and its result is thrown away
+        self._queue._cancel(self)
+
+    def report(self, progress, message=None):
+        # from inside the job function. progress is 0..1
+        self.progress = max(0.0, min(1.0, progress))
+        if message is not None:
+            self.message = message
+        self._queue._events.append((self, "progress"))
+        if self.cancelled:
+            raise Cancelled()
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.name!r} {self.state} {self.progress:.0%}>"
+
+
+class JobQueue:
+    def __init__(self, workers: int = 2, name: str = "jobs"):
+        self.workers = workers
+        self.name = name
+        self._heap = []  # (priority, seq, job)
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._threads = []
+        self._closed = False
+        self._events = deque()  # (job, kind), appends/pops are thread safe
+        self._active = set()  # running jobs
+        self.queued = 0
+        self.running = 0
+        self.counts = {"submitted": 0, "done": 0, "failed": 0, "cancelled": 0}
+
+    def submit(self, fn, name=None, priority=NORMAL, on_done=None, on_progress=None) -> Job:
+        # fn(job) runs on a worker; whatever it returns ends up in job.result
+        job = Job(self, fn, name, priority, on_done, on_progress)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("job queue is closed")
+            self._start_workers()
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self.queued += 1
+            self.counts["submitted"] += 1
+            self._cond.notify()
+        self._events.append((job, "queued"))
+        return job
+
+    def _start_workers(self):
+        # caller holds the lock. threads only start on the first job, so opening the window stays quick
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._heap:
+                    return
+                job = heapq.heappop(self._heap)[2]
+                if job.state != "queued":
+                    continue  # cancelled while waiting, already counted
+                self.queued -= 1
+                self.running += 1
+                self._active.add(job)
+                job.state = "running"
+                job.started = time.time()
+            self._events.append((job, "progress"))
+            try:
+                result = job._fn(job)
+                state, job.result = ("cancelled" if job.cancelled else "done"), result
+            except Cancelled:
+                state = "cancelled"
+            except Exception as e:
+                _logger.debug("job %s failed: %s", job.name, e)
+                state, job.error = "failed", e
+            with self._cond:
+                self.running -= 1
+                self._active.discard(job)
+                job.state = state
+                job.finished = time.time()
+                if state == "done":
+                    job.progress = 1.0
+                self.counts[state] += 1
+            self._events.append((job, "done"))
+
+    def _cancel(self, job):
+        with self._cond:
+            job._cancel.set()
+            if job.state != "queued":
+                return  # running ones finish as "cancelled", done ones stay done
+            job.state = "cancelled"
+            job.finished = time.time()
+            self.queued -= 1
+            self.counts["cancelled"] += 1
+        # the heap entry stays, the worker skips it when it comes up
+        self._events.append((job, "done"))
+
+    def cancel_all(self):
+        # queued and running
+        with self._cond:
+            jobs = [j for _, _, j in self._heap if j.state == "queued"] + list(self._active)
+        for j in jobs:
+            j.cancel()
+        return len(jobs)
+
+    def drain_events(self, limit: int = 10000):
+        out = []
+        while self._events and len(out) < limit:
+            out.append(self._events.popleft())
+        return out
+
+    def stats(self):
+        with self._cond:
+            return {"queued": self.queued, "running": self.running, "workers": self.workers, **self.counts}
+
+    def close(self, cancel_pending: bool = True):
+        if cancel_pending:
+            self.cancel_all()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class UiPump:
+    # the only bridge between worker threads and tk. every interval_ms on the tk thread:
+    # hand finished / progressed jobs to their callbacks, then on_tick(stats) (a status line)
+    def __init__(self, widget, queue: JobQueue, interval_ms: int = 50, on_tick=None, on_event=None):
+        self.widget = widget
+        self.queue = queue
+        self.interval_ms = interval_ms
+        self.on_tick = on_tick
+        self.on_event = on_event  # (job, kind) for every event, e.g. to keep a job list up to date
+        self._posted = deque()  # plain functions to run on the tk thread
+        self._running = False
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.widget.after(self.interval_ms, self._tick)
+        return self
+
+    def stop(self):
+        self._running = False
+
+    def post(self, fn, *args):
+        # run fn(*args) on the tk thread at the next tick (safe to call from any thread)
+        self._posted.append((fn, args))
+
+    def _tick(self):
+        if not self._running:
+            return
+        try:
+            events = self.queue.drain_events()
+            # many progress reports from one job in one tick only need drawing once
+            latest = {}
+            for job, kind in events:
+                if kind == "progress":
+                    latest[job.id] = job
+                else:
+                    latest.pop(job.id, None)  # finished, its older progress doesn't matter anymore
+                    self._handle(job, kind)
+            for job in latest.values():
+                self._handle(job, "progress")
+            while self._posted:
+                fn, args = self._posted.popleft()
+                fn(*args)
+            if self.on_tick is not None:
+                self.on_tick(self.queue.stats())
+        except Exception:
+            _logger.exception("ui pump callback failed")  # keep pumping, one bad callback shouldn't freeze the window
+        finally:
+            self.widget.after(self.interval_ms, self._tick)
+
+    def _handle(self, job, kind):
+        if self.on_event is not None:
+            self.on_event(job, kind)
+        cb = job.on_done if kind == "done" else job.on_progress if kind == "progress" else None
+        if cb is not None:
+            cb(job)
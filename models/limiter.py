@@ -0,0 +1,281 @@
+# how many requests to have in flight to the hosted api at once, worked out as we go.
+# too few and we're waiting on the network for nothing, too many and hf starts answering 429
+# (slow down) / 503 (model loading) or just gets slower. so, like tcp does it (AIMD):
+#   - every healthy answer: limit += 1 / limit   (about +1 per round of requests)
+#   - 429 / 503: limit *= 0.5, and wait out Retry-After before sending anything else
+#   - latency way above the usual: limit *= 0.8
+# a throttled call is retried (after the wait) instead of going straight back as an error.
+# one limiter for every hosted model, they all hit the same api.
+from __future__ import annotations
+import asyncio, email.utils, logging, os, threading, time
+from collections import deque
+
+_logger = logging.getLogger("hit137")
+
+THROTTLED = (429, 503)
+# the client methods that actually send a request (and so take a slot). anything else on the
+# client (close, headers, model, ...) goes straight through
+LIMITED = frozenset({"post", "text_classification", "image_classification", "zero_shot_classification",
+                     "zero_shot_image_classification", "feature_extraction", "text_generation",
+                     "chat_completion", "object_detection", "image_segmentation"})
+
+
+def status_of(err):
+    # http status of an exception from huggingface_hub (requests or httpx response) or our fakes
+    code = getattr(err, "status_code", None)
+    if code is None:
+        code = getattr(getattr(err, "response", None), "status_code", None)
+    return code
+
+
+def retry_after(err):
+    # seconds the server asked us to wait (Retry-After is seconds or an http date), None if it didn't say
+    headers = getattr(err, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(err, "response", None), "headers", None)
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 64, backoff: float = 0.5,
+                 latency_backoff: float = 0.8, latency_tolerance: float = 2.0, retries: int = 3,
+                 default_wait_s: float = 1.0, max_wait_s: float = 30.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance  # "spike" = this many times the usual latency
+        self.retries = retries
+        self.default_wait_s = default_wait_s  # throttled without a Retry-After
+        self.max_wait_s = max_wait_s
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self._waiters = deque()  # (loop, future) of the coroutines waiting in aacquire, oldest first
+        self._paused_until = 0.0
+        self._last_cut = 0.0
+        self._latency = {}  # key (model) -> [baseline ms (slow moving "normal"), recent ms (fast moving)]
+        self._recent_ms = 100.0  # of whatever answered last, for the cut cooldown
+        self.counts = {"ok": 0, "throttled": 0, "latency_cuts": 0, "retries": 0, "failed": 0}
+
+    # --- slots ---
+    def _free(self, now):
+        # caller holds the lock
+        return now >= self._paused_until and self.in_flight < int(self.limit)
+
+    def acquire(self):
+        with self._cond:
+            self.queued += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._free(now):
+                        break
+                    wait = self._paused_until - now if now < self._paused_until else None
+                    self._cond.wait(wait)
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+        return time.perf_counter()
+
+    async def aacquire(self):
+        # acquire for coroutines: waits on a future that release() resolves, so the loop keeps running
+        loop = asyncio.get_running_loop()
+        fut = None
+        with self._cond:
+            self.queued += 1
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    if self._free(now):
+                        self.in_flight += 1
+                        fut = None
+                        return time.perf_counter()
+                    fut = loop.create_future()
+                    self._waiters.append((loop, fut))
+                    wait = self._paused_until - now if now < self._paused_until else None
+                # a pause only ends with time passing, nobody releases anything to say so
+                await asyncio.wait((fut,), timeout=wait)
+                with self._cond:
+                    if not fut.done():
+                        self._waiters.remove((loop, fut))
+        finally:
+            with self._cond:
+                self.queued -= 1
+                if fut is not None:
+                    # cancelled while waiting. if release() had already picked us, pass the slot on
+                    if (loop, fut) in self._waiters:
+                        self._waiters.remove((loop, fut))
+                    elif fut.done():
+                        self._wake()
+
+    def _wake(self):
+        # caller holds the lock. one waiting coroutine per free slot, in the order they came. while
+        # paused all of them, so they go back to sleep with the pause as their timeout
+        paused = time.monotonic() < self._paused_until
+        free = int(self.limit) - self.in_flight
+        while self._waiters and (paused or free > 0):
+            loop, fut = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_resolve, fut)
+            except RuntimeError:  # its loop is closed, nobody's waiting there anymore
+                continue
+            free -= 1
+
+    def busy(self):
+        # no free slot (or someone already waiting for one): one more request would just queue
+        with self._cond:
+            return self.queued > 0 or not self._free(time.monotonic())
+
+    def try_acquire(self):
+        with self._cond:
+            if not self._free(time.monotonic()):
+                return None
+            self.in_flight += 1
+        return time.perf_counter()
+
+    def release(self, t0, err=None, key=None):
+        # t0 = what acquire gave back. err = the exception if the call failed. key = which model
+        # (a picture upload and a sentence have very different "normal" latencies)
+        ms = (time.perf_counter() - t0) * 1000
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            code = status_of(err) if err is not None else None
+            if code in THROTTLED:
+                self.counts["throttled"] += 1
+                wait = retry_after(err)
+                wait = min(self.max_wait_s, self.default_wait_s if wait is None else wait)
+                self._paused_until = max(self._paused_until, now + wait)
+                self._cut(self.backoff, now)
+            elif err is None:
+                self.counts["ok"] += 1
+                self._observe(key, ms, now)
+            self._cond.notify_all()
+            self._wake()
+        return code in THROTTLED
+
+    def _observe(self, key, ms, now):
+        # caller holds the lock
+        lat = self._latency.setdefault(key, [ms, ms])
+        lat[1] += 0.3 * (ms - lat[1])
+        # the baseline follows drops quickly and rises slowly, so a slow spell doesn't become "normal"
+        lat[0] += (0.3 if ms < lat[0] else 0.01) * (ms - lat[0])
+        self._recent_ms = lat[1]
+        if lat[1] > self.latency_tolerance * lat[0]:
+            if self._cut(self.latency_backoff, now):
+                self.counts["latency_cuts"] += 1
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def _cut(self, factor, now):
+        # at most one cut per round trip, the answers already on their way are from the old limit
+        if now - self._last_cut < self._recent_ms / 1000:
+            return False
+        self._last_cut = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        return True
+
+    # --- calls ---
+    def call(self, fn, *args, key=None, **kw):
+        # fn(*args, **kw) inside a slot. throttled -> wait it out and try again (retries times)
+        for attempt in range(self.retries + 1):
+            t0 = self.acquire()
+            try:
+                out = fn(*args, **kw)
+            except Exception as e:
+                if not self.release(t0, e, key) or attempt == self.retries:
+                    with self._cond:
+                        self.counts["failed"] += 1
+                    raise
+                with self._cond:
+                    self.counts["retries"] += 1
+                _logger.debug("throttled (%s), retrying after the pause", status_of(e))
+                continue
+            self.release(t0, key=key)
+            return out
+
+    async def acall(self, fn, *args, key=None, **kw):
+        # same for coroutines. waits on the event loop (aacquire), never blocks it
+        for attempt in range(self.retries + 1):
+            t0 = await self.aacquire()
+            try:
+                out = await fn(*args, **kw)
+            except Exception as e:
+                if not self.release(t0, e, key) or attempt == self.retries:
+                    with self._cond:
+                        self.counts["failed"] += 1
+                    raise
+                with self._cond:
+                    self.counts["retries"] += 1
+                continue
+            self.release(t0, key=key)
+            return out
+
+    def stats(self):
+        with self._cond:
+            return {"limit": round(self.limit, 2), "in_flight": self.in_flight, "queued": self.queued,
+                    "paused_s": round(max(0.0, self._paused_until - time.monotonic()), 2),
+                    "latency_ms": {str(k): {"usual": round(b, 2), "recent": round(r, 2)}
+                                   for k, (b, r) in self._latency.items()}, **self.counts}
+
+
+def _resolve(fut):
+    # runs on the waiter's own loop
+    if not fut.done():
+        fut.set_result(None)
+
+
+class LimitedClient:
+    # wraps an (Async)InferenceClient: the request methods (LIMITED) go through the limiter,
+    # everything else is the client's own
+    def __init__(self, client, limiter, key=None, is_async=False, methods=LIMITED):
+        self._inner = client
+        self._limiter = limiter
+        self._key = key
+        self._async = is_async
+        self._methods = methods
+
+    def __getattr__(self, name):
+        attr = getattr(self._inner, name)
+        if name not in self._methods or not callable(attr):
+            return attr
+        if self._async:
+            async def limited(*a, **kw):
+                return await self._limiter.acall(attr, *a, key=self._key, **kw)
+        else:
+            def limited(*a, **kw):
+                return self._limiter.call(attr, *a, key=self._key, **kw)
+        return limited
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def shared_limiter():
+    # None if HF_ADAPTIVE=0 (then it's whatever MAX_IN_FLIGHT says, like before)
+    global _shared
+    if os.getenv("HF_ADAPTIVE", "1") == "0":
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = AdaptiveLimiter(initial=int(os.getenv("HF_ADAPTIVE_START", "4")),
+                                      max_limit=int(os.getenv("HF_POOL_SIZE", "32")))
+        return _shared
+
+def reset_shared_limiter():
+    # forget the learned limit (benchmarks start every scenario fresh)
+    global _shared
+    with _shared_lock:
+        _shared = None
@@ -0,0 +1,132 @@
+# timings for every stage (preprocess / predict / postprocess) per model,
+# kept in rolling windows so we can see p50/p95/p99 and not just "it took 300ms once".
+# export as json or prometheus text.
+from __future__ import annotations
+import json, math, threading, time
+from collections import deque
+
+
+class Histogram:
+    # rolling window of the last N samples (ms). sorting 2k floats on snapshot is cheap enough
+    def __init__(self, window: int = 2048):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms: float):
+        with self._lock:
+            self._samples.append(ms)
+            self.count += 1
+            self.total_ms += ms
+
+    def percentile(self, q: float):
+        with self._lock:
+            xs = sorted(self._samples)
+        return nearest_rank(xs, q)
+
+    def snapshot(self):
+        with self._lock:
+            xs = sorted(self._samples)
+            count, total = self.count, self.total_ms
+        if not xs:
+            return {"count": count, "sum_ms": round(total, 3)}
+        return {
+            "count": count,
+            "sum_ms": round(total, 3),
+            "window": len(xs),
+            "mean_ms": round(sum(xs) / len(xs), 3),
+            "p50_ms": round(nearest_rank(xs, 0.50), 3),
+            "p95_ms": round(nearest_rank(xs, 0.95), 3),
+            "p99_ms": round(nearest_rank(xs, 0.99), 3),
+            "max_ms": round(xs[-1], 3),
+        }
+
+
+def nearest_rank(xs, q):
+    # nearest-rank percentile on an already sorted list: the ceil(q*n)-th value.
+    # the tiny nudge is for floats like 0.07 * 100 = 7.000000000000001
+    if not xs:
+        return None
+    i = min(len(xs) - 1, max(0, math.ceil(q * len(xs) - 1e-9) - 1))
+    return xs[i]
+
+
+class Metrics:
+    STAGES = ("preprocess", "predict", "postprocess")
+
+    def __init__(self, window: int = 2048):
+        self.window = window
+        self._hists = {}     # (model_id, stage) -> Histogram
+        self._counters = {}  # (model_id, name) -> int
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def hist(self, model_id, stage) -> Histogram:
+        k = (model_id, stage)
+        h = self._hists.get(k)
+        if h is None:
+            with self._lock:
+                h = self._hists.setdefault(k, Histogram(self.window))
+        return h
+
+    def observe(self, model_id, stage, ms):
+        self.hist(model_id, stage).observe(ms)
+
+    def inc(self, model_id, name, n=1):
+        with self._lock:
+            self._counters[(model_id, name)] = self._counters.get((model_id, name), 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            hists = dict(self._hists)
+            counters = dict(self._counters)
+        out = {}
+        for (mid, stage), h in hists.items():
+            out.setdefault(mid, {"stages": {}, "counters": {}})["stages"][stage] = h.snapshot()
+        for (mid, name), n in counters.items():
+            out.setdefault(mid, {"stages": {}, "counters": {}})["counters"][name] = n
+        return {"uptime_s": round(time.time() - self.started, 1), "models": out}
+
+    def to_json(self, **kw):
+        return json.dumps(self.snapshot(), **kw)
+
+    def to_prometheus(self):
+        lines = [
+            "# HELP hf_stage_latency_seconds per stage latency (rolling window quantiles)",
+            "# TYPE hf_stage_latency_seconds summary",
+        ]
+        with self._lock:
+            hists = sorted(self._hists.items())
+            counters = sorted(self._counters.items())
+        for (mid, stage), h in hists:
+            snap = h.snapshot()
+            lbl = f'model="{_esc(mid)}",stage="{stage}"'
+            for q, k in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                if k in snap:
+                    lines.append(f'hf_stage_latency_seconds{{{lbl},quantile="{q}"}} {snap[k] / 1000:.6f}')
+            lines.append(f"hf_stage_latency_seconds_sum{{{lbl}}} {snap['sum_ms'] / 1000:.6f}")
+            lines.append(f"hf_stage_latency_seconds_count{{{lbl}}} {snap['count']}")
+        lines.append("# HELP hf_requests_total requests by outcome")
+        lines.append("# TYPE hf_requests_total counter")
+        for (mid, name), n in counters:
+            lines.append(f'hf_requests_total{{model="{_esc(mid)}",outcome="{name}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+def _esc(s):
+    return str(s).replace("\\", "\\\\").replace('"', '\\"')
+
+
+_default = Metrics()
+
+def default_metrics() -> Metrics:
+    return _default
+
+def snapshot(fmt: str = "json"):
+    # fmt = "json" (a string), "dict", or "prometheus"
+    if fmt == "prometheus":
+        return _default.to_prometheus()
+    if fmt == "dict":
+        return _default.snapshot()
+    return _default.to_json(indent=2)
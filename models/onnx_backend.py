@@ -0,0 +1,134 @@
+# image classifiers exported to onnx + int8 dynamic quantization, run with onnx runtime on
+# the cpu. same call as a transformers pipeline (classifier(image, top_k=5)) so the local
+# client and HuggingFace1.py can use it as a drop-in. needs: torch + transformers to export
+# (once, result is kept on disk), onnxruntime + transformers (only the image processor) to run.
+from __future__ import annotations
+import inspect, os, threading
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hit137", "onnx")
+# only the matmuls get int8. that's where a vit spends its time; quantized convs
+# (ConvInteger) are usually *slower* than fp32 convs on onnx runtime's cpu kernels
+QUANT_OPS = ("MatMul", "Gemm")
+
+
+def export_dir(model_id: str) -> str:
+    # HF_ONNX_DIR moves the exports somewhere else
+    return os.path.join(os.getenv("HF_ONNX_DIR", DEFAULT_DIR), model_id.replace("/", "__"))
+
+
+def export(model_id: str, out_dir: str = None, quantize: bool = True, opset: int = 17) -> str:
+    # model_id can also be a local folder (that's what the tiny benchmark models are).
+    # writes model.onnx (+ model.int8.onnx) and the config/processor files next to it
+    import torch
+    from transformers import AutoConfig, AutoImageProcessor, AutoModelForImageClassification
+    out_dir = out_dir or export_dir(model_id)
+    os.makedirs(out_dir, exist_ok=True)
+    fp32 = os.path.join(out_dir, "model.onnx")
+    # written under a temporary name and renamed at the end, so a model.onnx that exists is
+    # always complete (another process exporting the same model at the same time can't see half)
+    if not os.path.exists(fp32):
+        config = AutoConfig.from_pretrained(model_id)
+        model = AutoModelForImageClassification.from_pretrained(model_id).eval()
+        size = _input_size(AutoImageProcessor.from_pretrained(model_id, use_fast=False))
+        dummy = torch.zeros(1, config.num_channels, size, size)
+        kw = {}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            # torch >= 2.5 has both exporters: dynamo=False = the old tracing one, doesn't need onnxscript.
+            # older torch only has that one and doesn't know the argument
+            kw["dynamo"] = False
+        tmp = f"{fp32}.{os.getpid()}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(model, (dummy,), tmp, input_names=["pixel_values"], output_names=["logits"],
+                              dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+                              opset_version=opset, **kw)
+        config.save_pretrained(out_dir)
+        AutoImageProcessor.from_pretrained(model_id, use_fast=False).save_pretrained(out_dir)
+        os.replace(tmp, fp32)
+    int8 = os.path.join(out_dir, "model.int8.onnx")
+    if quantize and not os.path.exists(int8):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        tmp = f"{int8}.{os.getpid()}.tmp"
+        quantize_dynamic(fp32, tmp, weight_type=QuantType.QInt8, op_types_to_quantize=list(QUANT_OPS))
+        os.replace(tmp, int8)
+    return out_dir
+
+
+def _input_size(processor):
+    size = getattr(processor, "crop_size", None) or processor.size
+    if isinstance(size, int):
+        return size
+    # a dict (or SizeDict in newer transformers, which has .get too)
+    return size.get("height") or size.get("shortest_edge")
+
+
+class OnnxImageClassifier:
+    def __init__(self, model_dir: str, quantized: bool = True, threads: int = None):
+        import onnxruntime as ort
+        from transformers import AutoConfig, AutoImageProcessor
+        name = "model.int8.onnx" if quantized else "model.onnx"
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, name), opts, providers=["CPUExecutionProvider"])
+        # slow (numpy) processor on purpose, the fast one wants torchvision
+        self.processor = AutoImageProcessor.from_pretrained(model_dir, use_fast=False)
+        self.labels = AutoConfig.from_pretrained(model_dir).id2label
+        self.model_dir = model_dir
+        self.quantized = quantized
+
+    def __call__(self, images, top_k=5, batch_size=None):
+        # like the pipeline: one image -> list of {label, score}, a list -> list of those
+        single = not isinstance(images, (list, tuple))
+        ims = [images] if single else list(images)
+        step = batch_size or len(ims) or 1
+        out = []
+        for i in range(0, len(ims), step):
+            out.extend(self._run(ims[i:i + step], top_k))
+        return out[0] if single else out
+
+    def _run(self, images, top_k):
+        import numpy as np
+        ims = [im.convert("RGB") if getattr(im, "mode", "RGB") != "RGB" else im for im in images]
+        pixels = self.processor(images=ims, return_tensors="np")["pixel_values"].astype(np.float32)
+        logits = self.session.run(None, {"pixel_values": pixels})[0]
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        k = min(top_k or probs.shape[1], probs.shape[1])
+        best = np.argsort(-probs, axis=1)[:, :k]
+        return [[{"label": self.labels[int(j)], "score": float(p[j])} for j in row] for p, row in zip(probs, best)]
+
+
+# one session per (model, quantized) for the whole process, like shared_pipeline (counted
+# holds too, release() only drops it when the last user lets go)
+_SESSIONS = {}  # key -> [classifier, holders]
+_SESSIONS_LOCK = threading.Lock()  # only guards the dicts, never held while exporting / loading
+_MODEL_LOCKS = {}  # model_id -> lock, so two threads don't export the same model at once
+
+def shared_classifier(model_id: str, quantized: bool = True) -> OnnxImageClassifier:
+    key = (model_id, quantized)
+    with _SESSIONS_LOCK:
+        entry = _SESSIONS.get(key)
+        if entry is not None:
+            entry[1] += 1
+            return entry[0]
+        lock = _MODEL_LOCKS.setdefault(model_id, threading.Lock())
+    # a slow export of one model doesn't hold up loading the others
+    with lock:
+        with _SESSIONS_LOCK:
+            entry = _SESSIONS.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return entry[0]
+        clf = OnnxImageClassifier(export(model_id, quantize=quantized), quantized)
+        with _SESSIONS_LOCK:
+            _SESSIONS[key] = [clf, 1]
+        return clf
+
+def release(model_id: str):
+    with _SESSIONS_LOCK:
+        for key in [k for k in _SESSIONS if k[0] == model_id]:
+            _SESSIONS[key][1] -= 1
+            if _SESSIONS[key][1] <= 0:
+                del _SESSIONS[key]
@@ -0,0 +1,258 @@
+# loaded models, kept up to a memory budget instead of forever. a local vit/resnet is
+# hundreds of MB, so when the budget (HF_MODEL_BUDGET_MB, default 2048) is blown the least
+# recently used model gets unloaded, and loaded again the next time someone asks for it.
+# also: preload the likely models in the background at startup, and count cold loads vs
+# warm hits (+ how long each took) so you can see if the budget is too small.
+from __future__ import annotations
+import gc, logging, os, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .metrics import default_metrics
+
+_logger = logging.getLogger("hit137")
+
+# where a model keeps the heavy stuff (BaseHFModel._client._pipe.model,
+# HuggingFace1's ModelDecorator._model._pipeline.model, ...)
+_ATTRS = ("_model", "_client", "_pipe", "_pipeline", "model", "_models")
+
+
+def rss_bytes():
+    # resident memory of this process right now, None if we can't tell
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def weight_tensors(obj, _depth=0, _seen=None):
+    # {data_ptr: bytes} of the torch weights reachable from obj, None if there aren't any
+    # (hosted, onnx). keyed by pointer so weights two models share (a cascade and the plain
+    # model both holding the same pipeline) or tied weights only count once
+    _seen = _seen if _seen is not None else set()
+    if obj is None or id(obj) in _seen or _depth > 4:
+        return None
+    _seen.add(id(obj))
+    if hasattr(obj, "state_dict") and hasattr(obj, "named_parameters"):
+        return {t.data_ptr(): t.numel() * t.element_size() for t in obj.state_dict().values()}
+    found = None
+    for a in _ATTRS:
+        sub = getattr(obj, a, None)
+        for s in (sub if isinstance(sub, (list, tuple)) else [sub]):
+            w = weight_tensors(s, _depth + 1, _seen)
+            if w is not None:
+                found = {**(found or {}), **w}
+    return found
+
+
+def weight_bytes(obj):
+    # bytes of torch weights reachable from obj, None if there aren't any (hosted, onnx)
+    w = weight_tensors(obj)
+    return None if w is None else sum(w.values())
+
+
+class _Slot:
+    def __init__(self, model, nbytes, weights=None):
+        self.model = model
+        self.nbytes = nbytes  # its own size (shared weights included), what stats() shows
+        self.weights = weights  # {data_ptr: bytes} when we could see torch weights, else None
+        self.users = 0  # jobs using it right now, it won't be evicted under them
+        self.doomed = False  # evict() asked while it was in use, goes when the last user lets go
+
+
+class ModelPool:
+    def __init__(self, factory, budget_mb: float = None, metrics=None):
+        # factory(name) -> a ready to use (loaded) model
+        self.factory = factory
+        mb = budget_mb if budget_mb is not None else float(os.getenv("HF_MODEL_BUDGET_MB", "2048"))
+        self.budget = int(mb * 2**20)
+        self._slots = OrderedDict()  # name -> _Slot, oldest use first
+        self._lock = threading.Lock()
+        self._load_locks = {}  # name -> lock, one load per model at a time
+        self._stats = {}
+        self._metrics = metrics or default_metrics()
+
+    def _st(self, name):
+        # caller holds the lock
+        st = self._stats.get(name)
+        if st is None:
+            st = self._stats[name] = {"cold_loads": 0, "warm_hits": 0, "preloads": 0, "evictions": 0,
+                                      "cold_ms_total": 0.0, "warm_ms_total": 0.0, "last_cold_ms": None}
+        return st
+
+    def warm(self, name, preload=False):
+        # make sure it's loaded (cold) or just count the hit (warm). on purpose it doesn't hand
+        # the model back: anything not pinned can be evicted + unloaded at any moment, so the
+        # only way to hold a model is use()
+        with self._acquire(name, preload):
+            pass
+
+    @contextmanager
+    def use(self, name):
+        # the model, loaded if needed. it can't be evicted until the with block is done
+        with self._acquire(name, pin=True) as model:
+            yield model
+
+    @contextmanager
+    def _acquire(self, name, preload=False, pin=False):
+        t0 = time.perf_counter()
+        slot = self._hit(name, t0, pin)
+        if slot is None:
+            slot = self._load(name, t0, preload, pin)
+        try:
+            yield slot.model
+        finally:
+            if pin:
+                with self._lock:
+                    slot.users -= 1
+                    evicted = self._evict()
+                    if slot.doomed and not slot.users and self._slots.get(name) is slot:
+                        del self._slots[name]
+                        evicted.append((name, slot.model))
+                self._unload(evicted)
+
+    def _hit(self, name, t0, pin):
+        with self._lock:
+            slot = self._slots.get(name)
+            if slot is None:
+                return None
+            self._slots.move_to_end(name)
+            slot.users += pin
+            ms = (time.perf_counter() - t0) * 1000
+            st = self._st(name)
+            st["warm_hits"] += 1
+            st["warm_ms_total"] += ms
+        self._metrics.observe(name, "pool_warm_hit", ms)
+        return slot
+
+    def _load(self, name, t0, preload, pin):
+        with self._lock:
+            lock = self._load_locks.setdefault(name, threading.Lock())
+        with lock:
+            slot = self._hit(name, t0, pin)  # someone else loaded it while we waited
+            if slot is not None:
+                return slot
+            before = rss_bytes()
+            model = self.factory(name)
+            after = rss_bytes()
+            ms = (time.perf_counter() - t0) * 1000
+            # weights if we can see them, otherwise how much the process grew (rough if
+            # two models load at once, but the best we've got for hosted/onnx)
+            weights = weight_tensors(model)
+            if weights is not None:
+                nbytes = sum(weights.values())
+            else:
+                nbytes = max(0, after - before) if before is not None and after is not None else 0
+            slot = _Slot(model, nbytes, weights)
+            with self._lock:
+                slot.users += pin
+                self._slots[name] = slot
+                st = self._st(name)
+                if preload:
+                    st["preloads"] += 1
+                else:
+                    st["cold_loads"] += 1
+                    st["cold_ms_total"] += ms
+                st["last_cold_ms"] = round(ms, 1)
+                evicted = self._evict(keep=name)
+        if not preload:
+            self._metrics.observe(name, "pool_cold_load", ms)
+        _logger.info("pool: loaded %s in %.0fms (~%.0f MB)", name, ms, nbytes / 2**20)
+        self._unload(evicted)
+        return slot
+
+    def _used(self):
+        # caller holds the lock. weights shared between slots are only counted once
+        other, weights = 0, {}
+        for slot in self._slots.values():
+            if slot.weights is None:
+                other += slot.nbytes
+            else:
+                weights.update(slot.weights)
+        return other + sum(weights.values())
+
+    def _evict(self, keep=None):
+        # caller holds the lock. oldest first, never the one just loaded or one in use.
+        # evicting a model whose weights another loaded model shares frees less (or nothing),
+        # _used() sees that, so we keep going until it really is under the budget
+        evicted = []
+        for name in list(self._slots):
+            if self._used() <= self.budget:
+                break
+            slot = self._slots[name]
+            if name == keep or slot.users:
+                continue
+            del self._slots[name]
+            self._st(name)["evictions"] += 1
+            evicted.append((name, slot.model))
+        return evicted
+
+    def _unload(self, evicted):
+        for name, model in evicted:
+            _logger.info("pool: evicting %s (over the %.0f MB budget)", name, self.budget / 2**20)
+            unload = getattr(model, "unload", None)
+            if unload is not None:
+                try:
+                    unload()
+                except Exception as e:
+                    _logger.info("pool: unloading %s failed: %s", name, e)
+        if evicted:
+            gc.collect()  # big tensors, give them back now rather than whenever
+
+    def evict(self, name):
+        # a model that's in use isn't pulled out from under the job: it goes when the job is done
+        with self._lock:
+            slot = self._slots.get(name)
+            if slot is None:
+                return
+            if slot.users:
+                slot.doomed = True
+                return
+            del self._slots[name]
+        self._unload([(name, slot.model)])
+
+    def preload(self, names, jobs=None):
+        # load in the background so the first click is warm. with a JobQueue they go in at
+        # background priority (user clicks jump ahead), otherwise one daemon thread
+        names = [n for n in names if n not in self._slots]
+        def one(n):
+            try:
+                self.warm(n, preload=True)
+            except Exception as e:
+                _logger.info("pool: preloading %s failed: %s", n, e)
+        if jobs is not None:
+            from .jobs import BACKGROUND
+            return [jobs.submit(lambda job, n=n: one(n), name=f"preload {n}", priority=BACKGROUND) for n in names]
+        t = threading.Thread(target=lambda: [one(n) for n in names], name="pool-preload", daemon=True)
+        t.start()
+        return t
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._slots
+
+    def loaded(self):
+        with self._lock:
+            return list(self._slots)
+
+    def stats(self):
+        with self._lock:
+            models = {}
+            for name, st in self._stats.items():
+                slot = self._slots.get(name)
+                models[name] = {
+                    "loaded": slot is not None,
+                    "approx_mb": round(slot.nbytes / 2**20, 1) if slot else None,
+                    "in_use": slot.users if slot else 0,
+                    "cold_loads": st["cold_loads"],
+                    "warm_hits": st["warm_hits"],
+                    "preloads": st["preloads"],
+                    "evictions": st["evictions"],
+                    "cold_load_ms_avg": round(st["cold_ms_total"] / st["cold_loads"], 1) if st["cold_loads"] else None,
+                    "warm_hit_ms_avg": round(st["warm_ms_total"] / st["warm_hits"], 4) if st["warm_hits"] else None,
+                    "last_load_ms": st["last_cold_ms"],
+                }
+            return {"budget_mb": round(self.budget / 2**20, 1),
+                    "used_mb": round(self._used() / 2**20, 1),
+                    "models": models}
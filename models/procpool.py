@@ -0,0 +1,282 @@
+# local pipelines in N worker processes instead of the gui process. each worker loads its
+# own copy of the model and gets its own intra-op threads, so pre/post-processing isn't
+# fighting the gil and a big cpu actually gets used.
+# pictures are decoded here once and the raw pixels go through multiprocessing.shared_memory
+# (the queue only carries the block's name + shape), text just goes through the queue.
+# callable like a transformers pipeline: pool(image, top_k=5) / pool([images], top_k=5).
+from __future__ import annotations
+import itertools, logging, math, os, queue, threading, time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+
+_logger = logging.getLogger("hit137")
+
+
+def _attach(name):
+    # attach to the parent's block. the parent owns it (and unlinks it), the worker only reads
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # 3.13+
+    except TypeError:
+        # older pythons: spawned workers share the parent's resource tracker, so the extra
+        # register is a no-op there (unregistering here would break the parent's unlink)
+        return shared_memory.SharedMemory(name=name)
+
+
+def _load(model_id, task, runtime, threads):
+    if runtime == "onnx":
+        # model_id is the export folder here, the parent exported it before starting us
+        from .onnx_backend import OnnxImageClassifier
+        return OnnxImageClassifier(model_id, quantized=True, threads=threads)
+    import torch
+    from transformers import pipeline
+    torch.set_num_threads(threads)
+    return pipeline(task, model=model_id, device="cpu", token=os.getenv("HF_TOKEN") or None)
+
+
+def _worker(model_id, task, runtime, threads, jobs, results):
+    # runs in the child. env first so the blas/openmp pools come up the right size
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    t0 = time.perf_counter()
+    try:
+        pipe = _load(model_id, task, runtime, threads)
+    except Exception as e:
+        results.put(("ready", os.getpid(), None, f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", os.getpid(), (time.perf_counter() - t0) * 1000, None))
+    import numpy as np
+    from PIL import Image
+    while True:
+        msg = jobs.get()
+        if msg is None:
+            return
+        job_id, items, kw = msg
+        blocks, inputs = [], []
+        try:
+            for kind, payload, shape in items:
+                if kind == "shm":
+                    shm = _attach(payload)
+                    blocks.append(shm)
+                    # fromarray copies into pil's own layout, so the block can go right after
+                    inputs.append(Image.fromarray(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf), "RGB"))
+                else:
+                    inputs.append(payload)
+            out = pipe(inputs, batch_size=len(inputs), **kw)
+            results.put((job_id, out, None))
+        except Exception as e:
+            results.put((job_id, None, f"{type(e).__name__}: {e}"))
+        finally:
+            for shm in blocks:
+                shm.close()
+
+
+class ProcessPipelinePool:
+    def __init__(self, model_id: str, task: str = "image-classification", workers: int = None,
+                 threads: int = None, runtime: str = "torch", start_timeout: float = 600.0,
+                 call_timeout: float = 300.0):
+        cpus = os.cpu_count() or 1
+        self.workers = workers or int(os.getenv("HF_PROC_WORKERS", "0")) or max(1, cpus // 4)
+        self.threads = threads or int(os.getenv("HF_PROC_THREADS", "0")) or max(1, cpus // self.workers)
+        self.model_id = model_id
+        self.task = task
+        self.call_timeout = call_timeout  # seconds one __call__ waits for its answers
+        source = model_id
+        if runtime == "onnx":
+            # export once, here, before any worker starts (they'd all write the same files at once)
+            from .onnx_backend import export
+            source = export(model_id)
+        # spawn, not fork: forking a process that already has threads (tk, our pools) is asking for it
+        ctx = get_context("spawn")
+        self._jobs = ctx.Queue()
+        self._results = ctx.Queue()
+        self._procs = [ctx.Process(target=_worker, name=f"pipe-{i}", daemon=True,
+                                   args=(source, task, runtime, self.threads, self._jobs, self._results))
+                       for i in range(self.workers)]
+        for p in self._procs:
+            p.start()
+        self._pending = {}  # job id -> (future, shm blocks to free)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._broken = None  # set to the reason once a worker died, every call fails after that
+        self.load_ms = self._wait_ready(start_timeout)
+        self._collector = threading.Thread(target=self._collect, name="pipe-results", daemon=True)
+        self._collector.start()
+        _logger.info("%s: %d worker processes x %d threads ready", model_id, self.workers, self.threads)
+
+    def _dead(self):
+        # "pipe-1 (exit code -11)" for a worker that's gone, None if they're all alive
+        for p in self._procs:
+            if not p.is_alive():
+                return f"{p.name} (exit code {p.exitcode})"
+        return None
+
+    def _wait_ready(self, timeout):
+        times = []
+        deadline = time.monotonic() + timeout
+        while len(times) < len(self._procs):
+            try:
+                tag, pid, ms, err = self._results.get(timeout=1.0)
+            except queue.Empty:
+                # a worker that crashed (not just raised) never says anything, don't wait out the timeout
+                dead = self._dead()
+                if dead is not None or time.monotonic() > deadline:
+                    self.close()
+                    raise BrokenProcessPool(f"{self.model_id}: worker {dead} died while loading" if dead
+                                            else f"{self.model_id}: workers not ready after {timeout:.0f}s")
+                continue
+            if err is not None:
+                self.close()
+                raise RuntimeError(f"worker {pid} couldn't load {self.model_id}: {err}")
+            times.append(round(ms, 1))
+        return times
+
+    def _collect(self):
+        while True:
+            try:
+                msg = self._results.get(timeout=1.0)
+            except queue.Empty:
+                dead = self._dead()
+                if dead is not None:
+                    self._break(f"worker {dead} died")
+                    return
+                continue
+            if msg is None:
+                return
+            job_id, out, err = msg
+            with self._lock:
+                fut, blocks = self._pending.pop(job_id, (None, ()))
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+            if fut is None:
+                continue
+            if err is not None:
+                fut.set_exception(RuntimeError(err))
+            else:
+                fut.set_result(out)
+
+    def _pack(self, x):
+        # pictures -> a shared block of raw RGB pixels, anything else goes as is
+        if isinstance(x, str) or not hasattr(x, "convert"):
+            return ("raw", x, None), None
+        import numpy as np
+        arr = np.asarray(x.convert("RGB") if x.mode != "RGB" else x)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, dtype=np.uint8, buffer=shm.buf)[...] = arr
+        return ("shm", shm.name, arr.shape), shm
+
+    def _break(self, reason):
+        # a worker is gone (killed, segfault, out of memory). we can't tell which jobs it had,
+        # so like concurrent.futures' process pool: everything pending fails, and so does what comes next
+        _logger.warning("%s: %s, failing %d pending job(s)", self.model_id, reason, len(self._pending))
+        with self._lock:
+            self._broken = reason
+            pending, self._pending = self._pending, {}
+        for fut, blocks in pending.values():
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+            if not fut.done():
+                fut.set_exception(BrokenProcessPool(f"{self.model_id}: {reason}"))
+
+    def submit(self, inputs, **kw) -> Future:
+        # one job = one list of inputs, handled by whichever worker is free
+        if self._broken is not None:
+            raise BrokenProcessPool(f"{self.model_id}: {self._broken}")
+        fut = Future()
+        items, blocks = [], []
+        try:
+            for x in inputs:
+                item, shm = self._pack(x)
+                items.append(item)
+                if shm is not None:
+                    blocks.append(shm)
+        except Exception:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+            raise
+        job_id = next(self._ids)
+        with self._lock:
+            broken = self._broken
+            if broken is None:
+                self._pending[job_id] = (fut, blocks)
+        if broken is not None:  # died while we were packing
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+            raise BrokenProcessPool(f"{self.model_id}: {broken}")
+        self._jobs.put((job_id, items, kw))
+        return fut
+
+    def __call__(self, inputs, batch_size=None, **kw):
+        # like a pipeline. a list is split so every worker gets a share (batch_size caps a share)
+        single = not isinstance(inputs, (list, tuple))
+        xs = [inputs] if single else list(inputs)
+        if not xs:
+            return []
+        chunk = math.ceil(len(xs) / self.workers)
+        if batch_size:
+            chunk = min(chunk, batch_size)
+        futs = [self.submit(xs[i:i + chunk], **kw) for i in range(0, len(xs), chunk)]
+        deadline = time.monotonic() + self.call_timeout
+        # TimeoutError if the workers are stuck, BrokenProcessPool if one died
+        out = [r for f in futs for r in f.result(timeout=max(0.0, deadline - time.monotonic()))]
+        return out[0] if single else out
+
+    def close(self):
+        for _ in self._procs:
+            self._jobs.put(None)
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self._results.put(None)  # stops the collector
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for fut, blocks in pending.values():
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+            if not fut.done():
+                fut.set_exception(RuntimeError("process pool closed"))
+
+
+# one pool per (task, model, runtime) for the whole process, like shared_pipeline (counted
+# holds too: the workers only stop when the last model using them is unloaded)
+_POOLS = {}  # key -> [pool, holders]
+_POOLS_LOCK = threading.Lock()  # only guards the dicts, starting workers happens outside it
+_STARTING = {}  # key -> lock, so two threads asking for the same pool don't both start one
+
+def shared_process_pool(task: str, model_id: str, runtime: str = "torch") -> ProcessPipelinePool:
+    key = (task, model_id, runtime)
+    with _POOLS_LOCK:
+        if key in _POOLS:
+            _POOLS[key][1] += 1
+            return _POOLS[key][0]
+        lock = _STARTING.setdefault(key, threading.Lock())
+    # spawning + loading takes a while, other models asking for their pools don't wait on it
+    with lock:
+        with _POOLS_LOCK:
+            if key in _POOLS:
+                _POOLS[key][1] += 1
+                return _POOLS[key][0]
+        pool = ProcessPipelinePool(model_id, task, runtime=runtime)
+        with _POOLS_LOCK:
+            _POOLS[key] = [pool, 1]
+            _STARTING.pop(key, None)
+        return pool
+
+def release_process_pool(task: str, model_id: str, runtime: str = "torch"):
+    # exactly that pool: the torch and onnx pools of one model are separate holds
+    key = (task, model_id, runtime)
+    with _POOLS_LOCK:
+        entry = _POOLS.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del _POOLS[key]
+    entry[0].close()
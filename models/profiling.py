@@ -0,0 +1,119 @@
+# "why was that run slow / where did the memory go", on demand. arm it for the next n runs
+# and each of those runs gets a cProfile (where the time went, function by function) and a
+# tracemalloc snapshot (which lines allocated the most). written to HF_PROFILE_DIR:
+#   <stamp>-<name>.prof        open with: python -m pstats file.prof  (or snakeviz)
+#   <stamp>-<name>.txt         top functions by cumulative time + top allocations, plain text
+# not armed = one int check per run, nothing else. HF_PROFILE=n arms the first n runs at startup.
+# cProfile only sees the thread it was started on, so this wraps a whole run() on the caller's
+# thread (preprocess -> predict -> postprocess). tracemalloc sees every thread, so allocations
+# from other work going on at the same time end up in the report too.
+# one capture at a time: a run that starts while another one is being profiled just runs normally
+# (and doesn't use up one of the n).
+from __future__ import annotations
+import cProfile, io, logging, os, pstats, re, threading, time, tracemalloc
+from contextlib import contextmanager
+
+_logger = logging.getLogger("hit137")
+
+
+class Profiler:
+    def __init__(self, out_dir: str = None, top: int = 25, frames: int = 10):
+        self.out_dir = os.path.expanduser(out_dir or os.getenv("HF_PROFILE_DIR", "~/.cache/hit137/profiles"))
+        self.top = top  # lines in each table of the report
+        self.frames = frames  # traceback depth tracemalloc keeps per allocation
+        self.pending = 0  # runs still to profile. plain int so the "off" check is as cheap as it gets
+        self.reports = []  # (prof path, txt path) of every capture so far, oldest first
+        self._busy = False
+        self._lock = threading.Lock()
+
+    def arm(self, n: int = 1):
+        # profile the next n runs (adds to whatever is still pending)
+        with self._lock:
+            self.pending += max(0, n)
+        return self
+
+    def disarm(self):
+        with self._lock:
+            self.pending = 0
+        return self
+
+    def _take(self, force=False):
+        with self._lock:
+            if self._busy or not (force or self.pending > 0):
+                return False
+            if not force:
+                self.pending -= 1
+            self._busy = True
+            return True
+
+    @contextmanager
+    def capture(self, name: str = "run", force: bool = False):
+        # profiles the with block if armed (or force=True). yields the (prof, txt) paths list,
+        # which gets filled in when the block ends. not armed -> yields None and does nothing
+        if not (force or self.pending) or not self._take(force):
+            yield None
+            return
+        paths = []
+        started_tm = not tracemalloc.is_tracing()
+        if started_tm:
+            tracemalloc.start(self.frames)
+        elif hasattr(tracemalloc, "reset_peak"):  # python 3.9+, else the peak is since whoever started it
+            tracemalloc.reset_peak()
+        prof = cProfile.Profile()
+        t0 = time.perf_counter()
+        prof.enable()
+        try:
+            yield paths
+        finally:
+            prof.disable()
+            wall_ms = (time.perf_counter() - t0) * 1000
+            try:
+                snap = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                if started_tm:
+                    tracemalloc.stop()
+                paths.extend(self._write(name, prof, snap, wall_ms, peak))
+            except Exception as e:
+                _logger.warning("couldn't write the profile for %s: %s", name, e)
+            finally:
+                with self._lock:
+                    self._busy = False
+
+    def _write(self, name, prof, snap, wall_ms, peak):
+        os.makedirs(self.out_dir, exist_ok=True)
+        safe = re.sub(r"[^\w.-]+", "_", name)[:60].strip("_-") or "run"
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"{now % 1:.3f}"[1:]
+        stem = os.path.join(self.out_dir, f"{stamp}-{safe}")
+        prof.dump_stats(stem + ".prof")
+
+        buf = io.StringIO()
+        buf.write(f"{name}\nwall: {wall_ms:.1f} ms, peak traced memory: {peak / 1e6:.2f} MB\n\n")
+        buf.write(f"--- top {self.top} functions by cumulative time ---\n")
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(self.top)
+        buf.write(f"--- top {self.top} allocations (still alive at the end of the run) by line ---\n")
+        # our own bookkeeping isn't interesting
+        snap = snap.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                   tracemalloc.Filter(False, __file__)])
+        for stat in snap.statistics("lineno")[:self.top]:
+            frame = stat.traceback[0]
+            buf.write(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}\n")
+        with open(stem + ".txt", "w") as f:
+            f.write(buf.getvalue())
+
+        out = (stem + ".prof", stem + ".txt")
+        with self._lock:
+            self.reports.append(out)
+        _logger.info("profile of %s (%.0f ms) saved to %s", name, wall_ms, out[0])
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self.pending, "captured": len(self.reports), "out_dir": self.out_dir,
+                    "last": self.reports[-1][0] if self.reports else None}
+
+
+_default = Profiler().arm(int(os.getenv("HF_PROFILE", "0") or 0))
+
+def default_profiler() -> Profiler:
+    return _default
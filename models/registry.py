@@ -1,15 +1,163 @@
-
 # this is like a tiny factory. i put strings here so the dropdown has friendly names.
-from .text_sentiment import TextSentimentModel
-from .image_classification import ImageClassificationModel
+# entries are just import paths + info, so listing the models doesn't import
+# huggingface_hub / PIL / transformers. the class only gets imported in create_model().
+import importlib
+from importlib import metadata
+
+# other packages can add models by declaring an entry point in this group, e.g. in their pyproject:
+#   [project.entry-points."hit137.models"]
+#   "Vision: My Detector" = "my_pkg.models:MyDetector"
+ENTRY_POINT_GROUP = "hit137.models"
 
 REGISTRY = {
-    "Text: Sentiment (easy one)": TextSentimentModel,
-    "Vision: Image Classifier (the picture one)": ImageClassificationModel,
+    "Text: Sentiment (easy one)": {
+        "key": "sentiment",
+        "path": ".text_sentiment:TextSentimentModel",
+        "backend": "hosted",
+        "task": "text-classification",
+        "category": "Text",
+        "model_id": "distilbert-base-uncased-finetuned-sst-2-english",
+        "description": "does sentiment. like positive/negative vibes.",
+    },
+    "Vision: Image Classifier (the picture one)": {
+        "key": "image",
+        "path": ".image_classification:ImageClassificationModel",
+        "backend": "hosted",
+        "task": "image-classification",
+        "category": "Vision",
+        "model_id": "google/vit-base-patch16-224",
+        "description": "guesses what the picture is basically.",
+    },
+    "Vision: ResNet-50 (the faster picture one)": {
+        "key": "resnet",
+        "path": ".image_classification:ImageClassificationModel",
+        "backend": "hosted",
+        "task": "image-classification",
+        "category": "Vision",
+        "model_id": "microsoft/resnet-50",
+        "description": "also guesses the picture, smaller and quicker than the vit.",
+    },
+    "Text: Sentiment (local cpu)": {
+        "key": "sentiment-local",
+        "path": ".text_sentiment:TextSentimentModel",
+        "backend": "local",
+        "task": "text-classification",
+        "category": "Text",
+        "model_id": "distilbert-base-uncased-finetuned-sst-2-english",
+        "description": "same sentiment model but runs on this computer.",
+    },
+    "Vision: Image Classifier (local cpu)": {
+        "key": "image-local",
+        "path": ".image_classification:ImageClassificationModel",
+        "backend": "local",
+        "task": "image-classification",
+        "category": "Vision",
+        "model_id": "google/vit-base-patch16-224",
+        "description": "same picture guesser but runs on this computer.",
+    },
+    "Vision: ResNet-50 (local cpu)": {
+        "key": "resnet-local",
+        "path": ".image_classification:ImageClassificationModel",
+        "backend": "local",
+        "task": "image-classification",
+        "category": "Vision",
+        "model_id": "microsoft/resnet-50",
+        "description": "the resnet, running on this computer.",
+    },
+    "Vision: Image Classifier (onnx int8)": {
+        "key": "image-onnx",
+        "path": ".image_classification:ImageClassificationModel",
+        "backend": "onnx",
+        "task": "image-classification",
+        "category": "Vision",
+        "model_id": "google/vit-base-patch16-224",
+        "description": "the vit squashed to int8 onnx. much quicker on a cpu, first load exports it.",
+    },
+    "Vision: ResNet-50 (onnx int8)": {
+        "key": "resnet-onnx",
+        "path": ".image_classification:ImageClassificationModel",
+        "backend": "onnx",
+        "task": "image-classification",
+        "category": "Vision",
+        "model_id": "microsoft/resnet-50",
+        "description": "the resnet on onnx runtime, first load exports it.",
+    },
+    "Vision: Cascade (resnet, vit if unsure)": {
+        "key": "cascade",
+        "path": ".cascade:CascadeModel",
+        "backend": "hosted",
+        "task": "image-classification",
+        "category": "Vision",
+        "model_id": "microsoft/resnet-50",
+        "options": {"slow_id": "google/vit-base-patch16-224"},
+        "description": "resnet first, only asks the vit too when resnet isn't sure. mostly resnet speed.",
+    },
+    "Vision: Cascade (local cpu)": {
+        "key": "cascade-local",
+        "path": ".cascade:CascadeModel",
+        "backend": "local",
+        "task": "image-classification",
+        "category": "Vision",
+        "model_id": "microsoft/resnet-50",
+        "options": {"slow_id": "google/vit-base-patch16-224"},
+        "description": "the cascade, both models on this computer.",
+    },
 }
 
+_plugins_found = False
+_classes = {}  # path -> class, so we only import once
+
+def _find_plugins():
+    # reading entry points only looks at package metadata, the plugin code isn't imported here
+    global _plugins_found
+    if _plugins_found:
+        return
+    _plugins_found = True
+    try:
+        eps = metadata.entry_points(group=ENTRY_POINT_GROUP)
+    except Exception:
+        return  # broken metadata shouldn't stop the app from starting
+    for ep in eps:
+        if ep.name in REGISTRY:
+            continue
+        cat = ep.name.split(":", 1)[0].strip() if ":" in ep.name else "Plugin"
+        REGISTRY[ep.name] = {
+            "key": ep.name.lower(),
+            "path": ep.value,
+            "backend": "hosted",
+            "task": "?",
+            "category": cat,
+            "model_id": "?",
+            "description": f"plugin model ({ep.value})",
+        }
+
 def get_model_names():
+    _find_plugins()
     return list(REGISTRY.keys())
 
-def create_model(name):
-    return REGISTRY[name]()  # fingers crossed
+def get_spec(name):
+    # name can be the dropdown name or the short key (handy for scripts)
+    _find_plugins()
+    if name in REGISTRY:
+        return REGISTRY[name]
+    for spec in REGISTRY.values():
+        if spec["key"] == name:
+            return spec
+    raise KeyError(f"no model called {name!r}")
+
+def load_class(name):
+    path = get_spec(name)["path"]
+    if path not in _classes:
+        mod_name, _, cls_name = path.partition(":")
+        mod = importlib.import_module(mod_name, __package__)
+        _classes[path] = getattr(mod, cls_name)
+    return _classes[path]
+
+def create_model(name, backend=None):
+    # backend=None means whatever the entry says
+    spec = get_spec(name)
+    kw = {"backend": backend or spec["backend"]}
+    if spec.get("model_id") not in (None, "?"):
+        kw["model_id"] = spec["model_id"]  # same class, different checkpoint (vit vs resnet)
+    kw.update(spec.get("options", {}))  # anything else the class takes (the cascade's second model)
+    return load_class(name)(**kw)  # fingers crossed
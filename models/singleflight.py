@@ -0,0 +1,93 @@
+# "single flight": if the exact same request is already on its way to hf,
+# don't send it again, just wait for that one and share the answer.
+# (double clicks, duplicate rows in a batch, two callers at once...)
+from __future__ import annotations
+import asyncio, threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}   # key -> _Call (threads)
+        self._afuts = {}   # (loop, key) -> asyncio.Future (coroutines)
+        self.leaders = 0   # calls that actually went upstream
+        self.shared = 0    # calls that piggybacked = upstream calls saved
+
+    def do(self, key, fn):
+        # returns (result, shared). shared=True means someone else did the work
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def ado(self, key, afn):
+        # same thing for coroutines. afn is an async function with no args
+        loop = asyncio.get_running_loop()
+        k = (loop, key)
+        with self._lock:
+            fut = self._afuts.get(k)
+            leader = fut is None
+            if leader:
+                fut = self._afuts[k] = loop.create_future()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            # shield so one impatient follower getting cancelled doesn't cancel everyone
+            return await asyncio.shield(fut), True
+        try:
+            res = await afn()
+            fut.set_result(res)
+            return res, False
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # mark it as seen, otherwise asyncio moans when nobody was waiting
+            raise
+        finally:
+            with self._lock:
+                self._afuts.pop(k, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls) + len(self._afuts)
+
+    def stats(self):
+        with self._lock:
+            return {"upstream_calls": self.leaders, "saved_calls": self.shared,
+                    "in_flight": len(self._calls) + len(self._afuts)}
+
+
+_default = SingleFlight()
+
+def default_group() -> SingleFlight:
+    # shared by every model instance, so two instances of the same model coalesce too
+    return _default
@@ -0,0 +1,265 @@
+# every prediction, kept on disk in columns instead of thrown away after _postprocess
+# makes its string. one numpy memmap file per column (fixed size rows), strings (labels,
+# model ids) are interned to small ints, so a million rows is ~70 MB and questions like
+# "how often was it POSITIVE", "everything under 0.6" or "p95 latency per model" are a few
+# numpy ops over the columns, no python dicts per row.
+#   store = PredictionStore("~/.cache/hit137/predictions")
+#   model.set_sink(store)
+#   store.query().where(model="microsoft/resnet-50", max_score=0.5).label_histogram()
+# one writer process at a time. readers (PredictionStore(path, readonly=True)) only see rows
+# up to the last flush.
+from __future__ import annotations
+import json, os, threading, time
+
+import numpy as np
+
+VERSION = 1
+FLAG_CACHED = 1
+FLAG_COALESCED = 2
+
+
+def _columns(top_k):
+    # name -> (dtype, shape of one row)
+    return {
+        "ts": ("<f8", ()),
+        "model": ("<u2", ()),
+        "task": ("<u1", ()),
+        "input": ("<u8", ()),  # first 64 bits of the payload's sha256 (same as the result cache key)
+        "latency_ms": ("<f4", ()),
+        "flags": ("<u1", ()),
+        "labels": ("<i4", (top_k,)),  # best first, -1 = empty
+        "scores": ("<f4", (top_k,)),
+    }
+
+
+def _write_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+class PredictionStore:
+    def __init__(self, path: str, top_k: int = 5, initial_rows: int = 1 << 16, flush_every: int = 1000,
+                 readonly: bool = False):
+        self.path = os.path.expanduser(path)
+        self.readonly = readonly
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        meta = self._read_json("meta.json")
+        if meta is None:
+            if readonly:
+                raise FileNotFoundError(f"no prediction store in {self.path}")
+            os.makedirs(self.path, exist_ok=True)
+            meta = {"version": VERSION, "top_k": top_k, "rows": 0, "capacity": initial_rows}
+        self.top_k = meta["top_k"]
+        self.rows = meta["rows"]
+        self._strings = self._read_json("strings.json") or {"labels": [], "models": [], "tasks": []}
+        self._ids = {kind: {s: i for i, s in enumerate(names)} for kind, names in self._strings.items()}
+        self._cols = {}
+        self._open(max(meta["capacity"], self.rows, 1))
+        self._unflushed = 0
+        if not readonly:
+            self.flush()
+
+    def _read_json(self, name):
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _open(self, capacity):
+        # (re)map every column at `capacity` rows, growing the files if needed
+        for name, (dtype, shape) in _columns(self.top_k).items():
+            file = os.path.join(self.path, name + ".bin")
+            row_bytes = int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+            if self.readonly:
+                have = os.path.getsize(file) // row_bytes
+                # mmap can't map an empty file
+                self._cols[name] = (np.memmap(file, dtype=dtype, mode="r", shape=(have,) + shape) if have
+                                    else np.zeros((0,) + shape, dtype=dtype))
+                continue
+            with open(file, "ab") as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+            self._cols[name] = np.memmap(file, dtype=dtype, mode="r+", shape=(capacity,) + shape)
+        self.capacity = capacity
+
+    def _intern(self, kind, s):
+        # caller holds the lock
+        i = self._ids[kind].get(s)
+        if i is None:
+            i = self._ids[kind][s] = len(self._strings[kind])
+            self._strings[kind].append(s)
+        return i
+
+    def record(self, model_id, task, label_scores, latency_ms, input_digest=None, cached=False,
+               coalesced=False, ts=None):
+        # one prediction. label_scores = [(label, score), ...] in any order
+        if self.readonly:
+            raise RuntimeError("store was opened readonly")
+        best = sorted(label_scores, key=lambda p: p[1], reverse=True)[:self.top_k]
+        with self._lock:
+            if self.rows == self.capacity:
+                for col in self._cols.values():
+                    col.flush()
+                self._open(self.capacity * 2)
+            i = self.rows
+            c = self._cols
+            c["ts"][i] = time.time() if ts is None else ts
+            c["model"][i] = self._intern("models", model_id)
+            c["task"][i] = self._intern("tasks", task)
+            c["input"][i] = int(input_digest[:16], 16) if input_digest else 0
+            c["latency_ms"][i] = latency_ms if latency_ms is not None else np.nan
+            c["flags"][i] = (FLAG_CACHED if cached else 0) | (FLAG_COALESCED if coalesced else 0)
+            c["labels"][i] = -1
+            c["scores"][i] = 0.0
+            for j, (label, score) in enumerate(best):
+                c["labels"][i, j] = self._intern("labels", label)
+                c["scores"][i, j] = score
+            self.rows += 1
+            self._unflushed += 1
+            if self._unflushed >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        # caller holds the lock. data first, then the names, then the row count that makes them visible
+        for col in self._cols.values():
+            col.flush()
+        _write_json(os.path.join(self.path, "strings.json"), self._strings)
+        _write_json(os.path.join(self.path, "meta.json"),
+                    {"version": VERSION, "top_k": self.top_k, "rows": self.rows, "capacity": self.capacity})
+        self._unflushed = 0
+
+    def flush(self):
+        if not self.readonly:
+            with self._lock:
+                self._flush()
+
+    close = flush
+
+    def column(self, name):
+        # the first `rows` rows of a column, still a memmap (nothing read yet)
+        return self._cols[name][:self.rows]
+
+    def names(self, kind):
+        return list(self._strings[kind])
+
+    def id_of(self, kind, s):
+        return self._ids[kind].get(s, -1)
+
+    def query(self):
+        return Query(self)
+
+    def __len__(self):
+        return self.rows
+
+
+class Query:
+    # a filter over a snapshot of the store (rows written after query() aren't in it)
+    def __init__(self, store, mask=None, rows=None):
+        self.store = store
+        self.rows = store.rows if rows is None else rows
+        self.mask = np.ones(self.rows, dtype=bool) if mask is None else mask
+
+    def _col(self, name):
+        return self.store._cols[name][:self.rows]
+
+    def where(self, model=None, task=None, label=None, min_score=None, max_score=None, since=None, until=None,
+              cached=None):
+        # label / scores are about the top-1 guess. returns a new Query
+        m = self.mask.copy()
+        if model is not None:
+            m &= self._is(self._col("model"), "models", model)
+        if task is not None:
+            m &= self._is(self._col("task"), "tasks", task)
+        if label is not None:
+            m &= self._is(self._col("labels")[:, 0], "labels", label)
+        if min_score is not None:
+            m &= self._col("scores")[:, 0] >= min_score
+        if max_score is not None:
+            m &= self._col("scores")[:, 0] < max_score
+        if since is not None:
+            m &= self._col("ts") >= since
+        if until is not None:
+            m &= self._col("ts") < until
+        if cached is not None:
+            m &= ((self._col("flags") & FLAG_CACHED) != 0) == cached
+        return Query(self.store, m, self.rows)
+
+    def _is(self, col, kind, name):
+        i = self.store.id_of(kind, name)
+        return col == i if i >= 0 else np.zeros(self.rows, dtype=bool)  # never seen -> nothing matches
+
+    def count(self):
+        return int(np.count_nonzero(self.mask))
+
+    def label_histogram(self, top=None):
+        # how often each label was the top-1 guess, most common first
+        ids = self._col("labels")[:, 0][self.mask]
+        counts = np.bincount(ids[ids >= 0], minlength=len(self.store.names("labels")))
+        order = np.argsort(counts)[::-1]
+        names = self.store.names("labels")
+        out = {names[i]: int(counts[i]) for i in order if counts[i]}
+        return dict(list(out.items())[:top]) if top else out
+
+    def label_scores(self, label):
+        # every score that label got (anywhere in the top-k) in the matching rows
+        i = self.store.id_of("labels", label)
+        if i < 0:
+            return np.zeros(0, dtype=np.float32)
+        return self._col("scores")[self.mask][self._col("labels")[self.mask] == i]
+
+    def score_summary(self):
+        return _summary(self._col("scores")[:, 0][self.mask])
+
+    def latency_summary(self):
+        # per model: count, mean, p50 / p95 / p99 of latency_ms (cache hits included, filter them with where)
+        models = self._col("model")[self.mask]
+        lat = self._col("latency_ms")[self.mask]
+        names = self.store.names("models")
+        return {names[i]: _summary(lat[models == i]) for i in np.unique(models)}
+
+    def inputs(self):
+        # distinct input hashes, e.g. to see how many repeats there were
+        return np.unique(self._col("input")[self.mask])
+
+    def rows_as_dicts(self, limit=20):
+        # a few rows for looking at, newest last
+        idx = np.flatnonzero(self.mask)[-limit:]
+        labels, models, tasks = self.store.names("labels"), self.store.names("models"), self.store.names("tasks")
+        out = []
+        for i in idx:
+            out.append({"ts": float(self._col("ts")[i]), "model": models[self._col("model")[i]],
+                        "task": tasks[self._col("task")[i]], "latency_ms": float(self._col("latency_ms")[i]),
+                        "cached": bool(self._col("flags")[i] & FLAG_CACHED),
+                        "top": [(labels[l], round(float(s), 4)) for l, s in
+                                zip(self._col("labels")[i], self._col("scores")[i]) if l >= 0]})
+        return out
+
+
+def _summary(x):
+    x = x[~np.isnan(x)] if x.dtype.kind == "f" else x
+    if not len(x):
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(x, [50, 95, 99])
+    return {"count": int(len(x)), "mean": round(float(x.mean()), 4), "p50": round(float(p50), 4),
+            "p95": round(float(p95), 4), "p99": round(float(p99), 4)}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_store():
+    # one store for the whole app, in HF_PREDICTION_STORE (a folder). None if that isn't set
+    global _default
+    path = os.getenv("HF_PREDICTION_STORE")
+    if not path:
+        return None
+    with _default_lock:
+        if _default is None:
+            import atexit
+            _default = PredictionStore(path)
+            atexit.register(_default.flush)
+        return _default
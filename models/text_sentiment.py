@@ -1,26 +1,129 @@
 
 # TEXT MODEL (sentiment). i just used the sst2 one because everyone does.
+import asyncio, logging
 from typing import Any
 from .base import BaseHFModel, LoggingMixin
+from .chunking import LongText, Vote, approx_spans, batched, fits, iter_windows, tokenizer_spans
 
 class TextSentimentModel(LoggingMixin, BaseHFModel):
     TASK = "text-classification"
+    # stripping text is basically free, so 1 preprocess thread and lots of requests in flight
+    PREPROCESS_WORKERS = 1
+    MAX_IN_FLIGHT = 16
+    # the model only reads MAX_TOKENS (incl. [CLS]/[SEP]), anything longer gets split into
+    # overlapping windows, WINDOW_BATCH of them per request, and the scores averaged by length
+    MAX_TOKENS = 512
+    WINDOW_OVERLAP = 64
+    WINDOW_BATCH = 16
 
-    def __init__(self, model_id="distilbert-base-uncased-finetuned-sst-2-english"):
-        super().__init__(model_id)
+    def __init__(self, model_id="distilbert-base-uncased-finetuned-sst-2-english", backend="hosted"):
+        super().__init__(model_id, backend)
+        self._tokenizer = None  # found in load(), None = count roughly
 
     def _preprocess(self, input_data: Any):
         if not isinstance(input_data, str) or not input_data.strip():
             raise ValueError("pls type some text first")
         txt = input_data.strip()
-        self.log(f"got text len={len(txt)}")
+        self.log("got text len=%d", len(txt))
+        # every token is at least one char, so short ones don't need counting
+        if len(txt) > self.MAX_TOKENS - 2 and not fits(self._spans(txt), self._window_size()):
+            return LongText(txt)
         return txt
 
+    def load(self):
+        super().load()
+        # looked up once per load, never in _preprocess (that's timed, and runs per input)
+        self._tokenizer = self._find_tokenizer()
+
+    def unload(self):
+        super().unload()
+        self._tokenizer = None
+
+    def _find_tokenizer(self):
+        # the model's own tokenizer so windows are exact. a local pipeline already has it,
+        # otherwise only one that's already on disk: the hosted backend never downloads model
+        # files just for this. nothing there / no transformers -> count roughly instead
+        tok = getattr(getattr(self._client, "_pipe", None), "tokenizer", None)
+        if tok is None:
+            try:
+                from huggingface_hub import try_to_load_from_cache
+                if not isinstance(try_to_load_from_cache(self._model_id, "tokenizer.json"), str):
+                    return None  # not cached, don't even import transformers
+                from transformers import AutoTokenizer
+                tok = AutoTokenizer.from_pretrained(self._model_id, local_files_only=True)
+            except Exception as e:
+                self.log("no tokenizer (%s), guessing token counts", e, level=logging.INFO)
+                return None
+        # offsets need a "fast" (rust) tokenizer
+        return tok if getattr(tok, "is_fast", False) else None
+
+    def _window_size(self):
+        # the rough count can be off, so leave it some room
+        n = self.MAX_TOKENS - 2
+        return n if self._tokenizer else n * 3 // 4
+
+    def _spans(self, text):
+        tok = self._tokenizer
+        return tokenizer_spans(tok, text) if tok else approx_spans(text)
+
+    def _windows(self, text):
+        return iter_windows(text, self._spans(text), self._window_size(), self.WINDOW_OVERLAP)
+
     def _predict(self, processed):
-        # hosted api call, no downloads (yay)
+        if isinstance(processed, LongText):
+            return self._predict_long(processed)
+        # hosted api call by default, or a local pipeline if backend="local"
         self.log("sending to hf (text-classification) ...")
         return self._client.text_classification(processed)
 
+    def _predict_long(self, text):
+        # windows are made as we go, so a huge document is never all in flight at once
+        vote = Vote()
+        for chunk in batched(self._windows(text), self.WINDOW_BATCH):
+            raws = self._predict_short_many([w for w, _ in chunk])
+            for (_, weight), raw in zip(chunk, raws):
+                if isinstance(raw, Exception):
+                    raise raw
+                vote.add(weight, raw)
+        self.log("long text: %d windows", vote.windows)
+        return vote.result()
+
+    def _predict_many(self, processed_list):
+        out = [None] * len(processed_list)
+        short = [i for i, p in enumerate(processed_list) if not isinstance(p, LongText)]
+        for i, p in enumerate(processed_list):
+            if isinstance(p, LongText):
+                try:
+                    out[i] = self._predict_long(p)
+                except Exception as e:
+                    out[i] = e
+        if short:
+            for i, raw in zip(short, self._predict_short_many([processed_list[i] for i in short])):
+                out[i] = raw
+        return out
+
+    def _predict_short_many(self, texts):
+        # local pipelines can do one batched forward pass, the hosted api can't
+        batch = getattr(self._client, "text_classification_batch", None)
+        if batch is None:
+            return super()._predict_many(texts)
+        return batch(texts)
+
+    async def _apredict(self, processed):
+        if isinstance(processed, LongText):
+            return await self._apredict_long(processed)
+        self.log("sending to hf async (text-classification) ...")
+        return await self._get_aclient().text_classification(processed)
+
+    async def _apredict_long(self, text):
+        client = self._get_aclient()
+        vote = Vote()
+        for chunk in batched(self._windows(text), self.WINDOW_BATCH):
+            raws = await asyncio.gather(*(client.text_classification(w) for w, _ in chunk))
+            for (_, weight), raw in zip(chunk, raws):
+                vote.add(weight, raw)
+        return vote.result()
+
     def _postprocess(self, raw):
         if not raw:
             return "no idea sorry"
@@ -0,0 +1,146 @@
+# one shared http connection pool for every hosted model. keep-alive means only the very
+# first request pays for dns + tls + tcp; after that everyone reuses warm connections.
+# also: a warm-up request at load time, and optional "hedged" requests (if a call is slower
+# than the usual p95, fire a second copy and take whichever answers first).
+from __future__ import annotations
+import logging, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait, FIRST_COMPLETED
+
+from .limiter import shared_limiter
+
+_logger = logging.getLogger("hit137")
+
+DEFAULT_ENDPOINT = "https://api-inference.huggingface.co"
+
+def endpoint() -> str:
+    # same env var huggingface_hub reads, so a local stand-in server can replace the real api
+    return os.getenv("HF_INFERENCE_ENDPOINT", DEFAULT_ENDPOINT).rstrip("/")
+
+def model_url(model_id: str) -> str:
+    return f"{endpoint()}/models/{model_id}"
+
+
+class SharedTransport:
+    def __init__(self, max_per_host: int = 32, max_hosts: int = 4):
+        self.max_per_host = max_per_host
+        self.max_hosts = max_hosts
+        self._session = None
+        self._installed = False
+        self._lock = threading.Lock()
+        self.warmups = {}  # url -> ms it took (first connection, so dns + tls included)
+
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                s = requests.Session()
+                # pool_block: if all max_per_host connections are busy, wait for one
+                # instead of opening (and then throwing away) an extra one
+                adapter = HTTPAdapter(pool_connections=self.max_hosts, pool_maxsize=self.max_per_host, pool_block=True)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                self._session = s
+            return self._session
+
+    def install(self):
+        # point huggingface_hub at our session. only once, it's global anyway
+        with self._lock:
+            if self._installed:
+                return
+            self._installed = True
+        import huggingface_hub
+        configure = getattr(huggingface_hub, "configure_http_backend", None)
+        if configure is None:
+            # newer hub versions (httpx) pool connections on their own
+            _logger.info("this huggingface_hub has no configure_http_backend, using its own pool")
+            return
+        configure(backend_factory=self.session)  # every thread gets the same pooled session
+
+    def warm_up(self, url: str, token: str = None, timeout: float = 10.0):
+        # any response is fine, the point is to get a connection open before the user clicks
+        t0 = time.perf_counter()
+        try:
+            headers = {"Authorization": f"Bearer {token}"} if token else {}
+            self.session().get(url, headers=headers, timeout=timeout).close()
+        except Exception as e:
+            _logger.info("warm-up of %s failed (%s), first request will be slow", url, e)
+            return None
+        ms = (time.perf_counter() - t0) * 1000
+        self.warmups[url] = round(ms, 2)
+        return ms
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def shared_transport() -> SharedTransport:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SharedTransport(max_per_host=int(os.getenv("HF_POOL_SIZE", "32")))
+        return _shared
+
+
+class Hedger:
+    # only for idempotent calls (classifying the same thing twice is harmless, just costs a request).
+    # the copy goes through the same limiter as everything else, so when that's full (slots all
+    # taken, or calls already queued) it would only wait in line and add load right when the api
+    # is slow. then we don't send it
+    def __init__(self, min_delay_ms: float = 20.0, default_delay_ms: float = 1000.0,
+                 max_ratio: float = 0.1, workers: int = 32, limiter="shared"):
+        self.min_delay_ms = min_delay_ms
+        self.default_delay_ms = default_delay_ms  # until we have a p95 to go on
+        self.max_ratio = max_ratio  # at most this share of calls get a second copy
+        self.limiter = limiter  # "shared" = shared_limiter() at call time, None = never too busy
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped_busy = 0
+
+    def call(self, fn, *args, delay_ms: float = None):
+        delay = max(self.min_delay_ms, delay_ms or self.default_delay_ms) / 1000
+        with self._lock:
+            self.calls += 1
+            allowed = self.hedged < self.max_ratio * self.calls
+        first = self._pool.submit(fn, *args)
+        if not allowed:
+            return first.result()
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        limiter = shared_limiter() if self.limiter == "shared" else self.limiter
+        if limiter is not None and limiter.busy():
+            with self._lock:
+                self.skipped_busy += 1
+            return first.result()
+        second = self._pool.submit(fn, *args)
+        with self._lock:
+            self.hedged += 1
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    if fut is second:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return fut.result()
+        return first.result()  # both failed, raise the original error
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "hedged": self.hedged, "hedge_wins": self.hedge_wins,
+                    "skipped_busy": self.skipped_busy}
+
+    def close(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,223 @@
+# small local inference server. several clients share one set of loaded models, and
+# requests for the same model that arrive at about the same time get micro-batched into
+# one call (a real batched forward pass on the local pipelines).
+#
+#   python server.py --port 8137 --max-batch 16 --max-wait-ms 10 --preload sentiment-local
+#   curl -s localhost:8137/models
+#   curl -s -X POST localhost:8137/predict/sentiment-local -d '{"text": "i loved it"}'
+#   curl -s -X POST localhost:8137/predict/sentiment-local -d '{"inputs": ["good", "bad"]}'
+#   curl -s -X POST localhost:8137/predict/image-local --data-binary @cat.jpg -H "Content-Type: image/jpeg"
+#   curl -s localhost:8137/metrics      # prometheus text
+#   curl -s localhost:8137/stats        # batch sizes, queue depth
+import argparse, asyncio, base64, binascii, json, os
+from concurrent.futures import ThreadPoolExecutor
+
+from models import metrics, registry
+from models.batching import MicroBatcher
+
+MAX_BODY = 32 * 1024 * 1024  # 32MB is plenty for a photo
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, msg):
+        super().__init__(msg)
+        self.status = status
+
+
+class ModelHost:
+    # one loaded model + the batcher in front of it
+    def __init__(self, name, backend, max_batch, max_wait_ms):
+        self.spec = registry.get_spec(name)
+        self.model = registry.create_model(name, backend=backend)
+        self.model.load()
+        # pictures only ever come as bytes: a string would be a path on *this* machine
+        self.images = self.model.TASK.startswith("image")
+        self.batcher = MicroBatcher(self.model.run_processed_batch, max_batch, max_wait_ms,
+                                    name=f"batch-{self.spec['key']}")
+
+    async def predict(self, x, pre_pool):
+        loop = asyncio.get_running_loop()
+        try:
+            if self.model.PREPROCESS_IN_EXECUTOR:
+                stuff = await loop.run_in_executor(pre_pool, self.model.prepare, x)
+            else:
+                stuff = self.model.prepare(x)
+        except OSError as e:  # not a picture pil can open (UnidentifiedImageError is one)
+            raise HttpError(400, f"couldn't read the input: {type(e).__name__}")
+        return await asyncio.wrap_future(self.batcher.submit(stuff))
+
+
+class InferenceServer:
+    def __init__(self, backend=None, max_batch=16, max_wait_ms=10.0):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.hosts = {}  # registry key -> ModelHost
+        self._loading = {}  # key -> asyncio.Task, so two clients don't load the same model
+        self.pre_pool = ThreadPoolExecutor(min(8, os.cpu_count() or 1), thread_name_prefix="srv-pre")
+
+    async def host(self, name):
+        key = registry.get_spec(name)["key"]  # KeyError -> 404
+        if key in self.hosts:
+            return self.hosts[key]
+        task = self._loading.get(key)
+        if task is None:
+            loop = asyncio.get_running_loop()
+            # loading can take ages (downloads), keep it off the event loop
+            task = self._loading[key] = asyncio.ensure_future(loop.run_in_executor(
+                None, ModelHost, key, self.backend, self.max_batch, self.max_wait_ms))
+        try:
+            self.hosts[key] = await task
+        finally:
+            self._loading.pop(key, None)
+        return self.hosts[key]
+
+    # --- routes ---
+    async def route(self, method, path, headers, body):
+        if path == "/healthz":
+            return 200, {"ok": True, "loaded": sorted(self.hosts)}
+        if path == "/models":
+            return 200, [{"name": n, **{k: v for k, v in registry.get_spec(n).items() if k != "path"}}
+                         for n in registry.get_model_names()]
+        if path == "/stats":
+            return 200, {k: h.batcher.stats() for k, h in self.hosts.items()}
+        if path == "/metrics":
+            return 200, metrics.snapshot("prometheus")
+        if path.startswith("/predict/"):
+            if method != "POST":
+                raise HttpError(405, "use POST")
+            try:
+                host = await self.host(path[len("/predict/"):])
+            except KeyError as e:
+                raise HttpError(404, e.args[0])
+            return 200, await self._predict(host, headers, body)
+        raise HttpError(404, f"nothing at {path}")
+
+    async def _predict(self, host, headers, body):
+        if headers.get("content-type", "").startswith("image/"):
+            if not host.images:
+                raise HttpError(400, "this model takes text, not a picture")
+            return await host.predict(body, self.pre_pool)
+        try:
+            req = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "body should be json (or an image with an image/* content type)")
+        if isinstance(req, dict) and "inputs" in req:
+            xs = [self._one_input(x, host.images) for x in req["inputs"]]
+            res = await asyncio.gather(*(host.predict(x, self.pre_pool) for x in xs), return_exceptions=True)
+            return [host.model._error_result(r) if isinstance(r, Exception) else r for r in res]
+        return await host.predict(self._one_input(req, host.images), self.pre_pool)
+
+    @staticmethod
+    def _one_input(x, images=False):
+        if images:
+            # never a string: the image model would open it as a file on the server
+            if isinstance(x, dict) and isinstance(x.get("image_b64"), str):
+                try:
+                    return base64.b64decode(x["image_b64"], validate=True)
+                except binascii.Error:
+                    raise HttpError(400, "image_b64 isn't valid base64")
+            raise HttpError(400, 'image models take the picture as the body (image/* content type) or {"image_b64": ...}')
+        if isinstance(x, str):
+            return x
+        if isinstance(x, dict) and isinstance(x.get("text"), str):
+            return x["text"]
+        raise HttpError(400, 'each input should be a string or {"text": ...}')
+
+    # --- bare-bones http/1.1 (keep-alive, content-length bodies only) ---
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                try:
+                    method, target, _ = line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    await self._send(writer, 400, {"error": "bad request line"}, close=True)
+                    break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                try:
+                    n = int(headers.get("content-length") or 0)
+                except ValueError:
+                    n = -1
+                if n < 0:
+                    await self._send(writer, 400, {"error": "bad content-length"}, close=True)
+                    break
+                if n > MAX_BODY:
+                    await self._send(writer, 413, {"error": "body too big"}, close=True)
+                    break
+                body = await reader.readexactly(n) if n else b""
+                close = headers.get("connection", "").lower() == "close"
+                try:
+                    status, payload = await self.route(method.upper(), target.split("?", 1)[0], headers, body)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except ValueError as e:  # bad input (empty text, not an image...)
+                    status, payload = 400, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                await self._send(writer, status, payload, close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, payload, close=False):
+        if isinstance(payload, str):
+            data, ctype = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            data, ctype = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {ctype}\r\nContent-Length: {len(data)}\r\n"
+                f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    def close(self):
+        for h in self.hosts.values():
+            h.batcher.close()
+        self.pre_pool.shutdown(wait=False)
+
+
+async def serve(host="127.0.0.1", port=8137, preload=(), **kw):
+    srv = InferenceServer(**kw)
+    for name in preload:
+        await srv.host(name)
+    server = await asyncio.start_server(srv.handle, host, port)
+    print(f"serving on http://{host}:{port} (ctrl-c to stop)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        srv.close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="local inference server with micro-batching")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8137)
+    ap.add_argument("--backend", help="force every model onto this backend (hosted / local)")
+    ap.add_argument("--max-batch", type=int, default=16)
+    ap.add_argument("--max-wait-ms", type=float, default=10.0, help="how long to hold a batch open")
+    ap.add_argument("--preload", action="append", default=[], help="registry key to load at startup (repeatable)")
+    args = ap.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.preload, backend=args.backend,
+                          max_batch=args.max_batch, max_wait_ms=args.max_wait_ms))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()